@@ -0,0 +1,78 @@
+"""Compare the storage size of packed geometries against xyz text
+
+Reads every species and TS geometry from the database configured in the environment
+(see the README), and reports the size of the packed geometries against the size of
+the same geometries as xyz strings, along with the time it takes to render and parse
+each format.
+
+Usage:
+    python benchmarks/bench_geometry_storage.py
+"""
+
+import time
+
+from flame_data import geometry
+from flame_data._pool import pg_connection, pg_cursor
+
+
+def geometry_column_sizes(table_name: str) -> dict:
+    """Measure the geometries in one table
+
+    :param table_name: The table name, "species" or "reaction_ts"
+    :type table_name: str
+    :return: The measurements; keys: "count", "packed_bytes", "stored_bytes",
+        "xyz_bytes", "render_seconds", "parse_seconds", "unpack_seconds"
+    :rtype: dict
+    """
+    query_string = f"""
+        SELECT geometry, pg_column_size(geometry) AS stored_size FROM {table_name}
+        WHERE geometry IS NOT NULL;
+    """
+
+    with pg_connection() as conn:
+        with pg_cursor(conn) as cursor:
+            cursor.execute(query_string)
+            rows = cursor.fetchall()
+
+    geo_datas = [r["geometry"] for r in rows]
+
+    start = time.perf_counter()
+    xyz_strs = list(map(geometry.xyz_string, geo_datas))
+    render_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    list(map(geometry.from_xyz_string, xyz_strs))
+    parse_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    list(map(geometry.coordinates, geo_datas))
+    unpack_seconds = time.perf_counter() - start
+
+    return {
+        "count": len(rows),
+        "packed_bytes": sum(map(len, geo_datas)),
+        "stored_bytes": sum(r["stored_size"] for r in rows),
+        "xyz_bytes": sum(len(s.encode("utf-8")) for s in xyz_strs),
+        "render_seconds": render_seconds,
+        "parse_seconds": parse_seconds,
+        "unpack_seconds": unpack_seconds,
+    }
+
+
+def main():
+    for table_name in ("species", "reaction_ts"):
+        res = geometry_column_sizes(table_name)
+        ratio = res["packed_bytes"] / res["xyz_bytes"] if res["xyz_bytes"] else 0.0
+        print(f"{table_name}: {res['count']} geometries")
+        print(f"  xyz text:     {res['xyz_bytes']:>12,d} bytes")
+        print(
+            f"  packed:       {res['packed_bytes']:>12,d} bytes ({ratio:.0%} of text)"
+        )
+        print(f"  stored:       {res['stored_bytes']:>12,d} bytes (pg_column_size)")
+        print(f"  render xyz:   {res['render_seconds'] * 1e3:>12.1f} ms")
+        print(f"  parse xyz:    {res['parse_seconds'] * 1e3:>12.1f} ms")
+        print(f"  unpack coords:{res['unpack_seconds'] * 1e3:>12.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
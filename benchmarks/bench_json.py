@@ -0,0 +1,152 @@
+"""Benchmark JSON encoding of collection download payloads
+
+Compares the standard library encoder, called the way Flask's default JSON provider
+calls it, against orjson, called the way `flame_data._json.JSONProvider` calls it.
+
+Usage:
+    python benchmarks/bench_json.py [--sizes 100 1000 5000] [--repeat 5]
+"""
+
+import argparse
+import json
+import random
+import time
+import tracemalloc
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SYMBOLS = ("C", "H", "O", "N")
+
+
+def xyz_string(natms: int) -> str:
+    """Generate a random xyz string, formatted like the ones stored in the database
+
+    :param natms: The number of atoms
+    :type natms: int
+    :return: The xyz string
+    :rtype: str
+    """
+    lines = [str(natms), ""]
+    for _ in range(natms):
+        symb = random.choice(SYMBOLS)
+        xyz = [random.uniform(-5.0, 5.0) for _ in range(3)]
+        lines.append(f"{symb:2s} {xyz[0]:10.6f} {xyz[1]:10.6f} {xyz[2]:10.6f}")
+    return "\n".join(lines)
+
+
+def collection_payload(nspcs: int) -> dict:
+    """Generate a payload shaped like a `GET /api/collection/<id>` response
+
+    :param nspcs: The number of species; there will be half as many reactions, with
+        one or two transition states each
+    :type nspcs: int
+    :return: The payload
+    :rtype: dict
+    """
+    species = [
+        {
+            "formula": f"C{i % 9 + 1}H{2 * (i % 9) + 4}O",
+            "conn_smiles": "C" * (i % 9 + 1) + "O",
+            "spin_mult": 1 + i % 2,
+            "smiles": "C" * (i % 9 + 1) + "O",
+            "inchi": f"InChI=1S/C{i % 9 + 1}H{2 * (i % 9) + 4}O/c1-2-3/h3H,2H2,1H3",
+            "amchi": f"AMChI=1/C{i % 9 + 1}H{2 * (i % 9) + 4}O/c1-2-3/h3H,2H2,1H3",
+            "geometry": xyz_string(random.randint(8, 30)),
+        }
+        for i in range(nspcs)
+    ]
+    reactions = [
+        {
+            "formula": f"C{i % 9 + 1}H{2 * (i % 9) + 5}O2",
+            "conn_smiles": "CCO.[OH]>>C[CH]O.O",
+            "smiles": "CCO.[OH]>>C[CH]O.O",
+            "spin_mult": 2,
+            "r_spin_mults": [1, 2],
+            "p_spin_mults": [2, 1],
+            "r_inchis": ["InChI=1S/C2H6O/c1-2-3/h3H,2H2,1H3", "InChI=1S/HO/h1H"],
+            "p_inchis": ["InChI=1S/C2H5O/c1-2-3/h2-3H,1H3", "InChI=1S/H2O/h1H2"],
+            "r_amchis": ["AMChI=1/C2H6O/c1-2-3/h3H,2H2,1H3", "AMChI=1/HO/h1H"],
+            "p_amchis": ["AMChI=1/C2H5O/c1-2-3/h2-3H,1H3", "AMChI=1/H2O/h1H2"],
+            "transition_states": [
+                {
+                    "geometry": xyz_string(random.randint(10, 35)),
+                    "class": "hydrogen abstraction",
+                    "amchi": "AMChI=1/C2H7O2/c1-2-4-3/h2,4H,1H3/t2-/m0/s1",
+                }
+                for _ in range(random.randint(1, 2))
+            ],
+        }
+        for i in range(nspcs // 2)
+    ]
+    return {
+        "contents": {"name": "Benchmark", "species": species, "reactions": reactions}
+    }
+
+
+def encode_stdlib(obj) -> bytes:
+    """Encode the way Flask's default provider does for a production response"""
+    return (
+        json.dumps(obj, ensure_ascii=True, sort_keys=True, separators=(",", ":")) + "\n"
+    ).encode()
+
+
+def encode_orjson(obj) -> bytes:
+    """Encode the way `flame_data._json.JSONProvider` does for a production response"""
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE
+    return orjson.dumps(obj, option=option)
+
+
+def measure(encode, obj, repeat: int) -> dict:
+    """Measure the encode time and peak memory for one encoder
+
+    :param encode: The encoder function
+    :param obj: The data to encode
+    :param repeat: The number of timing repetitions; the best is reported
+    :type repeat: int
+    :return: The measurements; keys: "seconds", "peak_bytes", "size_bytes"
+    :rtype: dict
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data = encode(obj)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    encode(obj)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"seconds": min(times), "peak_bytes": peak, "size_bytes": len(data)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(0)
+    encoders = {"stdlib": encode_stdlib}
+    if orjson is not None:
+        encoders["orjson"] = encode_orjson
+    else:
+        print("orjson is not installed; only benchmarking the stdlib encoder")
+
+    cols = ("species", "encoder", "size (MB)", "time (ms)", "peak (MB)")
+    print(" ".join(f"{c:>10}" for c in cols))
+    for nspcs in args.sizes:
+        obj = collection_payload(nspcs)
+        for name, encode in encoders.items():
+            res = measure(encode, obj, args.repeat)
+            print(
+                f"{nspcs:>10} {name:>10} {res['size_bytes'] / 1e6:>10.2f} "
+                f"{res['seconds'] * 1e3:>10.1f} {res['peak_bytes'] / 1e6:>10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
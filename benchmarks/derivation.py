@@ -0,0 +1,131 @@
+"""Count the automol calls made by the chem row builders for each submission
+
+Runs the builders that a species or reaction submission runs, once with a separate
+SMILES string for each builder and once with a shared derivation
+(`chem.SpeciesDerivation`, `chem.ReactionDerivation`), and compares the number of
+calls into automol and the time taken. Only calls that the chem module makes are
+counted, not the ones automol makes internally. No database is needed.
+
+Usage:
+    python benchmarks/derivation.py [--size 10] [--geometries]
+"""
+
+import argparse
+import collections
+import functools
+import os
+import time
+
+from suite import synthetic_reactions, synthetic_species
+
+AUTOMOL_MODULES = (
+    "amchi",
+    "geom",
+    "graph",
+    "inchi",
+    "inchi_key",
+    "mult.ts",
+    "reac",
+    "smiles",
+)
+
+
+def count_automol_calls(counter: collections.Counter):
+    """Wrap the functions of the automol modules used by chem, to count their calls
+
+    :param counter: The counter to record calls in, by function name
+    :type counter: collections.Counter
+    """
+    import automol
+
+    def _counted(name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            counter[name] += 1
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    for mod_name in AUTOMOL_MODULES:
+        mod = functools.reduce(getattr, mod_name.split("."), automol)
+        for attr, func in list(vars(mod).items()):
+            if (
+                callable(func)
+                and not attr.startswith("_")
+                and not isinstance(func, type)
+            ):
+                setattr(mod, attr, _counted(f"{mod_name}.{attr}", func))
+
+
+def submit_species(chem, smi, shared: bool, geometries: bool):
+    """Run the builders for a species submission, as `query` does"""
+    spc = chem.SpeciesDerivation(smi) if shared else smi
+    hash_key = (
+        spc.conn_inchi_hash if shared else chem.species_connectivity_chi_hash(smi)
+    )
+    chem.species_connectivity_row(spc)
+    chem.species_estate_row(spc)
+    chem.species_rows(spc, geometries=geometries)
+    return hash_key
+
+
+def submit_reaction(chem, smi, shared: bool, geometries: bool):
+    """Run the builders for a reaction submission, as `query` does"""
+    rxn = chem.ReactionDerivation(smi) if shared else smi
+    hash_keys = (
+        rxn.reagent_inchi_hashes
+        if shared
+        else chem.reaction_connectivity_chi_hashes(smi)[0]
+    )
+    chem.reaction_connectivity_row(rxn)
+    chem.reaction_estate_row(rxn)
+    chem.reaction_and_ts_rows(rxn, geometries=geometries)
+    return hash_keys
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=10, help="Species to submit")
+    parser.add_argument(
+        "--geometries",
+        action="store_true",
+        help="Also generate geometries, which dominate the time but aren't shared",
+    )
+    args = parser.parse_args()
+
+    # Importing flame_data sets up the app, which needs this
+    os.environ.setdefault("STATIC_FOLDER", os.path.join("flame-data-frontend", "dist"))
+    from flame_data import chem
+
+    counter = collections.Counter()
+    count_automol_calls(counter)
+
+    spc_smis = synthetic_species(args.size)
+    rxn_smis = synthetic_reactions(max(args.size // 2, 1))
+
+    results = {}
+    for shared in (False, True):
+        counter.clear()
+        start = time.perf_counter()
+        for smi in spc_smis:
+            submit_species(chem, smi, shared, args.geometries)
+        for smi in rxn_smis:
+            submit_reaction(chem, smi, shared, args.geometries)
+        seconds = time.perf_counter() - start
+        results[shared] = (seconds, collections.Counter(counter))
+
+    (base_secs, base_calls), (shared_secs, shared_calls) = results[False], results[True]
+    print(f"{'automol function':<40}{'separate':>10}{'shared':>10}")
+    for name in sorted(base_calls, key=lambda n: -base_calls[n]):
+        if base_calls[name] != shared_calls[name]:
+            print(f"{name:<40}{base_calls[name]:>10d}{shared_calls[name]:>10d}")
+    base_total, shared_total = sum(base_calls.values()), sum(shared_calls.values())
+    print(f"{'total':<40}{base_total:>10d}{shared_total:>10d}")
+    print(
+        f"{'time (s)':<40}{base_secs:>10.2f}{shared_secs:>10.2f}"
+        f"  ({1 - shared_total / base_total:.0%} fewer calls)"
+    )
+
+
+if __name__ == "__main__":
+    main()
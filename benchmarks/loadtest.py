@@ -0,0 +1,346 @@
+"""Replay a realistic mix of API traffic against a running server
+
+Each simulated user registers a fresh account, then repeatedly picks a scenario from
+the configured mix, until the time is up. Only the standard library is used, so this can
+run anywhere the server and its database can.
+
+Scenarios:
+    - login: `POST /api/login`
+    - search: `GET /api/species/connectivity` or `/api/reaction/connectivity` with a
+      (sometimes partial) formula
+    - detail: `GET /api/species/connectivity/<id>` or `/api/reaction/connectivity/<id>`
+    - collection: `GET /api/collection`
+    - export: `GET /api/collection/<id>` or `/api/collection/<id>/npz`
+    - submit: `POST /api/species/connectivity` or `/api/reaction/connectivity`, mostly
+      with species and reactions that already exist
+
+Usage:
+    python benchmarks/loadtest.py [--url http://127.0.0.1:5000] [--users 8]
+        [--duration 60] [--mix search=40,detail=30,collection=10,export=10,submit=5,login=5]
+        [--seed-catalog 30] [--serve "gunicorn -b 127.0.0.1:5000 flame_data:app"]
+        [--etags] [--output results.json]
+"""
+
+import argparse
+import collections
+import gzip
+import http.cookiejar
+import json
+import math
+import random
+import shlex
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+from suite import synthetic_reactions, synthetic_species
+
+DEFAULT_MIX = "search=40,detail=30,collection=10,export=10,submit=5,login=5"
+SEARCH_FORMULAS = ("CH4O", "C2H6O", "C3H8", "C4H10", "C2", "C3", "C4", "H2O", "O")
+
+
+class Client:
+    """An HTTP client with its own session cookies"""
+
+    def __init__(self, base_url: str, use_etags: bool = False):
+        self.base_url = base_url.rstrip("/")
+        self.use_etags = use_etags
+        self.etags = {}
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+
+    def request(self, method: str, path: str, body: dict = None):
+        """Send a request
+
+        :param method: The HTTP method
+        :type method: str
+        :param path: The path, including any query string
+        :type path: str
+        :param body: A JSON body, defaults to None
+        :type body: dict, optional
+        :return: The status code and the response body
+        :rtype: Tuple[int, bytes]
+        """
+        url = self.base_url + path
+        data = None
+        headers = {"Accept-Encoding": "gzip"}
+        if body is not None:
+            data = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        if self.use_etags and method == "GET" and url in self.etags:
+            headers["If-None-Match"] = self.etags[url]
+
+        req = urllib.request.Request(url, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(req) as resp:
+                status, content = resp.status, resp.read()
+                etag = resp.headers.get("ETag")
+                if resp.headers.get("Content-Encoding") == "gzip":
+                    content = gzip.decompress(content)
+        except urllib.error.HTTPError as err:
+            status, content, etag = err.code, err.read(), None
+
+        if etag is not None:
+            self.etags[url] = etag
+        return status, content
+
+
+class Recorder:
+    """Thread-safe record of request latencies and outcomes, by route"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+
+    def timed(self, client: Client, route: str, method: str, path: str, body=None):
+        """Send a request through a client, and record it under a route name"""
+        start = time.perf_counter()
+        try:
+            status, content = client.request(method, path, body)
+        except OSError:
+            status, content = None, b""
+        latency = time.perf_counter() - start
+
+        with self.lock:
+            self.latencies[route].append(latency)
+            if status is None or status >= 400:
+                self.errors[route] += 1
+        return status, content
+
+    def summary(self, elapsed: float) -> dict:
+        """Summarize the results for each route
+
+        :param elapsed: The wall time of the run, in seconds
+        :type elapsed: float
+        :return: The summaries, keyed by route; keys: "count", "errors",
+            "error_rate", "throughput", "p50_ms", "p95_ms", "p99_ms", "max_ms"
+        :rtype: dict
+        """
+        summaries = {}
+        for route, lats in sorted(self.latencies.items()):
+            lats = sorted(lats)
+            summaries[route] = {
+                "count": len(lats),
+                "errors": self.errors[route],
+                "error_rate": self.errors[route] / len(lats),
+                "throughput": len(lats) / elapsed,
+                "p50_ms": percentile(lats, 50) * 1e3,
+                "p95_ms": percentile(lats, 95) * 1e3,
+                "p99_ms": percentile(lats, 99) * 1e3,
+                "max_ms": lats[-1] * 1e3,
+            }
+        return summaries
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    """Get a percentile of sorted values, by the nearest-rank method"""
+    rank = math.ceil(pct / 100 * len(sorted_values))
+    return sorted_values[max(rank - 1, 0)]
+
+
+# SCENARIOS
+class Catalog:
+    """What the users know about the server's data, discovered during setup"""
+
+    def __init__(self, client: Client):
+        status, content = client.request("GET", "/api/species/connectivity")
+        spc_rows = json.loads(content)["contents"] if status == 200 else []
+        status, content = client.request("GET", "/api/reaction/connectivity")
+        rxn_rows = json.loads(content)["contents"] if status == 200 else []
+        self.species_ids = [r["id"] for r in spc_rows]
+        self.reaction_ids = [r["id"] for r in rxn_rows]
+        self.species_smiles = [r["conn_smiles"] for r in spc_rows]
+        self.reaction_smiles = [r["conn_smiles"] for r in rxn_rows]
+
+
+class User:
+    """A simulated user, running scenarios"""
+
+    def __init__(self, base_url, recorder, catalog, rng, use_etags=False):
+        self.client = Client(base_url, use_etags=use_etags)
+        self.recorder = recorder
+        self.catalog = catalog
+        self.rng = rng
+        self.email = f"loadtest-{uuid.uuid4().hex[:12]}@example.com"
+        self.password = "loadtest"
+        self.coll_id = None
+
+        body = {"email": self.email, "password": self.password}
+        recorder.timed(self.client, "POST /api/register", "POST", "/api/register", body)
+        status, content = self.client.request("GET", "/api/collection")
+        if status == 200:
+            colls = json.loads(content)["contents"]
+            self.coll_id = colls[0]["id"] if colls else None
+
+    def login(self):
+        body = {"email": self.email, "password": self.password}
+        self.recorder.timed(self.client, "POST /api/login", "POST", "/api/login", body)
+
+    def search(self):
+        kind = self.rng.choice(("species", "reaction"))
+        fml = self.rng.choice(SEARCH_FORMULAS)
+        params = {"formula": fml}
+        if self.rng.random() < 0.5:
+            params["partial"] = ""
+        path = f"/api/{kind}/connectivity?{urllib.parse.urlencode(params)}"
+        self.recorder.timed(self.client, f"GET /api/{kind}/connectivity", "GET", path)
+
+    def detail(self):
+        kind = self.rng.choice(("species", "reaction"))
+        ids = getattr(self.catalog, f"{kind}_ids")
+        if not ids:
+            return
+        path = f"/api/{kind}/connectivity/{self.rng.choice(ids)}"
+        route = f"GET /api/{kind}/connectivity/<id>"
+        self.recorder.timed(self.client, route, "GET", path)
+
+    def collection(self):
+        self.recorder.timed(
+            self.client, "GET /api/collection", "GET", "/api/collection"
+        )
+
+    def export(self):
+        if self.coll_id is None:
+            return
+        if self.rng.random() < 0.8:
+            path, route = f"/api/collection/{self.coll_id}", "GET /api/collection/<id>"
+        else:
+            path = f"/api/collection/{self.coll_id}/npz"
+            route = "GET /api/collection/<id>/npz"
+        self.recorder.timed(self.client, route, "GET", path)
+
+    def submit(self):
+        kind = self.rng.choice(("species", "reaction"))
+        smis = getattr(self.catalog, f"{kind}_smiles")
+        if not smis:
+            return
+        body = {"smiles": self.rng.choice(smis)}
+        path = f"/api/{kind}/connectivity"
+        self.recorder.timed(self.client, f"POST {path}", "POST", path, body)
+
+
+def parse_mix(mix_str: str) -> dict:
+    """Parse a scenario mix, like "search=40,detail=30"
+
+    :param mix_str: The mix string
+    :type mix_str: str
+    :return: The weights, keyed by scenario name
+    :rtype: dict
+    """
+    mix = {}
+    for item in mix_str.split(","):
+        name, weight = item.split("=")
+        name = name.strip()
+        if not hasattr(User, name):
+            raise ValueError(f"Unknown scenario: {name}")
+        mix[name] = float(weight)
+    return mix
+
+
+def run_user(user: User, mix: dict, deadline: float):
+    """Run scenarios for one user until the deadline"""
+    names, weights = zip(*mix.items())
+    while time.perf_counter() < deadline:
+        getattr(user, user.rng.choices(names, weights)[0])()
+
+
+# SETUP
+def wait_for_server(base_url: str, timeout: float = 30.0):
+    """Wait for a server to start accepting requests"""
+    client = Client(base_url)
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            client.request("GET", "/api/@me")
+            return
+        except OSError:
+            time.sleep(0.25)
+    raise TimeoutError(f"Server at {base_url} did not start within {timeout} s")
+
+
+def seed_catalog(base_url: str, size: int):
+    """Submit a synthetic catalog through the API, if it isn't there already"""
+    client = Client(base_url)
+    body = {"email": f"loadtest-seed-{uuid.uuid4().hex[:12]}@example.com"}
+    body["password"] = "loadtest"
+    client.request("POST", "/api/register", body)
+    for smi in synthetic_species(size):
+        client.request("POST", "/api/species/connectivity", {"smiles": smi})
+    for smi in synthetic_reactions(max(size // 2, 1)):
+        client.request("POST", "/api/reaction/connectivity", {"smiles": smi})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument(
+        "--seed-catalog",
+        type=int,
+        default=0,
+        help="Submit a synthetic catalog of this many species before starting",
+    )
+    parser.add_argument("--serve", help="A command to start the server with")
+    parser.add_argument(
+        "--etags", action="store_true", help="Send If-None-Match, like a browser"
+    )
+    parser.add_argument("--output", help="Save the results to this JSON file")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    server = subprocess.Popen(shlex.split(args.serve)) if args.serve else None
+    try:
+        wait_for_server(args.url)
+        if args.seed_catalog:
+            seed_catalog(args.url, args.seed_catalog)
+
+        catalog = Catalog(Client(args.url))
+        recorder = Recorder()
+        users = [
+            User(args.url, recorder, catalog, random.Random(args.seed + i), args.etags)
+            for i in range(args.users)
+        ]
+
+        start = time.perf_counter()
+        deadline = start + args.duration
+        threads = [
+            threading.Thread(target=run_user, args=(user, mix, deadline))
+            for user in users
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    summary = recorder.summary(elapsed)
+    cols = ("count", "err %", "req/s", "p50 ms", "p95 ms", "p99 ms")
+    print(f"{'route':<40}" + "".join(f"{c:>9}" for c in cols))
+    for route, res in summary.items():
+        print(
+            f"{route:<40}{res['count']:>9d}{res['error_rate']:>9.1%}"
+            f"{res['throughput']:>9.1f}{res['p50_ms']:>9.1f}"
+            f"{res['p95_ms']:>9.1f}{res['p99_ms']:>9.1f}"
+        )
+
+    if args.output:
+        meta = {"users": args.users, "duration": elapsed, "mix": mix}
+        with open(args.output, "w") as output_file:
+            json.dump({"meta": meta, "results": summary}, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Check that the hot read queries are planned with indexes
+
+Seeds a small synthetic catalog in the benchmark schema (see `suite.py`), applies the
+migrations to it, and records every statement that the detail, collection and export
+queries run. Each one is then explained with sequential scans disabled. With a catalog
+this small, Postgres would happily scan every table, but with `enable_seqscan` off it
+only does so when there is no index it could use. Any remaining sequential scan is
+reported, and the script exits with an error. `tests/test_query_plans.py` runs the same
+check under pytest.
+
+Usage:
+    python benchmarks/plans.py [--size 20]
+"""
+
+import argparse
+import json
+import sys
+
+import dotenv
+import psycopg
+
+from suite import (
+    BENCH_SCHEMA,
+    connection_info,
+    create_schema,
+    synthetic_reactions,
+    synthetic_species,
+)
+
+
+def capture_statements(statements: list):
+    """Record the statements run through the app's cursors
+
+    :param statements: The list to append (query, params) pairs to
+    :type statements: list
+    """
+    from flame_data import _pool
+
+    run = _pool.InstrumentedCursor._run
+
+    def _run(self, method, query, params, **kwargs):
+        if method.__name__ == "executemany":
+            statements.append((query, next(iter(params), None)))
+        else:
+            statements.append((query, params))
+        return run(self, method, query, params, **kwargs)
+
+    _pool.InstrumentedCursor._run = _run
+
+
+def seed(size: int) -> dict:
+    """Seed the benchmark schema, and return the IDs to query with"""
+    from flame_data import query
+
+    for smi in synthetic_species(size):
+        status, error = query.add_species_by_smiles_connectivity(smi)
+        assert status < 400, error
+    for smi in synthetic_reactions(max(size // 2, 1)):
+        status, error = query.add_reaction_by_smiles_connectivity(smi)
+        assert status < 400, error
+
+    user = query.add_user("plans@example.com", "-")
+    coll = query.add_user_collection(user["id"], "Plans")
+    spc_conn_rows = query.search_species_connectivities()
+    rxn_conn_rows = query.search_reaction_connectivities()
+    for conn_row in spc_conn_rows:
+        query.add_species_connectivity_to_collection(coll["id"], conn_row["id"])
+    for conn_row in rxn_conn_rows:
+        query.add_reaction_connectivity_to_collection(coll["id"], conn_row["id"])
+
+    with psycopg.connect(connection_info(), autocommit=True) as conn:
+        conn.execute(f"SET search_path TO {BENCH_SCHEMA};")
+        conn.execute("ANALYZE;")
+
+    return {
+        "user_id": user["id"],
+        "coll_id": coll["id"],
+        "spc_conn_id": spc_conn_rows[0]["id"],
+        "rxn_conn_id": rxn_conn_rows[0]["id"],
+    }
+
+
+def hot_queries(ids: dict) -> dict:
+    """The read queries to check, by name"""
+    from flame_data import query
+
+    coll_id = ids["coll_id"]
+    spc_conn_id, rxn_conn_id = ids["spc_conn_id"], ids["rxn_conn_id"]
+    return {
+        "species_by_connectivity": lambda: query.get_species_by_connectivity(
+            spc_conn_id
+        ),
+        "reactions_by_connectivity": lambda: query.get_reactions_by_connectivity(
+            rxn_conn_id
+        ),
+        "reaction_species": lambda: (
+            query.get_species_connectivity_ids_by_reaction_connectivity(rxn_conn_id)
+        ),
+        "species_reactions": lambda: (
+            query.get_reaction_connectivity_ids_by_species_connectivity(spc_conn_id)
+        ),
+        "reactions_by_species": lambda: query.search_reaction_connectivities(
+            species_ids=[spc_conn_id], role="reactant"
+        ),
+        "user_collections": lambda: query.get_user_collections(ids["user_id"]),
+        "collection_species": lambda: query.get_collection_species(coll_id),
+        "collection_reactions": lambda: query.get_collection_reactions(coll_id),
+        "collection_species_data": lambda: query.get_collection_species_data(coll_id),
+        "collection_reactions_data": lambda: (
+            query.get_collection_reactions_data(coll_id)
+        ),
+        "collection_geometries": lambda: query.get_collection_geometries(coll_id),
+    }
+
+
+def seq_scans(plan: dict) -> list:
+    """Find the tables that a query plan scans sequentially"""
+    tables = []
+    if plan.get("Node Type") == "Seq Scan":
+        tables.append(plan["Relation Name"])
+    for subplan in plan.get("Plans", []):
+        tables.extend(seq_scans(subplan))
+    return tables
+
+
+def check(size: int) -> dict:
+    """Seed the benchmark schema, and find the tables that each hot query scans
+    sequentially
+
+    :param size: The number of species to seed
+    :type size: int
+    :return: The tables scanned sequentially, and the number of statements run, by
+        query name
+    :rtype: dict
+    """
+    create_schema()
+    from flame_data import migrate
+
+    migrate.apply()
+    ids = seed(size)
+
+    statements = []
+    capture_statements(statements)
+
+    results = {}
+    with psycopg.connect(connection_info(), autocommit=True) as conn:
+        conn.execute(f"SET search_path TO {BENCH_SCHEMA};")
+        conn.execute("SET enable_seqscan = off;")
+        for name, func in hot_queries(ids).items():
+            statements.clear()
+            func()
+
+            tables = []
+            for query_string, params in statements:
+                if query_string.split(None, 1)[0].upper() not in ("SELECT", "WITH"):
+                    continue
+                row = conn.execute(
+                    f"EXPLAIN (FORMAT JSON) {query_string}", params
+                ).fetchone()
+                plan = row[0] if isinstance(row[0], list) else json.loads(row[0])
+                tables.extend(seq_scans(plan[0]["Plan"]))
+
+            results[name] = (sorted(set(tables)), len(statements))
+
+    return results
+
+
+def main():
+    dotenv.load_dotenv()
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=20, help="Species to seed")
+    args = parser.parse_args()
+
+    failures = 0
+    for name, (tables, count) in check(args.size).items():
+        if tables:
+            failures += 1
+            print(f"{name:<28} FAIL  seq scan on {', '.join(tables)}")
+        else:
+            print(f"{name:<28} ok    ({count} statements)")
+
+    if failures:
+        print(f"{failures} query(s) scan a table sequentially")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
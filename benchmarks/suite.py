@@ -0,0 +1,349 @@
+"""Benchmark the chem builders and the main query paths on a synthetic catalog
+
+The benchmarks run against the database configured in the environment (see the
+README), but only ever touch a dedicated schema in it (`flame_data_bench`), which is
+dropped and recreated from `database.sql` at the start of every run. A throwaway
+Postgres instance is still recommended, since the timings are sensitive to other load.
+
+For each catalog size, the suite times:
+    - `chem.species_rows` and `chem.reaction_and_ts_rows`
+    - ingestion through `query.add_reaction_by_smiles_connectivity`
+    - exact and partial formula searches
+    - pathway searches over the in-memory reaction network
+    - `query.sort_rows_by_formula`
+    - collection export, as JSON data and as a NumPy archive
+
+Usage:
+    python benchmarks/suite.py run [--sizes 10 30 100] [--output results.json]
+    python benchmarks/suite.py compare baseline.json results.json [--threshold 0.2]
+    python benchmarks/suite.py run --compare baseline.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import dotenv
+import psycopg
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA_FILE = os.path.join(ROOT_DIR, "database.sql")
+BENCH_SCHEMA = "flame_data_bench"
+
+# Functional groups, applied to carbon chains of increasing length
+SPECIES_TEMPLATES = (
+    "{c}",  # alkane
+    "{c}O",  # alcohol
+    "{c}C=O",  # aldehyde
+    "{c}OC",  # ether
+    "C=C{c}",  # alkene
+)
+
+
+# SYNTHETIC CATALOG
+def synthetic_species(count: int) -> list:
+    """Generate SMILES strings for a synthetic set of closed-shell species
+
+    :param count: The number of species
+    :type count: int
+    :return: The SMILES strings
+    :rtype: list
+    """
+    smis = []
+    nc = 1
+    while len(smis) < count:
+        for template in SPECIES_TEMPLATES:
+            smis.append(template.format(c="C" * nc))
+        nc += 1
+    return smis[:count]
+
+
+def synthetic_reactions(count: int) -> list:
+    """Generate reaction SMILES strings for a synthetic set of H-abstractions by OH
+
+    :param count: The number of reactions
+    :type count: int
+    :return: The reaction SMILES strings
+    :rtype: list
+    """
+    smis = []
+    nc = 2
+    while len(smis) < count:
+        chain = "C" * nc
+        smis.append(f"{chain}.[OH]>>[CH2]{chain[1:]}.O")
+        smis.append(f"{chain}O.[OH]>>{chain}[O].O")
+        nc += 1
+    return smis[:count]
+
+
+# DATABASE SETUP
+def connection_info() -> str:
+    """Get the connection info for the benchmark database from the environment"""
+    return psycopg.conninfo.make_conninfo(
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT"),
+        dbname=os.getenv("DB_NAME"),
+    )
+
+
+def create_schema():
+    """Create a fresh benchmark schema, and point the app's connections at it
+
+    Must be called before `flame_data` is imported
+    """
+    with open(SCHEMA_FILE) as schema_file:
+        schema_sql = schema_file.read()
+
+    with psycopg.connect(connection_info(), autocommit=True) as conn:
+        conn.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE;")
+        conn.execute(f"CREATE SCHEMA {BENCH_SCHEMA};")
+        conn.execute(f"SET search_path TO {BENCH_SCHEMA};")
+        conn.execute(schema_sql)
+
+    # libpq reads this for every new connection, including the app's pool
+    os.environ["PGOPTIONS"] = f"-c search_path={BENCH_SCHEMA}"
+    os.environ.setdefault("STATIC_FOLDER", os.path.join("flame-data-frontend", "dist"))
+
+
+def clear_tables():
+    """Clear all data from the benchmark schema"""
+    with psycopg.connect(connection_info(), autocommit=True) as conn:
+        conn.execute(f"SET search_path TO {BENCH_SCHEMA};")
+        conn.execute(
+            "TRUNCATE users, species_connectivity, reaction_connectivity, collection, "
+            "smiles_identifier RESTART IDENTITY CASCADE;"
+        )
+
+
+# BENCHMARKS
+def timed(func, *args, repeat: int = 1):
+    """Time a function call, taking the best of several repetitions
+
+    :param func: The function
+    :param args: Arguments to the function
+    :param repeat: The number of repetitions, defaults to 1
+    :type repeat: int, optional
+    :return: The best time, in seconds, and the return value of the last call
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ret = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, ret
+
+
+def run_size(size: int, repeat: int) -> dict:
+    """Run every benchmark on a synthetic catalog of one size
+
+    :param size: The number of species in the catalog; there are half as many reactions
+    :type size: int
+    :param repeat: The number of repetitions for the fast benchmarks
+    :type repeat: int
+    :return: The results, keyed by benchmark name; each has keys "seconds" and "count"
+    :rtype: dict
+    """
+    from flame_data import chem, export, query
+
+    spc_smis = synthetic_species(size)
+    rxn_smis = synthetic_reactions(max(size // 2, 1))
+    results = {}
+
+    def record(name, seconds, count=1):
+        results[name] = {"seconds": seconds, "count": count}
+        print(f"  {name:<28} {seconds * 1e3:>12.1f} ms  ({count} items)")
+
+    clear_tables()
+
+    # 1. Chem builders, without the database
+    secs, _ = timed(lambda: [chem.species_rows(s) for s in spc_smis])
+    record("chem.species_rows", secs, len(spc_smis))
+    secs, _ = timed(lambda: [chem.reaction_and_ts_rows(s) for s in rxn_smis])
+    record("chem.reaction_and_ts_rows", secs, len(rxn_smis))
+
+    # 2. Ingestion
+    def _ingest():
+        for smi in spc_smis:
+            status, error = query.add_species_by_smiles_connectivity(smi)
+            assert status < 400, error
+        for smi in rxn_smis:
+            status, error = query.add_reaction_by_smiles_connectivity(smi)
+            assert status < 400, error
+
+    secs, _ = timed(_ingest)
+    record("ingest", secs, len(spc_smis) + len(rxn_smis))
+
+    # 3. Formula search
+    fml = chem.species_connectivity_row(spc_smis[-1])["formula"]
+    secs, _ = timed(query.search_species_connectivities, fml, False, repeat=repeat)
+    record("search.species.exact", secs)
+    secs, _ = timed(query.search_species_connectivities, "C2", True, repeat=repeat)
+    record("search.species.partial", secs)
+    secs, _ = timed(query.search_reaction_connectivities, "C2", True, repeat=repeat)
+    record("search.reaction.partial", secs)
+    secs, rows = timed(query.search_species_connectivities, repeat=repeat)
+    record("search.species.all", secs, len(rows))
+
+    # Pathways over the in-memory reaction network, between the first and last species
+    source_id, target_id = rows[0]["id"], rows[-1]["id"]
+    secs, pathways = timed(
+        query.find_reaction_pathways, source_id, target_id, 4, 100, True, repeat=repeat
+    )
+    record("search.reaction.pathway", secs, len(pathways))
+
+    # 4. Sorting
+    secs, _ = timed(query.sort_rows_by_formula, rows, repeat=repeat)
+    record("sort_rows_by_formula", secs, len(rows))
+
+    # 5. Collection export
+    user = query.add_user("bench@example.com", "-")
+    coll = query.add_user_collection(user["id"], "Benchmark")
+    for conn_row in rows:
+        query.add_species_connectivity_to_collection(coll["id"], conn_row["id"])
+    for conn_row in query.search_reaction_connectivities():
+        query.add_reaction_connectivity_to_collection(coll["id"], conn_row["id"])
+
+    def _export_json():
+        return {
+            "name": query.get_collection_name(coll["id"]),
+            "species": query.get_collection_species_data(coll["id"]),
+            "reactions": query.get_collection_reactions_data(coll["id"]),
+        }
+
+    secs, data = timed(_export_json, repeat=repeat)
+    record("export.json", secs, len(data["species"]) + len(data["reactions"]))
+
+    def _export_npz():
+        return export.collection_npz(*query.get_collection_geometries(coll["id"]))
+
+    secs, _ = timed(_export_npz, repeat=repeat)
+    record("export.npz", secs)
+
+    return results
+
+
+def run(sizes: list, repeat: int) -> dict:
+    """Run the benchmark suite
+
+    :param sizes: The catalog sizes
+    :type sizes: list
+    :param repeat: The number of repetitions for the fast benchmarks
+    :type repeat: int
+    :return: The results, with keys "meta" and "results"; results are keyed by
+        "<benchmark>@<size>"
+    :rtype: dict
+    """
+    create_schema()
+
+    import automol
+
+    results = {}
+    for size in sizes:
+        print(f"Catalog size {size}:")
+        for name, res in run_size(size, repeat).items():
+            results[f"{name}@{size}"] = res
+
+    return {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "automol": getattr(automol, "__version__", "unknown"),
+            "sizes": sizes,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """Compare benchmark results against a baseline
+
+    :param baseline: The baseline results
+    :type baseline: dict
+    :param current: The current results
+    :type current: dict
+    :param threshold: The relative slowdown above which to flag a regression
+    :type threshold: float
+    :return: The names of the benchmarks that regressed
+    :rtype: list
+    """
+    regressions = []
+    print(f"{'benchmark':<36} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, res in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<36} {'-':>12} {res['seconds'] * 1e3:>10.1f}ms")
+            continue
+
+        change = res["seconds"] / base["seconds"] - 1 if base["seconds"] else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(
+            f"{name:<36} {base['seconds'] * 1e3:>10.1f}ms "
+            f"{res['seconds'] * 1e3:>10.1f}ms {change:>+8.0%}{flag}"
+        )
+    return regressions
+
+
+def git_commit() -> str:
+    """Get the current git commit of the repository, if there is one"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    dotenv.load_dotenv()
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=[10, 30, 100])
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument("--output", help="Save the results to this JSON file")
+    run_parser.add_argument("--compare", help="Compare against this baseline file")
+    run_parser.add_argument("--threshold", type=float, default=0.2)
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.2)
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        current = run(args.sizes, args.repeat)
+        if args.output:
+            with open(args.output, "w") as output_file:
+                json.dump(current, output_file, indent=2)
+        baseline_path = args.compare
+    else:
+        with open(args.current) as current_file:
+            current = json.load(current_file)
+        baseline_path = args.baseline
+
+    if baseline_path:
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,8 @@
 CREATE TABLE users (
   id SERIAL PRIMARY KEY,
   email VARCHAR(345) UNIQUE NOT NULL,
-  password VARCHAR(100) NOT NULL
+  password VARCHAR(100) NOT NULL,
+  admin BOOLEAN NOT NULL DEFAULT FALSE
 );
 
 -- SPECIES TABLES
@@ -22,14 +23,21 @@ CREATE TABLE species_connectivity (
 CREATE TABLE species_estate (
   id BIGSERIAL PRIMARY KEY,
   spin_mult SMALLINT,
+  stereo_count INTEGER,  -- The total number of stereoisomers, stored or not
   conn_id BIGINT
     REFERENCES species_connectivity(id)
     ON DELETE CASCADE
 );
 
+CREATE INDEX species_estate_conn_id_idx ON species_estate (conn_id);
+
 CREATE TABLE species (
   id BIGSERIAL PRIMARY KEY,
-  geometry TEXT,
+  geometry BYTEA,  -- Packed symbols and coordinates (see flame_data/geometry.py);
+                   -- NULL until generated, if stored lazily
+  -- 'pending', 'running' or 'failed' while the geometry is NULL, otherwise 'ready'
+  geometry_status TEXT NOT NULL DEFAULT 'ready',
+  geometry_claimed_at TIMESTAMPTZ,  -- When a worker set the status to 'running'
   smiles TEXT,
   inchi TEXT,
   amchi TEXT,
@@ -39,10 +47,20 @@ CREATE TABLE species (
     ON DELETE CASCADE
 );
 
+CREATE INDEX species_estate_id_idx ON species (estate_id);
+
+-- For the background worker to find species that are waiting for geometries, and
+-- claims that have gone stale
+CREATE INDEX species_geometry_pending_idx
+ON species (id) WHERE geometry_status = 'pending';
+
+CREATE INDEX species_geometry_running_idx
+ON species (geometry_claimed_at) WHERE geometry_status = 'running';
+
 -- REACTION TABLES
 
 -- Restart command:
--- DROP TABLE IF EXISTS reaction_connectivity, reaction, reaction_estate, reaction_ts, reaction_reactants, reaction_products, collection_reactions;
+-- DROP TABLE IF EXISTS reaction_connectivity, reaction_connectivity_species, reaction, reaction_estate, reaction_ts, reaction_reactants, reaction_products, collection_reactions;
 
 -- This table contains duplicate information that could be recreated using a JOIN It is
 -- mainly for searching purposes
@@ -95,6 +113,8 @@ CREATE TABLE reaction (
   UNIQUE(r_amchi_key, p_amchi_key)
 );
 
+CREATE INDEX reaction_conn_id_idx ON reaction (conn_id);
+
 CREATE TABLE reaction_estate (
   id BIGSERIAL PRIMARY KEY,
   spin_mult SMALLINT,
@@ -103,9 +123,14 @@ CREATE TABLE reaction_estate (
     ON DELETE CASCADE
 );
 
+CREATE INDEX reaction_estate_reaction_id_idx ON reaction_estate (reaction_id);
+
 CREATE TABLE reaction_ts (
   id BIGSERIAL PRIMARY KEY,
-  geometry TEXT,
+  geometry BYTEA,  -- Packed symbols and coordinates (see flame_data/geometry.py)
+  -- 'pending', 'running' or 'failed' while the geometry is NULL, otherwise 'ready'
+  geometry_status TEXT NOT NULL DEFAULT 'ready',
+  geometry_claimed_at TIMESTAMPTZ,  -- When a worker set the status to 'running'
   class TEXT,
   amchi TEXT,
   amchi_key CHAR(27) UNIQUE,
@@ -114,6 +139,33 @@ CREATE TABLE reaction_ts (
     ON DELETE CASCADE
 );
 
+CREATE INDEX reaction_ts_estate_id_idx ON reaction_ts (estate_id);
+
+-- For the background worker to find TSs that are waiting for geometries
+CREATE INDEX reaction_ts_geometry_pending_idx
+ON reaction_ts (id) WHERE geometry_status = 'pending';
+
+-- For the workers to find claims that have gone stale
+CREATE INDEX reaction_ts_geometry_running_idx
+ON reaction_ts (geometry_claimed_at) WHERE geometry_status = 'running';
+
+-- Which species connectivities take part in each reaction connectivity, as reactants
+-- or products. This duplicates r_conn_ids and p_conn_ids, but can be indexed and
+-- enforces the references.
+CREATE TABLE reaction_connectivity_species (
+  reaction_conn_id BIGINT NOT NULL
+    REFERENCES reaction_connectivity(id)
+    ON DELETE CASCADE,
+  species_conn_id BIGINT NOT NULL
+    REFERENCES species_connectivity(id)
+    ON DELETE CASCADE,
+  role TEXT NOT NULL CHECK (role IN ('reactant', 'product')),
+  PRIMARY KEY (reaction_conn_id, species_conn_id, role)
+);
+
+CREATE INDEX reaction_connectivity_species_species_idx
+ON reaction_connectivity_species (species_conn_id, role);
+
 -- REAGENTS TABLES
 
 CREATE TABLE reaction_reactants (
@@ -126,6 +178,8 @@ CREATE TABLE reaction_reactants (
   PRIMARY KEY(reaction_id, species_id)
 );
 
+CREATE INDEX reaction_reactants_species_id_idx ON reaction_reactants (species_id);
+
 CREATE TABLE reaction_products (
   reaction_id BIGINT
     REFERENCES reaction(id)
@@ -136,6 +190,8 @@ CREATE TABLE reaction_products (
   PRIMARY KEY(reaction_id, species_id)
 );
 
+CREATE INDEX reaction_products_species_id_idx ON reaction_products (species_id);
+
 -- COLLECTION TABLES
 
 CREATE TABLE collection (
@@ -146,6 +202,8 @@ CREATE TABLE collection (
     ON DELETE CASCADE
 );
 
+CREATE INDEX collection_user_id_idx ON collection (user_id);
+
 CREATE TABLE collection_species (
   coll_id INT
     REFERENCES collection(id)
@@ -156,6 +214,8 @@ CREATE TABLE collection_species (
   PRIMARY KEY(coll_id, species_id)
 );
 
+CREATE INDEX collection_species_species_id_idx ON collection_species (species_id);
+
 CREATE TABLE collection_reactions (
   coll_id INT
     REFERENCES collection(id)
@@ -165,3 +225,79 @@ CREATE TABLE collection_reactions (
     ON DELETE CASCADE,
   PRIMARY KEY(coll_id, reaction_id)
 );
+
+CREATE INDEX collection_reactions_reaction_id_idx
+ON collection_reactions (reaction_id);
+
+-- IDEMPOTENCY TABLES
+
+-- Responses to submissions with an Idempotency-Key header, so that retries can be
+-- answered without redoing the work. The status is NULL while the first request is
+-- still being processed. Rows expire after a configurable time.
+CREATE TABLE idempotency_key (
+  user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  key VARCHAR(255) NOT NULL,
+  request_hash TEXT NOT NULL,
+  status INTEGER,
+  content_type TEXT,
+  body BYTEA,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (user_id, key)
+);
+
+CREATE INDEX idempotency_key_created_at_idx ON idempotency_key (created_at);
+
+-- IDENTIFIER MEMO TABLES
+
+-- Identifiers computed from raw SMILES strings, as they were submitted or looked up.
+-- Each column is filled in when it is first needed (see flame_data/_identifiers.py).
+CREATE TABLE smiles_identifier (
+  smiles TEXT PRIMARY KEY,
+  conn_inchi_hash CHAR(14),
+  amchi_key CHAR(27)
+);
+
+-- CACHE VALIDATION TABLES
+
+-- Each data table has a generation counter that grows with every statement that
+-- modifies it. The API derives ETags from these, so that conditional requests for
+-- unchanged data can be answered without running the full query. Each statement logs a
+-- fresh value from the sequence, and a table's generation is the sum of its values, so
+-- that writers never wait on each other (see flame_data/migrations/0015).
+CREATE SEQUENCE table_generation_seq;
+
+CREATE TABLE table_generation_log (
+  table_name TEXT NOT NULL,
+  generation BIGINT NOT NULL
+);
+
+CREATE INDEX table_generation_log_table_name_idx
+ON table_generation_log (table_name) INCLUDE (generation);
+
+CREATE FUNCTION bump_table_generation() RETURNS TRIGGER AS $$
+BEGIN
+  INSERT INTO table_generation_log (table_name, generation)
+  VALUES (TG_TABLE_NAME, nextval('table_generation_seq'));
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+  name TEXT;
+BEGIN
+  FOREACH name IN ARRAY ARRAY[
+    'species_connectivity', 'species_estate', 'species',
+    'reaction_connectivity', 'reaction', 'reaction_estate', 'reaction_ts',
+    'reaction_connectivity_species', 'reaction_reactants', 'reaction_products',
+    'collection', 'collection_species', 'collection_reactions'
+  ]
+  LOOP
+    EXECUTE format(
+      'CREATE TRIGGER %I AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I '
+      'FOR EACH STATEMENT EXECUTE FUNCTION bump_table_generation();',
+      name || '_generation', name
+    );
+  END LOOP;
+END;
+$$;
@@ -0,0 +1,39 @@
+// Write gzip and brotli versions of the build output next to the originals, so that
+// the Flask app can serve them without compressing on every request
+import fs from "node:fs";
+import path from "node:path";
+import { fileURLToPath } from "node:url";
+import zlib from "node:zlib";
+
+const distDir = path.join(path.dirname(fileURLToPath(import.meta.url)), "..", "dist");
+const extensions = [".js", ".css", ".html", ".svg", ".json"];
+const minSize = 500;
+
+function* walk(dir) {
+  for (const entry of fs.readdirSync(dir, { withFileTypes: true })) {
+    const entryPath = path.join(dir, entry.name);
+    if (entry.isDirectory()) {
+      yield* walk(entryPath);
+    } else {
+      yield entryPath;
+    }
+  }
+}
+
+for (const filePath of walk(distDir)) {
+  if (!extensions.includes(path.extname(filePath))) continue;
+
+  const data = fs.readFileSync(filePath);
+  if (data.length < minSize) continue;
+
+  fs.writeFileSync(`${filePath}.gz`, zlib.gzipSync(data, { level: 9 }));
+  fs.writeFileSync(
+    `${filePath}.br`,
+    zlib.brotliCompressSync(data, {
+      params: {
+        [zlib.constants.BROTLI_PARAM_QUALITY]: zlib.constants.BROTLI_MAX_QUALITY,
+        [zlib.constants.BROTLI_PARAM_SIZE_HINT]: data.length,
+      },
+    }),
+  );
+}
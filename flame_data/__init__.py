@@ -1,5 +1,4 @@
-from flame_data import chem, query, utils
-from flame_data._app import app
+import importlib
 
 __all__ = [
     "app",
@@ -8,3 +7,15 @@ __all__ = [
     "chem",
     "utils",
 ]
+
+
+def __getattr__(name):
+    # Import the app and modules on first use, so that the worker, scripts and sandbox
+    # processes only load what they need; importing `query` opens a connection pool
+    if name == "app":
+        from flame_data._app import app
+
+        return app
+    if name in ("query", "chem", "utils"):
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,156 @@
+"""Admission control, limiting how many requests of each class run at once
+
+Each budget has a number of run slots and a number of queue slots, shared by all worker
+processes on a machine. A request takes a free run slot if there is one. Otherwise, it
+takes a queue slot and waits for a run slot to free up, and it is rejected if there are
+no queue slots left or the wait times out.
+
+Slots are lock files under `ADMISSION_DIR`, held with `flock`, so they are released
+automatically if a worker dies while holding one.
+
+A queued request holds a worker thread while it waits, so the default budgets are sized
+from the number of requests a machine can serve at once, `WEB_CONCURRENCY` workers
+times `GUNICORN_THREADS` threads (see `gunicorn.conf.py`). Heavy requests can use at
+most half of the threads, running or queued, which leaves the rest for reads.
+"""
+
+import errno
+import fcntl
+import os
+import random
+import tempfile
+import time
+from typing import NamedTuple, Optional
+
+import dotenv
+
+from flame_data import _metrics
+
+dotenv.load_dotenv()
+
+ADMISSION_DIR = os.getenv(
+    "ADMISSION_DIR", os.path.join(tempfile.gettempdir(), "flame_data_admission")
+)
+POLL_INTERVAL = 0.05
+
+
+class Budget(NamedTuple):
+    """A concurrency budget for one class of requests"""
+
+    slots: int  # Requests that can run at once
+    queue: int  # Requests that can wait for a slot at once
+    wait: float  # How long a request can wait for a slot, in seconds
+
+
+def default_slots(capacity: int) -> dict:
+    """Get the default run and queue slots of each budget
+
+    :param capacity: The number of requests that can be served at once, per machine,
+        or 0 if unknown (as under the development server)
+    :type capacity: int
+    :return: The run and queue slots, by budget name
+    :rtype: dict
+    """
+    if not capacity:
+        return {"heavy": (2, 2), "read": (16, 16)}
+
+    heavy_slots = max(1, capacity // 4)
+    heavy_queue = max(0, min(heavy_slots, capacity // 2 - heavy_slots))
+    read_slots = max(1, capacity - heavy_slots - heavy_queue)
+    return {
+        "heavy": (heavy_slots, heavy_queue),
+        "read": (read_slots, max(0, capacity - read_slots)),
+    }
+
+
+CAPACITY = int(os.getenv("WEB_CONCURRENCY", "0")) * int(
+    os.getenv("GUNICORN_THREADS", "1")
+)
+_DEFAULTS = default_slots(CAPACITY)
+
+BUDGETS = {
+    # Routes that run the chem pipeline
+    "heavy": Budget(
+        slots=int(os.getenv("HEAVY_SLOTS", _DEFAULTS["heavy"][0])),
+        queue=int(os.getenv("HEAVY_QUEUE", _DEFAULTS["heavy"][1])),
+        wait=float(os.getenv("HEAVY_WAIT", "10")),
+    ),
+    # Routes that only read from the database
+    "read": Budget(
+        slots=int(os.getenv("READ_SLOTS", _DEFAULTS["read"][0])),
+        queue=int(os.getenv("READ_QUEUE", _DEFAULTS["read"][1])),
+        wait=float(os.getenv("READ_WAIT", "5")),
+    ),
+}
+
+
+def acquire(budget_name: str) -> Optional[int]:
+    """Acquire a run slot in a budget, waiting in the queue if necessary
+
+    :param budget_name: The name of the budget, a key of `BUDGETS`
+    :type budget_name: str
+    :return: A handle for releasing the slot, or None if the request was rejected
+    :rtype: Optional[int]
+    """
+    budget = BUDGETS[budget_name]
+    slot = _try_slot(budget_name, "run", budget.slots)
+    if slot is not None:
+        _metrics.observe_admission(budget_name, "running", 1)
+        return slot
+
+    queue_slot = _try_slot(budget_name, "queue", budget.queue)
+    if queue_slot is None:
+        _metrics.observe_admission_rejected(budget_name)
+        return None
+
+    _metrics.observe_admission(budget_name, "queued", 1)
+    try:
+        deadline = time.monotonic() + budget.wait
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            slot = _try_slot(budget_name, "run", budget.slots)
+            if slot is not None:
+                _metrics.observe_admission(budget_name, "running", 1)
+                return slot
+    finally:
+        _release_slot(queue_slot)
+        _metrics.observe_admission(budget_name, "queued", -1)
+
+    _metrics.observe_admission_rejected(budget_name)
+    return None
+
+
+def release(budget_name: str, slot: int):
+    """Release a run slot
+
+    :param budget_name: The name of the budget
+    :type budget_name: str
+    :param slot: The handle returned by `acquire()`
+    :type slot: int
+    """
+    _release_slot(slot)
+    _metrics.observe_admission(budget_name, "running", -1)
+
+
+def _try_slot(budget_name: str, kind: str, count: int) -> Optional[int]:
+    os.makedirs(ADMISSION_DIR, exist_ok=True)
+
+    # Start at a random slot, so that requests don't all contend for the first one
+    offset = random.randrange(count) if count else 0
+    for idx in range(count):
+        name = f"{budget_name}-{kind}-{(offset + idx) % count}.lock"
+        fd = os.open(os.path.join(ADMISSION_DIR, name), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except OSError as exc:
+            os.close(fd)
+            if exc.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+
+    return None
+
+
+def _release_slot(fd: int):
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
@@ -1,4 +1,11 @@
+import functools
+import hashlib
+import io
+import json
 import os
+import random
+import uuid
+from typing import List, Optional, Tuple
 
 import dotenv
 import flask
@@ -6,9 +13,21 @@ import flask_bcrypt
 import flask_cors
 import flask_session
 import flask_sqlalchemy
+import psycopg
 import sqlalchemy
 
-from flame_data import query
+from flame_data import (
+    _admission,
+    _compress,
+    _json,
+    _metrics,
+    _profile,
+    _queries,
+    _timing,
+    export,
+    query,
+)
+from flame_data._pool import pool, query_scope
 from flame_data.utils import response
 
 dotenv.load_dotenv()
@@ -20,6 +39,7 @@ app = flask.Flask(
     static_folder=os.path.join("..", os.getenv("STATIC_FOLDER")),
     static_url_path="",
 )
+app.json = _json.JSONProvider(app)
 
 # 2. Configure the app
 app.config.update(
@@ -53,6 +73,96 @@ flask_cors.CORS(app, supports_credentials=True)
 # 6. Create a bcrypt instance
 bcrypt = flask_bcrypt.Bcrypt(app)
 
+# 7. Log at the configured level (INFO by default)
+app.logger.setLevel(os.getenv("LOG_LEVEL", "INFO"))
+
+
+# 8. Time requests and record their queries (registered first, so it runs after the
+# other response handlers)
+@app.before_request
+def start_request_timing():
+    _timing.start()
+    _queries.start()
+
+
+@app.after_request
+def add_request_timing(resp: flask.Response) -> flask.Response:
+    timings, total = _timing.stop()
+    query_stats = _queries.stop()
+    resp.headers["Server-Timing"] = _timing.server_timing_header(timings, total)
+    resp.headers["X-Request-ID"] = get_request_id()
+    app.logger.info(
+        json.dumps(
+            {
+                "request_id": get_request_id(),
+                "method": flask.request.method,
+                "path": flask.request.path,
+                "status": resp.status_code,
+                "total_ms": round(total * 1e3, 1),
+                **{f"{k}_ms": round(v * 1e3, 1) for k, v in timings.items()},
+                "queries": sum(s["count"] for s in query_stats.values()),
+            }
+        )
+    )
+    return resp
+
+
+# 9. Compress API responses and serve static files precompressed
+app.after_request(_compress.compress_response)
+
+
+# 10. Collect metrics
+@app.before_request
+def start_request_metrics():
+    _metrics.start_request()
+
+
+@app.after_request
+def observe_request_metrics(resp: flask.Response) -> flask.Response:
+    _metrics.observe_pool(pool)
+    return _metrics.observe_request(resp)
+
+
+app.teardown_request(_metrics.finish_request)
+
+
+# 11. Profile individual requests on demand, for admins
+@app.before_request
+def start_request_profile():
+    modes = _profile.requested_modes()
+    if modes:
+        user = get_user()
+        if user is not None and user.get("admin"):
+            _profile.start(modes)
+
+
+@app.after_request
+def save_request_profile(resp: flask.Response) -> flask.Response:
+    kinds = _profile.stop(get_request_id())
+    if kinds:
+        resp.headers["X-Profile-Saved"] = ", ".join(kinds)
+    return resp
+
+
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", str(24 * 60 * 60)))
+IDEMPOTENCY_KEY_LEASE = int(os.getenv("IDEMPOTENCY_KEY_LEASE", "300"))
+IDEMPOTENCY_KEY_LIMIT = int(os.getenv("IDEMPOTENCY_KEY_LIMIT", "1000"))
+# The fraction of claims that also clear out every user's expired keys
+IDEMPOTENCY_KEY_SWEEP_RATE = 0.01
+QUERY_TIMEOUT = float(os.getenv("QUERY_TIMEOUT", "10"))
+EXPORT_QUERY_TIMEOUT = float(os.getenv("EXPORT_QUERY_TIMEOUT", "60"))
+PATHWAY_MAX_STEPS = int(os.getenv("PATHWAY_MAX_STEPS", "6"))
+PATHWAY_MAX_LIMIT = 100
+SPECIES_KEY_TYPES = (
+    "smiles",
+    "inchi",
+    "amchi",
+    "inchi_key",
+    "amchi_key",
+    "inchi_hash",
+    "amchi_hash",
+)
+
 
 # helper functions
 def get_user() -> dict:
@@ -66,10 +176,347 @@ def get_user() -> dict:
     return user
 
 
+def get_request_id() -> str:
+    """Get the ID of the current request
+
+    Uses the `X-Request-ID` header, if the client or a proxy sent a valid one, and
+    generates a new ID otherwise
+    """
+    if "request_id" not in flask.g:
+        request_id = flask.request.headers.get("X-Request-ID", "")
+        if not _profile.REQUEST_ID_PATTERN.fullmatch(request_id):
+            request_id = uuid.uuid4().hex
+        flask.g.request_id = request_id
+
+    return flask.g.request_id
+
+
+def lookup_species_connectivity_ids(
+    keys: List[str], key_type: str
+) -> List[Optional[int]]:
+    """Look up species connectivity IDs from request parameters
+
+    :param keys: The identifying keys, or the IDs themselves if `key_type` is "id"
+    :type keys: List[str]
+    :param key_type: The type of the keys; one of `SPECIES_KEY_TYPES`, or "id"
+    :type key_type: str
+    :return: The IDs, with None for species that aren't in the database
+    :rtype: List[Optional[int]]
+    :raises ValueError: If the key type or an ID is invalid
+    """
+    if key_type == "id":
+        if not all(k.isdigit() for k in keys):
+            raise ValueError("Species IDs must be integers")
+        return list(map(int, keys))
+
+    if key_type not in SPECIES_KEY_TYPES:
+        raise ValueError(f"Invalid key_type {key_type}")
+    return query.lookup_species_connectivities(keys, key_type, id_only=True)
+
+
+def add_connectivity(
+    smi: str, reaction: bool = False
+) -> Tuple[int, str, Optional[int]]:
+    """Add a species or reaction connectivity, if it isn't there yet, and look up its ID
+
+    The existence check can be answered by the in-process index, which can still list
+    a connectivity that another worker deleted since its last sync. If the ID then
+    isn't found, the connectivity is added again, checking the database this time.
+
+    :param smi: SMILES string
+    :type smi: str
+    :param reaction: Is it a reaction?, default False
+    :type reaction: bool, optional
+    :return: A status code and an error message, if it failed, and the ID
+    :rtype: Tuple[int, str, Optional[int]]
+    """
+    if reaction:
+        add, lookup = (
+            query.add_reaction_by_smiles_connectivity,
+            query.lookup_reaction_connectivity,
+        )
+    else:
+        add, lookup = (
+            query.add_species_by_smiles_connectivity,
+            query.lookup_species_connectivity,
+        )
+
+    id = None
+    for recheck in (False, True):
+        status, error = add(smi, recheck=recheck)
+        if status >= 400:
+            return status, error, None
+
+        id = lookup(smi, id_only=True)
+        if id is not None:
+            break
+
+    app.logger.debug("The ID for this connectivity is %s", id)
+    if id is None:
+        return 409, f"{smi} was deleted while it was being added", None
+
+    return 0, "", id
+
+
+def conditional(*table_names: str, private: bool = False):
+    """Answer conditional GET requests for a route based on table generations
+
+    The ETag is derived from the generations of the tables the route reads from, so a
+    request with a matching `If-None-Match` header gets a 304 without running the
+    route's queries
+
+    :param table_names: The names of the tables that the route's data comes from
+    :type table_names: str
+    :param private: Is the data specific to the session user?, defaults to False
+    :type private: bool, optional
+    """
+
+    def decorator(route):
+        @functools.wraps(route)
+        def wrapper(*args, **kwargs):
+            # Generations are read before the data, so a change in between can only
+            # make the ETag stale, never the data
+            gen_dct = query.get_table_generations(table_names)
+            user_id = flask.session.get("user_id", None) if private else None
+            key = json.dumps([flask.request.full_path, user_id, gen_dct])
+            etag = hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+            is_hit = flask.request.if_none_match.contains_weak(etag)
+            _metrics.observe_cache("etag", is_hit)
+            if is_hit:
+                resp = flask.Response(status=304)
+            else:
+                resp = flask.make_response(route(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+
+            resp.set_etag(etag, weak=True)
+            resp.headers["Cache-Control"] = (
+                "private, no-cache" if private else "no-cache"
+            )
+            return resp
+
+        return wrapper
+
+    return decorator
+
+
+def admitted(budget_name: str):
+    """Limit how many requests to a route can run at once, using an admission budget
+
+    Requests that can't get a slot in time are rejected with a 503 and a `Retry-After`
+    header, rather than tying up a worker
+
+    :param budget_name: The name of the budget; "heavy" for routes that run the chem
+        pipeline, "read" for routes that only read from the database
+    :type budget_name: str
+    """
+
+    def decorator(route):
+        @functools.wraps(route)
+        def wrapper(*args, **kwargs):
+            slot = _admission.acquire(budget_name)
+            if slot is None:
+                resp = flask.make_response(
+                    response(503, error="The server is busy; please try again later")
+                )
+                resp.headers["Retry-After"] = str(
+                    max(1, round(_admission.BUDGETS[budget_name].wait))
+                )
+                return resp
+
+            try:
+                return route(*args, **kwargs)
+            finally:
+                _admission.release(budget_name, slot)
+
+        return wrapper
+
+    return decorator
+
+
+def query_timeout(seconds: float):
+    """Limit how long each query run by a route can take
+
+    Queries are also cancelled if the client disconnects. Either way, the request gets
+    a 503 rather than holding on to a database connection.
+
+    :param seconds: The statement timeout for each query, in seconds
+    :type seconds: float
+    """
+
+    def decorator(route):
+        @functools.wraps(route)
+        def wrapper(*args, **kwargs):
+            client_socket = flask.request.environ.get("gunicorn.socket")
+            with query_scope(seconds, client_socket) as scope:
+                try:
+                    return route(*args, **kwargs)
+                except psycopg.errors.QueryCanceled:
+                    reason = "disconnect" if scope.cancelled else "timeout"
+                    _metrics.observe_query_cancelled(reason)
+                    app.logger.warning(
+                        "Cancelled the queries for %s (%s)", flask.request.path, reason
+                    )
+                    resp = flask.make_response(
+                        response(503, error="This request took too long to answer")
+                    )
+                    resp.headers["Retry-After"] = "30"
+                    return resp
+
+        return wrapper
+
+    return decorator
+
+
+def idempotent(route):
+    """Let clients safely retry a route by sending an `Idempotency-Key` header
+
+    The first response for a given key and user is stored, and retries with the same
+    key get that response back without running the route again. Server errors aren't
+    stored, so those requests can be retried for real. Neither are requests whose
+    worker died before responding, once their claim on the key has expired.
+    """
+
+    @functools.wraps(route)
+    def wrapper(*args, **kwargs):
+        key = flask.request.headers.get("Idempotency-Key")
+        user_id = flask.session.get("user_id", None)
+        if key is None or user_id is None:
+            return route(*args, **kwargs)
+
+        if not 0 < len(key) <= 255:
+            return response(400, error="Idempotency-Key must be 1-255 characters")
+
+        request_hash = hashlib.sha256(
+            flask.request.method.encode("utf-8")
+            + flask.request.full_path.encode("utf-8")
+            + flask.request.get_data()
+        ).hexdigest()
+
+        if random.random() < IDEMPOTENCY_KEY_SWEEP_RATE:
+            query.expire_idempotency_keys(IDEMPOTENCY_KEY_TTL, IDEMPOTENCY_KEY_LEASE)
+
+        row = query.claim_idempotency_key(
+            user_id,
+            key,
+            request_hash,
+            IDEMPOTENCY_KEY_TTL,
+            IDEMPOTENCY_KEY_LEASE,
+            IDEMPOTENCY_KEY_LIMIT,
+        )
+        _metrics.observe_cache("idempotency", row is not None)
+        if row is not None:
+            if row["request_hash"] != request_hash:
+                return response(
+                    422, error="This Idempotency-Key was used for a different request"
+                )
+            if row["status"] is None:
+                resp = flask.make_response(
+                    response(
+                        409, error="A request with this Idempotency-Key is in progress"
+                    )
+                )
+                resp.headers["Retry-After"] = "1"
+                return resp
+
+            resp = flask.Response(
+                row["body"], status=row["status"], content_type=row["content_type"]
+            )
+            resp.headers["Idempotent-Replayed"] = "true"
+            return resp
+
+        try:
+            resp = flask.make_response(route(*args, **kwargs))
+        except BaseException:
+            query.release_idempotency_key(user_id, key)
+            raise
+
+        if resp.status_code >= 500:
+            query.release_idempotency_key(user_id, key)
+        else:
+            query.save_idempotent_response(
+                user_id, key, resp.status_code, resp.content_type, resp.get_data()
+            )
+        return resp
+
+    return wrapper
+
+
 # STATIC FILES
 @app.route("/")
 def server():
-    return flask.helpers.send_from_directory(app.static_folder, "index.html")
+    return _compress.send_static_file(app.static_folder, "index.html")
+
+
+def static_file(filename):
+    return _compress.send_static_file(app.static_folder, filename)
+
+
+app.view_functions["static"] = static_file
+
+
+# METRICS
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """@api {get} /metrics Get metrics for all workers, in the Prometheus text format"""
+    data = _metrics.metrics_data()
+    if data is None:
+        return response(404, error="Metrics are not enabled")
+
+    return flask.Response(data, mimetype=_metrics.CONTENT_TYPE)
+
+
+# DEVELOPMENT ROUTES
+@app.route("/api/dev/queries", methods=["GET"])
+def get_slowest_queries():
+    """@api {get} /api/dev/queries Get the statements with the most total time in this
+    worker process (only available in debug mode)
+
+    @apiQuery limit {Number} The number of statements to return, defaults to 20
+    @apiSuccess {Object[]} queries An array of objects with keys `fingerprint`,
+        `count`, `rows`, `total_ms`, `mean_ms`, `max_ms`
+    """
+    if not app.debug:
+        return response(404, error="Not found")
+
+    limit = flask.request.args.get("limit", 20, type=int)
+    return response(200, contents=_queries.slowest(limit))
+
+
+# PROFILING ROUTES
+@app.route("/api/profile", methods=["GET"])
+def get_profiles():
+    """@api {get} /api/profile List the saved request profiles (admins only)
+
+    @apiSuccess {Object[]} profiles An array of objects with keys `request_id`, `kind`,
+        `size`, `created`
+    """
+    user = get_user()
+    if user is None or not user.get("admin"):
+        return response(403, error="Forbidden")
+
+    return response(200, contents=_profile.list_profiles())
+
+
+@app.route("/api/profile/<request_id>/<kind>", methods=["GET"])
+def get_profile(request_id, kind):
+    """@api {get} /api/profile/:request_id/:kind Download a saved request profile
+    (admins only)
+
+    @apiParam {String} request_id The ID of the profiled request
+    @apiParam {String} kind The kind of profile: `cpu` (a cProfile stats file, for
+        `pstats` or snakeviz) or `memory` (a text report of the top allocation sites)
+    """
+    user = get_user()
+    if user is None or not user.get("admin"):
+        return response(403, error="Forbidden")
+
+    path = _profile.profile_path(request_id, kind)
+    if path is None or not os.path.exists(path):
+        return response(404, error=f"No {kind} profile for request {request_id}.")
+
+    return flask.send_file(path, as_attachment=True)
 
 
 # AUTHENTICATION ROUTES
@@ -148,6 +595,9 @@ def register_user():
 
 # SPECIES/REACTION ROUTES
 @app.route("/api/species/connectivity", methods=["GET"])
+@conditional("species_connectivity")
+@admitted("read")
+@query_timeout(QUERY_TIMEOUT)
 def get_species_connectivities():
     """@api {get} /api/species/connectivity Get all species connectivities
 
@@ -163,21 +613,108 @@ def get_species_connectivities():
 
 
 @app.route("/api/reaction/connectivity", methods=["GET"])
+@conditional("reaction_connectivity", "reaction_connectivity_species")
+@admitted("read")
+@query_timeout(QUERY_TIMEOUT)
 def get_reaction_connectivities():
     """@api {get} /api/reaction/connectivity Get all reaction connectivities
 
     @apiQuery formula {String} A formula to search for, e.g. 'CH4O'
     @apiQuery partial If present, allows for partial formula matches
+    @apiQuery species {String} A species that the reactions must involve, e.g. '[OH]';
+        may be repeated, to require several species
+    @apiQuery key_type {String} The type of the species keys; options: "smiles",
+        "inchi", "amchi", "inchi_key", "amchi_key", "inchi_hash", "amchi_hash", "id" (a
+        connectivity ID); defaults to "smiles"
+    @apiQuery role {String} The role of the species; options: "reactant", "product",
+        "either"; defaults to "either"
     @apiSuccess {Object[]} reaction An array of objects with keys `conn_id`, `formula`,
         `conn_smiles`, `conn_inchi`, `conn_inchi_hash`, `conn_amchi`, `conn_amchi_hash`
     """
     fml_str = flask.request.args.get("formula")
     is_partial = flask.request.args.get("partial") is not None
-    reaction_conns = query.search_reaction_connectivities(fml_str, is_partial)
+    spc_keys = flask.request.args.getlist("species")
+    key_type = flask.request.args.get("key_type", "smiles").lower()
+    role = flask.request.args.get("role", "either").lower()
+
+    if role not in ("reactant", "product", "either"):
+        return response(400, error=f"Invalid role {role}")
+
+    spc_ids = None
+    if spc_keys:
+        try:
+            spc_ids = lookup_species_connectivity_ids(spc_keys, key_type)
+        except ValueError as err:
+            return response(400, error=str(err))
+        # A species that isn't in the database doesn't take part in any reactions
+        if None in spc_ids:
+            return response(200, contents=[])
+
+    reaction_conns = query.search_reaction_connectivities(
+        fml_str, is_partial, species_ids=spc_ids, role=role
+    )
     return response(200, contents=reaction_conns)
 
 
+@app.route("/api/reaction/pathway", methods=["GET"])
+@conditional("reaction_connectivity")
+@admitted("read")
+@query_timeout(QUERY_TIMEOUT)
+def get_reaction_pathways():
+    """@api {get} /api/reaction/pathway Find reaction pathways between two species
+
+    @apiQuery source {String} The species to start from, e.g. 'CCO'
+    @apiQuery target {String} The species to end at, e.g. 'C=O'
+    @apiQuery key_type {String} The type of the species keys; options: "smiles",
+        "inchi", "amchi", "inchi_key", "amchi_key", "inchi_hash", "amchi_hash", "id" (a
+        connectivity ID); defaults to "smiles"
+    @apiQuery max_steps {Number} The most reactions in a pathway; defaults to 3
+    @apiQuery limit {Number} The most pathways to return; defaults to 20
+    @apiQuery reversible If present, allows reactions to run in reverse
+    @apiQuery exclude {String} A species not to pass through, e.g. '[OH]'; may be
+        repeated
+    @apiSuccess {Object[][]} pathways The pathways, shortest first; each step is an
+        object with keys `reaction_conn_id`, `conn_smiles`, `from_conn_id`,
+        `to_conn_id`, and `reverse`
+    """
+    source = flask.request.args.get("source")
+    target = flask.request.args.get("target")
+    key_type = flask.request.args.get("key_type", "smiles").lower()
+    max_steps = flask.request.args.get("max_steps", 3, type=int)
+    limit = flask.request.args.get("limit", 20, type=int)
+    reversible = flask.request.args.get("reversible") is not None
+    exclude_keys = flask.request.args.getlist("exclude")
+
+    if source is None or target is None:
+        return response(400, error="Both a source and a target are required")
+    if not 1 <= max_steps <= PATHWAY_MAX_STEPS:
+        return response(400, error=f"max_steps must be 1-{PATHWAY_MAX_STEPS}")
+    if not 1 <= limit <= PATHWAY_MAX_LIMIT:
+        return response(400, error=f"limit must be 1-{PATHWAY_MAX_LIMIT}")
+
+    try:
+        source_id, target_id, *exclude_ids = lookup_species_connectivity_ids(
+            [source, target, *exclude_keys], key_type
+        )
+    except ValueError as err:
+        return response(400, error=str(err))
+    if source_id is None or target_id is None:
+        return response(404, error="The source or target species was not found.")
+
+    pathways = query.find_reaction_pathways(
+        source_id,
+        target_id,
+        max_steps=max_steps,
+        limit=limit,
+        reversible=reversible,
+        exclude_ids=[i for i in exclude_ids if i is not None],
+    )
+    return response(200, contents=pathways)
+
+
 @app.route("/api/species/connectivity", methods=["POST"])
+@idempotent
+@admitted("heavy")
 def add_species_connectivity():
     """@api {post} /api/species/connectivity Add a new species connectivity
 
@@ -190,23 +727,21 @@ def add_species_connectivity():
 
     smi = flask.request.json.get("smiles")
 
-    # 1. Add the species
-    status, error = query.add_species_by_smiles_connectivity(smi)
+    # 1. Add the species and look up its connectivity ID
+    status, error, id = add_connectivity(smi)
     if status >= 400:
         return response(status, error=error)
 
-    # 2. Look up the connectivity ID
-    id = query.lookup_species_connectivity(smi, id_only=True)
-    print("The ID for this connectivity is", id)
-
-    # 3. Add these species to the user's "My Data" collection
-    print(f"Adding the species to collection {coll_id}")
+    # 2. Add these species to the user's "My Data" collection
+    app.logger.debug("Adding the species to collection %s", coll_id)
     query.add_species_connectivity_to_collection(coll_id, id)
 
     return response(201)
 
 
 @app.route("/api/reaction/connectivity", methods=["POST"])
+@idempotent
+@admitted("heavy")
 def add_reaction_connectivity():
     """@api {post} /api/reaction/connectivity Add a new reaction connectivity
 
@@ -217,23 +752,22 @@ def add_reaction_connectivity():
         return response(401, error="Unauthorized")
 
     smi = flask.request.json.get("smiles")
-    status, error = query.add_reaction_by_smiles_connectivity(smi)
+    status, error, id = add_connectivity(smi, reaction=True)
     if status >= 400:
         return response(status, error=error)
 
-    id = query.lookup_reaction_connectivity(smi, id_only=True)
-    print("The ID for this connectivity is", id)
-
     # 3. Add these reaction to the user's "My Data" collection
     coll_id = query.lookup_user_collection(user["id"], "My Data", id_only=True)
     if coll_id is not None:
-        print(f"Adding the reaction to collection {coll_id}")
+        app.logger.debug("Adding the reaction to collection %s", coll_id)
         query.add_reaction_connectivity_to_collection(coll_id, id)
 
     return response(201)
 
 
 @app.route("/api/species/connectivity/batch", methods=["POST"])
+@idempotent
+@admitted("heavy")
 def add_species_connectivities():
     """@api {post} /api/species/connectivity Add new connectivity species in batch
 
@@ -246,45 +780,50 @@ def add_species_connectivities():
 
     smis = flask.request.json.get("smilesList")
     for smi in smis:
-        # 1. Add the species
-        status, error = query.add_species_by_smiles_connectivity(smi)
+        # 1. Add the species and look up its connectivity ID
+        status, error, id = add_connectivity(smi)
         if status >= 400:
             return response(status, error=error)
 
-        # 2. Look up the connectivity ID
-        id = query.lookup_species_connectivity(smi, id_only=True)
-        print("The ID for this connectivity is", id)
-
-        # 3. Add these species to the user's "My Data" collection
-        print(f"Adding the species to collection {coll_id}")
+        # 2. Add these species to the user's "My Data" collection
+        app.logger.debug("Adding the species to collection %s", coll_id)
         query.add_species_connectivity_to_collection(coll_id, id)
 
     return response(201)
 
 
 @app.route("/api/species/connectivity/<id>", methods=["GET"])
+@conditional("species_connectivity", "species_estate", "species")
+@admitted("read")
+@query_timeout(QUERY_TIMEOUT)
 def get_species_details_by_connectivity(id):
     """@api {get} /api/species/connectivity/:id Get details for one connectivity species
 
     @apiparam {Number} id The ID of the connectivity species
     @apiSuccess {Object[]} species An array of objects with keys `id`, `geometry`,
-        `smiles`, `inchi`, `amchi`, `amchi_key`, `estate_id`, `spin_mult`, `conn_id`,
-        `formula`, `svg_string`, `conn_smiles`, `conn_inchi`, `conn_inchi_hash`,
-        `conn_amchi`, `conn_amchi_hash`
+        `geometry_status` ("pending" until the worker has generated the geometry),
+        `smiles`, `inchi`, `amchi`, `amchi_key`, `estate_id`, `spin_mult`,
+        `stereo_count`, `conn_id`, `formula`, `svg_string`, `conn_smiles`, `conn_inchi`,
+        `conn_inchi_hash`, `conn_amchi`, `conn_amchi_hash`
     """
     species_data = query.get_species_by_connectivity(id)
     return response(200, contents=species_data)
 
 
 @app.route("/api/reaction/connectivity/<id>", methods=["GET"])
+@conditional("reaction_connectivity", "reaction", "reaction_estate", "reaction_ts")
+@admitted("read")
+@query_timeout(QUERY_TIMEOUT)
 def get_reaction_details_by_connectivity(id):
     """@api {get} /api/reaction/connectivity/:id Get details for one connectivity reaction
 
     @apiparam {Number} id The ID of the connectivity reaction
-    @apiSuccess {Object[]} reaction An array of objects with keys `id`, `geometry`,
-        `smiles`, `inchi`, `amchi`, `amchi_key`, `estate_id`, `spin_mult`, `conn_id`,
-        `formula`, `svg_string`, `conn_smiles`, `conn_inchi`, `conn_inchi_hash`,
-        `conn_amchi`, `conn_amchi_hash`
+    @apiSuccess {Object[]} reaction An array of objects with keys `id`, `geometries`,
+        `geometry_statuses` ("pending" until the worker has generated the geometry),
+        `geometries_pending`, `smiles`, `classes`, `amchis`, `amchi_keys`, `ts_ids`,
+        `spin_mult`, `conn_id`, `formula`, `conn_smiles`, `r_conn_ids`, `p_conn_ids`,
+        `r_amchi`, `p_amchi`, `r_amchi_key`, `p_amchi_key`, `r_inchis`, `p_inchis`,
+        `r_amchis`, `p_amchis`, `r_amchi_keys`, `p_amchi_keys`
     """
     reaction_data = query.get_reactions_by_connectivity(id)
     return response(200, contents=reaction_data)
@@ -323,6 +862,7 @@ def delete_reaction_connectivity(id):
 
 
 @app.route("/api/species/<id>", methods=["PUT"])
+@admitted("heavy")
 def update_species_geometry(id):
     """@api {put} /api/species/:id Edit the geometry of one species
 
@@ -342,6 +882,7 @@ def update_species_geometry(id):
 
 
 @app.route("/api/reaction/ts/<id>", methods=["PUT"])
+@admitted("heavy")
 def update_reaction_geometry(id):
     """@api {put} /api/reaction/ts/:id Edit a TS geometry of one reaction
 
@@ -362,6 +903,19 @@ def update_reaction_geometry(id):
 
 # COLLECTION ROUTES
 @app.route("/api/collection", methods=["GET"])
+@conditional(
+    "collection",
+    "collection_species",
+    "collection_reactions",
+    "species_connectivity",
+    "species_estate",
+    "species",
+    "reaction_connectivity",
+    "reaction",
+    private=True,
+)
+@admitted("read")
+@query_timeout(QUERY_TIMEOUT)
 def get_user_collections():
     """@api {get} /api/collection Get all collections for this user
 
@@ -396,7 +950,7 @@ def add_user_collection():
         return response(401, error="Unauthorized")
 
     name = flask.request.json.get("name")
-    print("The new collection name:", name)
+    app.logger.debug("The new collection name: %s", name)
     query.add_user_collection(user["id"], name)
 
     return response(201)
@@ -416,7 +970,7 @@ def add_species_connectivities_to_user_collection(id):
     conn_ids = flask.request.json.get("conn_ids")
 
     for conn_id in conn_ids:
-        print(f"Adding species connectivity {conn_id} to collection {id}")
+        app.logger.debug("Adding species connectivity %s to collection %s", conn_id, id)
         query.add_species_connectivity_to_collection(id, conn_id)
 
     return response(201)
@@ -436,7 +990,9 @@ def add_reaction_connectivities_to_user_collection(id):
     conn_ids = flask.request.json.get("conn_ids")
 
     for conn_id in conn_ids:
-        print(f"Adding reaction connectivity {conn_id} to collection {id}")
+        app.logger.debug(
+            "Adding reaction connectivity %s to collection %s", conn_id, id
+        )
         query.add_reaction_connectivity_to_collection(id, conn_id)
 
     return response(201)
@@ -456,7 +1012,9 @@ def remove_species_connectivities_from_user_collection(id):
     conn_ids = flask.request.json.get("conn_ids")
 
     for conn_id in conn_ids:
-        print(f"Adding connectivity {conn_id} to collection {id}")
+        app.logger.debug(
+            "Removing species connectivity %s from collection %s", conn_id, id
+        )
         query.remove_species_connectivity_from_collection(id, conn_id)
 
     return response(204)
@@ -476,13 +1034,32 @@ def remove_reaction_connectivities_from_user_collection(id):
     conn_ids = flask.request.json.get("conn_ids")
 
     for conn_id in conn_ids:
-        print(f"Adding connectivity {conn_id} to collection {id}")
+        app.logger.debug(
+            "Removing reaction connectivity %s from collection %s", conn_id, id
+        )
         query.remove_reaction_connectivity_from_collection(id, conn_id)
 
     return response(204)
 
 
 @app.route("/api/collection/<id>", methods=["GET"])
+@conditional(
+    "collection",
+    "collection_species",
+    "collection_reactions",
+    "species_connectivity",
+    "species_estate",
+    "species",
+    "reaction_connectivity",
+    "reaction",
+    "reaction_estate",
+    "reaction_ts",
+    "reaction_reactants",
+    "reaction_products",
+    private=True,
+)
+@admitted("read")
+@query_timeout(EXPORT_QUERY_TIMEOUT)
 def get_user_collection_data(id):
     """@api {get} /api/collection Get the data from a collection
 
@@ -502,6 +1079,49 @@ def get_user_collection_data(id):
     return response(200, contents=coll_data)
 
 
+@app.route("/api/collection/<id>/npz", methods=["GET"])
+@conditional(
+    "collection",
+    "collection_species",
+    "collection_reactions",
+    "species_connectivity",
+    "species_estate",
+    "species",
+    "reaction_connectivity",
+    "reaction",
+    "reaction_estate",
+    "reaction_ts",
+    private=True,
+)
+@admitted("read")
+@query_timeout(EXPORT_QUERY_TIMEOUT)
+def get_user_collection_npz(id):
+    """@api {get} /api/collection/:id/npz Get the geometries from a collection as NumPy
+    arrays, in an .npz archive
+
+    @apiParam {Number} id The ID of the collection
+
+    @apiSuccess {File} collection The .npz archive; arrays `atomic_numbers`,
+        `coordinates`, `offsets`, `metadata` (see `flame_data.export.collection_npz`)
+    """
+    user = get_user()
+    if user is None:
+        return response(401, error="Unauthorized")
+
+    name = query.get_collection_name(id)
+    if name is None:
+        return response(404, error=f"No resource with ID {id} was found.")
+
+    species_rows, ts_rows = query.get_collection_geometries(id)
+    npz_data = export.collection_npz(species_rows, ts_rows)
+    return flask.send_file(
+        io.BytesIO(npz_data),
+        mimetype="application/octet-stream",
+        as_attachment=True,
+        download_name=f"{name.replace(' ', '_')}.npz",
+    )
+
+
 @app.route("/api/collection/<id>", methods=["DELETE"])
 def delete_user_collection(id):
     """@api {get} /api/collection Get the data from a collection
@@ -0,0 +1,112 @@
+import gzip
+import mimetypes
+import os
+
+import flask
+
+from flame_data import _metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses smaller than this (in bytes) aren't worth compressing
+MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 500))
+
+COMPRESSIBLE_MIMETYPES = ("application/json", "image/svg+xml", "text/")
+
+# Vite puts its content-hashed build output here, so these files never change
+HASHED_ASSET_PREFIX = "assets/"
+
+
+def available_encodings() -> list:
+    """Get the content encodings that can be used, in order of preference
+
+    :return: The content encodings
+    :rtype: list
+    """
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def compress_response(resp: flask.Response) -> flask.Response:
+    """Compress a dynamic response, if the client accepts it and it is worth it
+
+    :param resp: The response
+    :type resp: flask.Response
+    :return: The response, compressed if appropriate
+    :rtype: flask.Response
+    """
+    resp.vary.add("Accept-Encoding")
+
+    if (
+        resp.status_code < 200
+        or resp.status_code in (204, 304)
+        or resp.direct_passthrough
+        or "Content-Encoding" in resp.headers
+        or not (resp.mimetype or "").startswith(COMPRESSIBLE_MIMETYPES)
+        or resp.content_length is None
+        or resp.content_length < MIN_SIZE
+    ):
+        return resp
+
+    encoding = flask.request.accept_encodings.best_match(available_encodings())
+    if encoding is None:
+        return resp
+
+    data = resp.get_data()
+    if encoding == "br":
+        data = brotli.compress(data, quality=4)
+    else:
+        data = gzip.compress(data, compresslevel=6)
+
+    resp.set_data(data)
+    resp.headers["Content-Encoding"] = encoding
+    return resp
+
+
+def send_static_file(folder: str, filename: str) -> flask.Response:
+    """Send a static file, using a precompressed version of it if there is one
+
+    The precompressed versions (`.br`, `.gz`) are generated when the frontend is built
+
+    :param folder: The static folder
+    :type folder: str
+    :param filename: The path of the file within the static folder
+    :type filename: str
+    :return: The response
+    :rtype: flask.Response
+    """
+    encodings = {"br": ".br", "gzip": ".gz"}
+    offered = [
+        e
+        for e, ext in encodings.items()
+        if os.path.isfile(os.path.join(folder, filename + ext))
+    ]
+    encoding = flask.request.accept_encodings.best_match(offered) if offered else None
+
+    if (
+        "gzip" in flask.request.accept_encodings
+        or "br" in flask.request.accept_encodings
+    ):
+        _metrics.observe_cache("precompressed_static", encoding is not None)
+
+    mimetype, _ = mimetypes.guess_type(filename)
+    if encoding is None:
+        resp = flask.send_from_directory(folder, filename, mimetype=mimetype)
+    else:
+        resp = flask.send_from_directory(
+            folder,
+            filename + encodings[encoding],
+            mimetype=mimetype,
+            download_name=os.path.basename(filename),
+        )
+        resp.headers["Content-Encoding"] = encoding
+    resp.vary.add("Accept-Encoding")
+
+    if filename.startswith(HASHED_ASSET_PREFIX):
+        resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    else:
+        resp.headers["Cache-Control"] = "no-cache"
+
+    return resp
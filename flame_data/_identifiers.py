@@ -0,0 +1,174 @@
+"""Memoized identifiers for SMILES strings
+
+Converting a SMILES string to an InChI or AMChI is one of the slowest steps in looking
+up or submitting a species, and the same few species (O2, OH, H2O, ...) come up over
+and over. Here, the identifiers computed from each raw SMILES string that is submitted
+are saved in the `smiles_identifier` table. Lookups read from it, but don't write to it,
+so that arbitrary SMILES strings from clients can't grow it without bound. A bounded LRU
+cache in each worker sits in front of it.
+
+Lookups by other kinds of key go straight to `chem`, since those are cheap to convert.
+"""
+
+import collections
+import os
+import threading
+from typing import List, Tuple, Union
+
+import automol
+import dotenv
+
+from flame_data import _metrics, chem
+from flame_data._pool import pg_connection, pg_cursor
+from flame_data.utils import is_nonstring_sequence
+
+dotenv.load_dotenv()
+
+LRU_SIZE = int(os.getenv("IDENTIFIER_CACHE_SIZE", "10000"))
+
+# The memoized identifiers, by column of the `smiles_identifier` table
+COLUMNS = {
+    "conn_inchi_hash": lambda smi: chem.species_connectivity_chi_hash(smi)[0],
+    "amchi_key": lambda smi: chem.species_amchi_key(smi),
+}
+
+_lru = collections.OrderedDict()
+_lru_lock = threading.Lock()
+
+
+def smiles_identifiers(smis: List[str], column: str, save: bool = False) -> List[str]:
+    """Get one identifier for each of several SMILES strings
+
+    Checks the in-process cache, then the database, and only computes the identifiers
+    that are in neither
+
+    :param smis: SMILES strings
+    :type smis: List[str]
+    :param column: The identifier; a key of `COLUMNS`
+    :type column: str
+    :param save: Save the computed identifiers to the database for next time? For
+        SMILES strings that are being submitted; default False
+    :type save: bool, optional
+    :return: The identifiers, in the same order
+    :rtype: List[str]
+    :raises ValueError: If the column isn't one of `COLUMNS`
+    """
+    if column not in COLUMNS:
+        raise ValueError(f"Invalid identifier column {column}")
+
+    ids = {}
+
+    # 1. The in-process cache
+    with _lru_lock:
+        for smi in smis:
+            val = _lru.get((smi, column))
+            if val is not None:
+                _lru.move_to_end((smi, column))
+                ids[smi] = val
+    for smi in smis:
+        _metrics.observe_cache("identifier_lru", smi in ids)
+
+    # 2. The database
+    missing = sorted({s for s in smis if s not in ids})
+    if missing:
+        query_string = f"""
+            SELECT smiles, {column} AS value FROM smiles_identifier
+            WHERE smiles = ANY(%s) AND {column} IS NOT NULL;
+        """
+        with pg_connection() as conn:
+            with pg_cursor(conn) as cursor:
+                cursor.execute(query_string, [missing])
+                found = {r["smiles"]: r["value"].strip() for r in cursor.fetchall()}
+        for smi in missing:
+            _metrics.observe_cache("identifier_table", smi in found)
+        ids.update(found)
+        _lru_add({(s, column): v for s, v in found.items()})
+
+    # 3. Compute the rest, and save them if requested
+    missing = [s for s in missing if s not in ids]
+    if missing:
+        computed = {s: COLUMNS[column](s) for s in missing}
+        ids.update(computed)
+        _lru_add({(s, column): v for s, v in computed.items()})
+
+    if missing and save:
+        query_string = f"""
+            INSERT INTO smiles_identifier (smiles, {column})
+            VALUES (%(smiles)s, %(value)s)
+            ON CONFLICT (smiles) DO UPDATE SET {column} = EXCLUDED.{column};
+        """
+        query_params = [{"smiles": s, "value": v} for s, v in computed.items()]
+        with pg_connection() as conn:
+            with pg_cursor(conn) as cursor:
+                cursor.executemany(query_string, query_params)
+
+    return [ids[s] for s in smis]
+
+
+def species_connectivity_chi_hash(
+    key: str, key_type: str = "smiles", save: bool = False
+) -> Tuple[str, bool]:
+    """Get a species connectivity ChI hash from an identifier, memoizing SMILES
+
+    See `chem.species_connectivity_chi_hash()`, and `smiles_identifiers()` for `save`
+    """
+    return species_connectivity_chi_hashes([key], key_type, save=save)[0]
+
+
+def species_connectivity_chi_hashes(
+    keys: List[str], key_type: str = "smiles", save: bool = False
+) -> List[Tuple[str, bool]]:
+    """Get species connectivity ChI hashes from identifiers, memoizing SMILES
+
+    See `chem.species_connectivity_chi_hash()`, and `smiles_identifiers()` for `save`
+    """
+    if key_type.lower() != "smiles":
+        return [chem.species_connectivity_chi_hash(k, key_type) for k in keys]
+
+    hashes = smiles_identifiers(keys, "conn_inchi_hash", save=save)
+    return [(h, False) for h in hashes]
+
+
+def reaction_connectivity_chi_hashes(
+    key: Union[str, Tuple[str, str]], key_type: str = "smiles", save: bool = False
+) -> Tuple[Tuple[str, str], bool]:
+    """Get a reaction connectivity ChI hash from an identifier, memoizing SMILES
+
+    The reactants and products are memoized separately, so that they can be shared
+    with other reactions and with species lookups
+
+    See `chem.reaction_connectivity_chi_hashes()`, and `smiles_identifiers()` for
+    `save`
+    """
+    if key_type.lower() != "smiles":
+        return chem.reaction_connectivity_chi_hashes(key, key_type)
+
+    if isinstance(key, str):
+        key = automol.smiles.reaction_reagents(key)
+
+    assert is_nonstring_sequence(key) and len(key) == 2, (
+        f"Key of type {key_type} requires a pair of strings identifying\n"
+        f"reactants and products, but received {key}."
+    )
+    rhash, phash = smiles_identifiers(list(key), "conn_inchi_hash", save=save)
+    return (rhash, phash), False
+
+
+def species_amchi_keys(keys: List[str], key_type: str = "smiles") -> List[str]:
+    """Get AMChI keys from identifiers, memoizing SMILES
+
+    See `chem.species_amchi_key()`
+    """
+    if key_type.lower() != "smiles":
+        return [chem.species_amchi_key(k, key_type) for k in keys]
+
+    return smiles_identifiers(keys, "amchi_key")
+
+
+def _lru_add(items: dict):
+    with _lru_lock:
+        _lru.update(items)
+        for key in items:
+            _lru.move_to_end(key)
+        while len(_lru) > LRU_SIZE:
+            _lru.popitem(last=False)
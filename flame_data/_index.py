@@ -0,0 +1,215 @@
+"""In-process index of the connectivity hashes in the database
+
+Lets submissions check whether a species or reaction connectivity already exists
+without a database round trip. Each worker process keeps the InChI and AMChI
+connectivity hashes of both connectivity tables in memory. They are loaded on first
+use, and then kept current incrementally.
+
+The index is synced at most once every `IDENTIFIER_INDEX_SYNC` seconds, and only if
+the table's generation counter (see `database.sql`) has changed. A sync fetches the
+rows with IDs past the last one seen, then compares row counts. If the counts differ,
+rows were deleted or committed out of ID order, and the index is reloaded.
+
+A hit means that the connectivity existed as of the last sync. A miss can be out of
+date by up to the sync interval, so callers should check the database before adding
+anything (under the advisory lock, as they already do).
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+import dotenv
+import numpy
+
+from flame_data import _metrics
+from flame_data._pool import pg_connection, pg_cursor
+
+dotenv.load_dotenv()
+
+ENABLED = os.getenv("IDENTIFIER_INDEX", "1").lower() not in ("0", "false", "no")
+SYNC_INTERVAL = float(os.getenv("IDENTIFIER_INDEX_SYNC", "5"))
+MERGE_SIZE = 4096  # Merge recent additions into the sorted array at this many
+
+logger = logging.getLogger(__name__)
+
+
+class HashSet:
+    """A compact set of fixed-width ASCII hashes
+
+    Loaded hashes are stored in a sorted NumPy array, at one byte per character, and
+    looked up by binary search. Hashes added since are kept in a regular set, until
+    there are enough of them to merge into the array.
+    """
+
+    def __init__(self, width: int):
+        self.dtype = f"S{width}"
+        self._sorted = numpy.empty(0, dtype=self.dtype)
+        self._recent = set()
+
+    def load(self, hashes: Iterable[str]):
+        """Replace the contents of the set"""
+        self._sorted = numpy.unique(numpy.array(list(hashes), dtype=self.dtype))
+        self._recent = set()
+
+    def add(self, hash_: str):
+        """Add a hash to the set"""
+        self._recent.add(hash_.encode("ascii"))
+        if len(self._recent) >= MERGE_SIZE:
+            recent = numpy.array(list(self._recent), dtype=self.dtype)
+            self._sorted = numpy.union1d(self._sorted, recent)
+            self._recent = set()
+
+    def __contains__(self, hash_: str) -> bool:
+        key = hash_.encode("ascii")
+        if key in self._recent:
+            return True
+        idx = numpy.searchsorted(self._sorted, key)
+        return bool(idx < len(self._sorted) and self._sorted[idx] == key)
+
+    def __len__(self) -> int:
+        return len(self._sorted) + len(self._recent)
+
+
+class ConnectivityIndex:
+    """The index of one connectivity table"""
+
+    def __init__(self, table_name: str, columns: Dict[str, str], width: int):
+        """
+        :param table_name: The name of the table
+        :param columns: SQL expressions for the hashes to index, by key type ("inchi"
+            or "amchi")
+        :param width: The width of the hashes
+        """
+        self.table_name = table_name
+        self.columns = columns
+        self.hash_sets = {k: HashSet(width) for k in columns}
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.generation = None
+        self.max_id = 0
+        self.count = 0
+        self.synced_at = 0.0
+
+    def contains(self, hash_: str, key_type: str = "inchi") -> Optional[bool]:
+        """Check whether a hash is in the table, as of the last sync
+
+        :param hash_: The hash
+        :type hash_: str
+        :param key_type: The type of hash; "inchi" or "amchi"
+        :type key_type: str
+        :return: Whether it is there, or None if the index isn't available
+        :rtype: Optional[bool]
+        """
+        if not ENABLED:
+            return None
+
+        try:
+            self.sync()
+        except Exception as exc:
+            logger.warning("Syncing the %s index failed: %s", self.table_name, exc)
+            return None
+
+        with self.lock:
+            hit = hash_ in self.hash_sets[key_type]
+        _metrics.observe_cache(f"{self.table_name}_index", hit)
+        return hit
+
+    def add(self, hashes: Dict[str, str]):
+        """Add the hashes of a connectivity that this process just added to the table
+
+        :param hashes: The hashes, by key type ("inchi" and "amchi")
+        :type hashes: Dict[str, str]
+        """
+        with self.lock:
+            if self.loaded:
+                for key_type, hash_ in hashes.items():
+                    self.hash_sets[key_type].add(hash_)
+
+    def invalidate(self):
+        """Reload the index on next use, after connectivities have been deleted"""
+        with self.lock:
+            self.loaded = False
+
+    def sync(self):
+        """Bring the index up to date, if the sync interval has passed"""
+        with self.lock:
+            if self.loaded and time.monotonic() - self.synced_at < SYNC_INTERVAL:
+                return
+
+            generation = self._generation()
+            if self.loaded and generation == self.generation:
+                self.synced_at = time.monotonic()
+                return
+
+            if self.loaded:
+                rows = self._fetch(after_id=self.max_id)
+                self._add_rows(rows)
+                if self._row_count() != self.count:
+                    self.loaded = False
+
+            if not self.loaded:
+                rows = self._fetch()
+                for key_type, hash_set in self.hash_sets.items():
+                    hash_set.load(r[key_type] for r in rows if r[key_type])
+                self.max_id = max((r["id"] for r in rows), default=0)
+                self.count = len(rows)
+                self.loaded = True
+
+            self.generation = generation
+            self.synced_at = time.monotonic()
+
+    def _add_rows(self, rows):
+        for row in rows:
+            for key_type, hash_set in self.hash_sets.items():
+                if row[key_type]:
+                    hash_set.add(row[key_type])
+            self.max_id = max(self.max_id, row["id"])
+        self.count += len(rows)
+
+    def _generation(self) -> int:
+        query_string = """
+            SELECT SUM(generation)::BIGINT AS generation FROM table_generation_log
+            WHERE table_name = %s;
+        """
+        with pg_connection() as conn:
+            with pg_cursor(conn) as cursor:
+                cursor.execute(query_string, [self.table_name])
+                row = cursor.fetchone()
+        return row["generation"] or 0
+
+    def _fetch(self, after_id: int = 0) -> list:
+        columns = ", ".join(f"{e} AS {k}" for k, e in self.columns.items())
+        query_string = f"""
+            SELECT id, {columns} FROM {self.table_name} WHERE id > %s;
+        """
+        with pg_connection() as conn:
+            with pg_cursor(conn) as cursor:
+                cursor.execute(query_string, [after_id])
+                return cursor.fetchall()
+
+    def _row_count(self) -> int:
+        query_string = f"""
+            SELECT COUNT(*) AS count FROM {self.table_name};
+        """
+        with pg_connection() as conn:
+            with pg_cursor(conn) as cursor:
+                cursor.execute(query_string)
+                return cursor.fetchone()["count"]
+
+
+SPECIES = ConnectivityIndex(
+    "species_connectivity",
+    {"inchi": "conn_inchi_hash", "amchi": "conn_amchi_hash"},
+    width=14,
+)
+REACTIONS = ConnectivityIndex(
+    "reaction_connectivity",
+    {
+        "inchi": "r_conn_inchi_hash || p_conn_inchi_hash",
+        "amchi": "r_conn_amchi_hash || p_conn_amchi_hash",
+    },
+    width=28,
+)
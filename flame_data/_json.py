@@ -0,0 +1,67 @@
+from flask.json.provider import DefaultJSONProvider
+
+from flame_data import _timing
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JSONProvider(DefaultJSONProvider):
+    """A JSON provider that encodes with orjson, if it is installed
+
+    Falls back on the standard library encoder otherwise. Either way, the output is
+    equivalent to that of Flask's default provider.
+    """
+
+    def dumps(self, obj, **kwargs) -> str:
+        """Serialize data as JSON
+
+        :param obj: The data to serialize
+        :return: The JSON string
+        :rtype: str
+        """
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+
+        return orjson.dumps(obj, default=self.default, option=self._option()).decode()
+
+    def loads(self, s, **kwargs):
+        """Deserialize data as JSON
+
+        :param s: The JSON string or bytes
+        :return: The data
+        """
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+
+        return orjson.loads(s)
+
+    @_timing.timed("json")
+    def response(self, *args, **kwargs):
+        """Serialize the given arguments as JSON, and return a response for it
+
+        Skips the intermediate string, since orjson encodes straight to bytes
+
+        :return: The response object
+        """
+        if orjson is None:
+            return super().response(*args, **kwargs)
+
+        obj = self._prepare_response_obj(args, kwargs)
+        option = self._option() | orjson.OPT_APPEND_NEWLINE
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=option),
+            mimetype=self.mimetype,
+        )
+
+    def _option(self) -> int:
+        # Dates go through the default handler, to be formatted the same way as Flask
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return option
@@ -0,0 +1,285 @@
+"""Prometheus metrics for the API and the chem pipeline
+
+Requires the optional `prometheus_client` package; without it, recording does nothing
+and there is nothing to serve.
+
+Under gunicorn, each worker is a separate process, so the workers write their values to
+files in `PROMETHEUS_MULTIPROC_DIR`, which are aggregated when the metrics are served
+(see `gunicorn.conf.py`, which sets this up). Without that variable, the values are
+simply kept in memory, which is fine for a single-process development server.
+"""
+
+import contextlib
+import functools
+import os
+import time
+from typing import Optional
+
+import flask
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+if prometheus_client is not None:
+    CONTENT_TYPE = prometheus_client.CONTENT_TYPE_LATEST
+    REQUEST_LATENCY = prometheus_client.Histogram(
+        "flame_data_request_duration_seconds",
+        "Request latency",
+        ["method", "route", "status"],
+    )
+    REQUESTS_IN_FLIGHT = prometheus_client.Gauge(
+        "flame_data_requests_in_flight",
+        "Requests currently being handled",
+        multiprocess_mode="livesum",
+    )
+    POOL_CONNECTIONS = prometheus_client.Gauge(
+        "flame_data_pool_connections",
+        "Database pool connections, by state (max, size, available)",
+        ["state"],
+        multiprocess_mode="livesum",
+    )
+    POOL_REQUESTS_WAITING = prometheus_client.Gauge(
+        "flame_data_pool_requests_waiting",
+        "Requests waiting for a database pool connection",
+        multiprocess_mode="livesum",
+    )
+    QUERIES_CANCELLED = prometheus_client.Counter(
+        "flame_data_queries_cancelled",
+        "Requests whose queries were cancelled, by reason (timeout, disconnect)",
+        ["route", "reason"],
+    )
+    CHEM_DURATION = prometheus_client.Histogram(
+        "flame_data_chem_duration_seconds",
+        "Chem pipeline run time, by builder function",
+        ["builder"],
+        buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+    )
+    SUBMISSION_STEREOISOMERS = prometheus_client.Histogram(
+        "flame_data_submission_stereoisomers",
+        "Number of stereoisomers generated per species submission",
+        buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+    )
+    SUBMISSION_TRANSITION_STATES = prometheus_client.Histogram(
+        "flame_data_submission_transition_states",
+        "Number of transition states generated per reaction submission",
+        buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+    )
+    ADMISSION_OCCUPANCY = prometheus_client.Gauge(
+        "flame_data_admission_requests",
+        "Requests holding admission slots, by budget and state (running, queued)",
+        ["budget", "state"],
+        multiprocess_mode="livesum",
+    )
+    ADMISSION_REJECTED = prometheus_client.Counter(
+        "flame_data_admission_rejected",
+        "Requests rejected for lack of an admission slot, by budget",
+        ["budget"],
+    )
+    CACHE_REQUESTS = prometheus_client.Counter(
+        "flame_data_cache_requests",
+        "Cache lookups, by cache and result (hit, miss)",
+        ["cache", "result"],
+    )
+
+
+# REQUESTS
+def start_request():
+    """Start measuring a request"""
+    if prometheus_client is None:
+        return
+
+    flask.g.metrics_start = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc()
+
+
+def observe_request(resp: flask.Response) -> flask.Response:
+    """Record the latency of a request
+
+    :param resp: The response
+    :type resp: flask.Response
+    :return: The response, unchanged
+    :rtype: flask.Response
+    """
+    start_time = flask.g.get("metrics_start")
+    if prometheus_client is None or start_time is None:
+        return resp
+
+    rule = flask.request.url_rule
+    REQUEST_LATENCY.labels(
+        method=flask.request.method,
+        route=rule.rule if rule is not None else "unmatched",
+        status=resp.status_code,
+    ).observe(time.perf_counter() - start_time)
+    return resp
+
+
+def finish_request(exc: Optional[BaseException] = None):
+    """Finish measuring a request, whether or not it succeeded
+
+    :param exc: The exception that ended the request, if any
+    :type exc: Optional[BaseException]
+    """
+    if prometheus_client is None or flask.g.pop("metrics_start", None) is None:
+        return
+
+    REQUESTS_IN_FLIGHT.dec()
+
+
+def observe_pool(pool):
+    """Record the current state of a database connection pool
+
+    :param pool: The pool
+    :type pool: psycopg_pool.ConnectionPool
+    """
+    if prometheus_client is None:
+        return
+
+    stats = pool.get_stats()
+    POOL_CONNECTIONS.labels(state="max").set(stats.get("pool_max", 0))
+    POOL_CONNECTIONS.labels(state="size").set(stats.get("pool_size", 0))
+    POOL_CONNECTIONS.labels(state="available").set(stats.get("pool_available", 0))
+    POOL_REQUESTS_WAITING.set(stats.get("requests_waiting", 0))
+
+
+def observe_query_cancelled(reason: str):
+    """Record a request whose queries were cancelled
+
+    :param reason: Why, "timeout" or "disconnect"
+    :type reason: str
+    """
+    if prometheus_client is None:
+        return
+
+    rule = flask.request.url_rule
+    route = rule.rule if rule is not None else "unmatched"
+    QUERIES_CANCELLED.labels(route=route, reason=reason).inc()
+
+
+# CHEM PIPELINE
+_recording = True
+
+
+def stop_recording():
+    """Stop recording chem metrics in this process
+
+    For the sandbox's child processes (see `_sandbox`), which would otherwise each
+    write their own set of files to `PROMETHEUS_MULTIPROC_DIR`. The parent times the
+    builder that it runs in the child instead.
+    """
+    global _recording
+    _recording = False
+
+
+@contextlib.contextmanager
+def builder_timer(name: str):
+    """Record the run time of a chem builder function
+
+    :param name: The name of the builder function
+    :type name: str
+    """
+    if prometheus_client is None or not _recording:
+        yield
+        return
+
+    with CHEM_DURATION.labels(builder=name).time():
+        yield
+
+
+def timed_builder(func):
+    """Decorate a chem builder function to record its run time"""
+    if prometheus_client is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with builder_timer(func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def observe_species_submission(nstereo: int):
+    """Record the number of stereoisomers generated for a new species
+
+    :param nstereo: The number of stereoisomers
+    :type nstereo: int
+    """
+    if prometheus_client is not None:
+        SUBMISSION_STEREOISOMERS.observe(nstereo)
+
+
+def observe_reaction_submission(nts: int):
+    """Record the number of transition states generated for a new reaction
+
+    :param nts: The number of transition states
+    :type nts: int
+    """
+    if prometheus_client is not None:
+        SUBMISSION_TRANSITION_STATES.observe(nts)
+
+
+# ADMISSION CONTROL
+def observe_admission(budget: str, state: str, delta: int):
+    """Record a request taking or releasing an admission slot
+
+    :param budget: The name of the budget
+    :type budget: str
+    :param state: The kind of slot, "running" or "queued"
+    :type state: str
+    :param delta: 1 for taking a slot, -1 for releasing one
+    :type delta: int
+    """
+    if prometheus_client is not None:
+        ADMISSION_OCCUPANCY.labels(budget=budget, state=state).inc(delta)
+
+
+def observe_admission_rejected(budget: str):
+    """Record a request being rejected for lack of an admission slot
+
+    :param budget: The name of the budget
+    :type budget: str
+    """
+    if prometheus_client is not None:
+        ADMISSION_REJECTED.labels(budget=budget).inc()
+
+
+# CACHES
+def observe_cache(cache: str, hit: bool):
+    """Record a cache lookup
+
+    The caches are the ETags of conditional GETs ("etag"), precompressed static files
+    ("precompressed_static"), stored idempotent responses ("idempotency"), and the
+    identifier caches and indexes ("identifier_lru", "identifier_table",
+    "<table>_index")
+
+    :param cache: The name of the cache
+    :type cache: str
+    :param hit: Was it a hit?
+    :type hit: bool
+    """
+    if prometheus_client is not None:
+        CACHE_REQUESTS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+# EXPOSITION
+def metrics_data() -> Optional[bytes]:
+    """Get the current metrics in the Prometheus text format
+
+    :return: The metrics, or None if `prometheus_client` is not installed
+    :rtype: Optional[bytes]
+    """
+    if prometheus_client is None:
+        return None
+
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+
+    return prometheus_client.generate_latest(registry)
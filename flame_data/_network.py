@@ -0,0 +1,271 @@
+"""In-process graph of the reaction network, for pathway searches
+
+Each species connectivity is a node, and each reaction connectivity adds an edge from
+each of its reactants to each of its products. The edges are stored in compressed
+sparse row (CSR) form, once in each direction: sorted node IDs, offsets into the edge
+arrays for each node, and the neighbor and reaction ID of each edge. They are built
+from the `r_conn_ids` and `p_conn_ids` of the reaction connectivities on first use.
+
+The graph is kept current much like the connectivity indexes (see `_index`). Before
+each search, if the table's generation has changed, the reactions with IDs past the
+last one seen are fetched. Their edges are kept in a small adjacency
+dictionary until there are enough of them to rebuild the arrays. If the row count
+doesn't match afterwards, the graph is reloaded. The generation is checked every time,
+with no sync interval, since the search responses are cached by generation (see
+`_app.conditional`), and a search on an older graph would be cached as current.
+"""
+
+import collections
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+import numpy
+
+from flame_data._pool import pg_connection, pg_cursor
+
+MERGE_SIZE = 4096  # Rebuild the arrays with the recent edges at this many
+MAX_EXPANSIONS = 100_000  # Stop a pathway search after extending this many paths
+
+
+class AdjacencyCSR:
+    """The edges out of each node, in compressed sparse row form"""
+
+    def __init__(self, sources, targets, reactions):
+        """
+        :param sources: The source node ID of each edge
+        :param targets: The target node ID of each edge
+        :param reactions: The reaction ID of each edge
+        """
+        sources = numpy.asarray(sources, dtype=numpy.int64)
+        order = numpy.argsort(sources, kind="stable")
+        self.nodes, counts = numpy.unique(sources, return_counts=True)
+        self.offsets = numpy.concatenate(([0], numpy.cumsum(counts)))
+        self.targets = numpy.asarray(targets, dtype=numpy.int64)[order]
+        self.reactions = numpy.asarray(reactions, dtype=numpy.int64)[order]
+
+    def neighbors(self, node: int) -> Iterable[Tuple[int, int]]:
+        """Get the edges out of a node
+
+        :param node: The node ID
+        :type node: int
+        :return: The target node ID and reaction ID of each edge
+        :rtype: Iterable[Tuple[int, int]]
+        """
+        idx = numpy.searchsorted(self.nodes, node)
+        if idx == len(self.nodes) or self.nodes[idx] != node:
+            return ()
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return zip(self.targets[start:end].tolist(), self.reactions[start:end].tolist())
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+
+class ReactionNetwork:
+    """The reaction network graph"""
+
+    table_name = "reaction_connectivity"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.generation = None
+        self.max_id = 0
+        self.count = 0
+        self._clear()
+
+    def pathways(
+        self,
+        source: int,
+        target: int,
+        max_steps: int = 3,
+        limit: int = 20,
+        reversible: bool = False,
+        exclude: Iterable[int] = (),
+    ) -> List[List[dict]]:
+        """Find the reaction pathways from one species to another, shortest first
+
+        Runs a breadth-first search over paths, only extending a path through species
+        that can still reach the target in the steps that are left. These distances
+        come from a first search, back from the target. A pathway doesn't visit a
+        species or use a reaction twice.
+
+        :param source: The species connectivity ID to start from
+        :type source: int
+        :param target: The species connectivity ID to end at
+        :type target: int
+        :param max_steps: The most reactions in a pathway, defaults to 3
+        :type max_steps: int, optional
+        :param limit: The most pathways to return, defaults to 20
+        :type limit: int, optional
+        :param reversible: Allow reactions to run in reverse?, defaults to False
+        :type reversible: bool, optional
+        :param exclude: Species not to pass through, such as common radicals
+        :type exclude: Iterable[int], optional
+        :return: The pathways; each step has keys `reaction_conn_id`,
+            `from_conn_id`, `to_conn_id`, and `reverse`, which is true if the step runs
+            from products to reactants
+        :rtype: List[List[dict]]
+        """
+        self.sync()
+
+        exclude = set(exclude) - {source, target}
+        with self.lock:
+            distances = self._distances(target, max_steps, reversible, exclude)
+            if source == target or source not in distances:
+                return []
+
+            pathways = []
+            expansions = 0
+            queue = collections.deque([((source,), ())])
+            while queue and len(pathways) < limit and expansions < MAX_EXPANSIONS:
+                nodes, steps = queue.popleft()
+                if nodes[-1] == target:
+                    pathways.append(list(steps))
+                    continue
+
+                steps_left = max_steps - len(steps) - 1
+                for node, rxn_id, reverse in self._neighbors(nodes[-1], reversible):
+                    if node in nodes or node in exclude:
+                        continue
+                    if any(s["reaction_conn_id"] == rxn_id for s in steps):
+                        continue
+                    if distances.get(node, max_steps + 1) > steps_left:
+                        continue
+                    step = {
+                        "reaction_conn_id": rxn_id,
+                        "from_conn_id": nodes[-1],
+                        "to_conn_id": node,
+                        "reverse": reverse,
+                    }
+                    queue.append(((*nodes, node), (*steps, step)))
+                    expansions += 1
+
+        return pathways
+
+    def invalidate(self):
+        """Reload the graph on next use, after reactions have been deleted"""
+        with self.lock:
+            self.loaded = False
+
+    def sync(self):
+        """Bring the graph up to date
+
+        Afterwards, it is at least as new as any table generation read before the call
+        """
+        with self.lock:
+            generation = self._generation()
+            if self.loaded and generation == self.generation:
+                return
+
+            if self.loaded:
+                rows = self._fetch(after_id=self.max_id)
+                self._add_rows(rows)
+                if self._row_count() != self.count:
+                    self.loaded = False
+
+            if not self.loaded:
+                self._clear()
+                self._add_rows(self._fetch())
+                self._merge()
+                self.loaded = True
+
+            self.generation = generation
+
+    def _clear(self):
+        self._edges = numpy.empty((0, 3), dtype=numpy.int64)
+        self._forward = AdjacencyCSR([], [], [])
+        self._backward = AdjacencyCSR([], [], [])
+        self._recent = []
+        self._recent_forward = collections.defaultdict(list)
+        self._recent_backward = collections.defaultdict(list)
+        self.max_id = 0
+        self.count = 0
+
+    def _add_rows(self, rows):
+        for row in rows:
+            for rct in set(row["r_conn_ids"] or ()):
+                for prd in set(row["p_conn_ids"] or ()):
+                    if rct != prd:
+                        self._recent.append((rct, prd, row["id"]))
+                        self._recent_forward[rct].append((prd, row["id"]))
+                        self._recent_backward[prd].append((rct, row["id"]))
+            self.max_id = max(self.max_id, row["id"])
+        self.count += len(rows)
+
+        if len(self._recent) >= MERGE_SIZE:
+            self._merge()
+
+    def _merge(self):
+        recent = numpy.array(self._recent, dtype=numpy.int64).reshape(-1, 3)
+        self._edges = numpy.concatenate((self._edges, recent))
+        rcts, prds, rxn_ids = self._edges.T
+        self._forward = AdjacencyCSR(rcts, prds, rxn_ids)
+        self._backward = AdjacencyCSR(prds, rcts, rxn_ids)
+        self._recent = []
+        self._recent_forward.clear()
+        self._recent_backward.clear()
+
+    def _neighbors(
+        self, node: int, reversible: bool, backward: bool = False
+    ) -> Iterable[Tuple[int, int, bool]]:
+        # Edges out of the node (or into it, if backward), flagging reversed reactions
+        directions = [backward, not backward] if reversible else [backward]
+        for reverse in directions:
+            csr, recent = (
+                (self._backward, self._recent_backward)
+                if reverse
+                else (self._forward, self._recent_forward)
+            )
+            for nbr, rxn_id in csr.neighbors(node):
+                yield nbr, rxn_id, reverse != backward
+            for nbr, rxn_id in recent.get(node, ()):
+                yield nbr, rxn_id, reverse != backward
+
+    def _distances(
+        self, target: int, max_steps: int, reversible: bool, exclude: set
+    ) -> Dict[int, int]:
+        # The number of steps from each species to the target, up to the maximum
+        distances = {target: 0}
+        frontier = [target]
+        for steps in range(1, max_steps + 1):
+            next_frontier = []
+            for node in frontier:
+                for nbr, _, _ in self._neighbors(node, reversible, backward=True):
+                    if nbr not in distances and nbr not in exclude:
+                        distances[nbr] = steps
+                        next_frontier.append(nbr)
+            frontier = next_frontier
+        return distances
+
+    def _generation(self) -> int:
+        query_string = """
+            SELECT SUM(generation)::BIGINT AS generation FROM table_generation_log
+            WHERE table_name = %s;
+        """
+        with pg_connection() as conn:
+            with pg_cursor(conn) as cursor:
+                cursor.execute(query_string, [self.table_name])
+                row = cursor.fetchone()
+        return row["generation"] or 0
+
+    def _fetch(self, after_id: int = 0) -> list:
+        query_string = f"""
+            SELECT id, r_conn_ids, p_conn_ids FROM {self.table_name} WHERE id > %s;
+        """
+        with pg_connection() as conn:
+            with pg_cursor(conn) as cursor:
+                cursor.execute(query_string, [after_id])
+                return cursor.fetchall()
+
+    def _row_count(self) -> int:
+        query_string = f"""
+            SELECT COUNT(*) AS count FROM {self.table_name};
+        """
+        with pg_connection() as conn:
+            with pg_cursor(conn) as cursor:
+                cursor.execute(query_string)
+                return cursor.fetchone()["count"]
+
+
+NETWORK = ReactionNetwork()
@@ -1,21 +1,102 @@
+import contextlib
+import contextvars
+import hashlib
 import os
+import select
+import socket
+import threading
+import time
+from typing import Optional
 
 import dotenv
 import psycopg
 import psycopg_pool
 
+from flame_data import _queries, _timing
+
 dotenv.load_dotenv()
 
 
-pool = psycopg_pool.ConnectionPool(
-    psycopg.conninfo.make_conninfo(
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        host=os.getenv("DB_HOST"),
-        port=os.getenv("DB_PORT"),
-        dbname=os.getenv("DB_NAME"),
-    ),
+conninfo = psycopg.conninfo.make_conninfo(
+    user=os.getenv("DB_USER"),
+    password=os.getenv("DB_PASSWORD"),
+    host=os.getenv("DB_HOST"),
+    port=os.getenv("DB_PORT"),
+    dbname=os.getenv("DB_NAME"),
 )
+pool = psycopg_pool.ConnectionPool(conninfo)
+
+
+class QueryScope:
+    """Settings and state for the queries run by one request
+
+    :param timeout: The statement timeout, in seconds, or None for the server default
+    :type timeout: Optional[float]
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.timeout = timeout
+        self.cancelled = False
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def start_query(self, conn):
+        """Mark a connection as running a query for this scope"""
+        with self._lock:
+            if self.cancelled:
+                raise psycopg.errors.QueryCanceled("The request was cancelled")
+            self._conn = conn
+
+    def finish_query(self):
+        """Mark the current query as finished"""
+        with self._lock:
+            self._conn = None
+
+    def cancel(self):
+        """Cancel the running query, if there is one, and any further queries
+
+        Can be called from any thread
+        """
+        with self._lock:
+            self.cancelled = True
+            if self._conn is not None:
+                self._conn.cancel()
+
+
+_scope = contextvars.ContextVar("query_scope", default=None)
+
+
+class InstrumentedCursor(psycopg.Cursor):
+    """A cursor that records its queries for the current request
+
+    Query time is added to the request's "db" timing, and each query is recorded by
+    fingerprint, to catch statements that are run in a loop. Queries can be cancelled
+    through the current `QueryScope`, if there is one.
+    """
+
+    def execute(self, query, params=None, **kwargs):
+        return self._run(super().execute, query, params, **kwargs)
+
+    def executemany(self, query, params_seq, **kwargs):
+        return self._run(super().executemany, query, params_seq, **kwargs)
+
+    def _run(self, method, query, params, **kwargs):
+        scope = _scope.get()
+        if scope is not None:
+            scope.start_query(self.connection)
+
+        start_time = time.perf_counter()
+        try:
+            with _timing.timer("db"):
+                result = method(query, params, **kwargs)
+        finally:
+            if scope is not None:
+                scope.finish_query()
+
+        # Only successful queries are recorded, so that a strict-mode repeat error
+        # can't hide the database's own error
+        _queries.record(query, self.rowcount, time.perf_counter() - start_time)
+        return result
 
 
 def pg_connection():
@@ -33,4 +114,117 @@ def pg_cursor(conn):
     :param conn: The connection context
     :return: The cursor
     """
-    return conn.cursor(row_factory=psycopg.rows.dict_row)
+    scope = _scope.get()
+    if scope is not None and scope.timeout is not None:
+        # Applies until the end of the transaction, so it only needs setting once per
+        # transaction, and never leaks into other requests using this connection
+        if conn.info.transaction_status == psycopg.pq.TransactionStatus.IDLE:
+            conn.execute(
+                "SELECT set_config('statement_timeout', %s, true);",
+                [str(int(scope.timeout * 1000))],
+            )
+
+    return InstrumentedCursor(conn, row_factory=psycopg.rows.dict_row)
+
+
+@contextlib.contextmanager
+def query_scope(timeout: Optional[float] = None, client_socket=None):
+    """Run queries within a scope, with a statement timeout and cancellation
+
+    If a client socket is given, a watchdog thread cancels the running query when the
+    client disconnects, since the response would be thrown away anyway. Either way, a
+    timed-out or cancelled query raises `psycopg.errors.QueryCanceled`.
+
+    :param timeout: The statement timeout, in seconds, defaults to None
+    :type timeout: Optional[float]
+    :param client_socket: The client's socket, defaults to None
+    :type client_socket: Optional[socket.socket]
+    :return: The scope
+    :rtype: QueryScope
+    """
+    scope = QueryScope(timeout)
+    token = _scope.set(scope)
+    stop = threading.Event()
+    if client_socket is not None:
+        watchdog = threading.Thread(
+            target=_watch_client, args=(client_socket, scope, stop), daemon=True
+        )
+        watchdog.start()
+
+    try:
+        yield scope
+    finally:
+        stop.set()
+        _scope.reset(token)
+
+
+def _watch_client(client_socket, scope: QueryScope, stop: threading.Event):
+    while not stop.wait(0.25):
+        try:
+            readable, _, _ = select.select([client_socket], [], [], 0)
+            # A closed connection is readable, with nothing left to read
+            disconnected = bool(readable) and not client_socket.recv(1, socket.MSG_PEEK)
+        except (OSError, ValueError):
+            disconnected = True
+
+        if disconnected:
+            scope.cancel()
+            return
+
+
+@contextlib.contextmanager
+def pg_advisory_lock(key: str, max_poll_interval: float = 1.0):
+    """Hold a Postgres advisory lock on a key, waiting for it if necessary
+
+    Since advisory locks are held by the database, this works across worker processes
+    and machines. The lock is taken on a dedicated connection, outside of the pool.
+    Otherwise, each lock holder would keep a pool connection checked out while it ran
+    the chem pipeline, and a few concurrent submissions could use up the pool that
+    their own inserts need.
+
+    Within a `QueryScope`, waiting for the lock counts as a query: it raises
+    `psycopg.errors.QueryCanceled` once the scope is cancelled, or once it has waited
+    longer than the scope's statement timeout.
+
+    :param key: The key to lock
+    :type key: str
+    :param max_poll_interval: The longest time between polls, in seconds
+    :type max_poll_interval: float, optional
+    """
+    lock_id = int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "big")
+    lock_id -= 1 << 63  # Postgres takes a signed 64-bit integer
+    interval = 0.05
+    scope = _scope.get()
+    deadline = None
+    if scope is not None and scope.timeout is not None:
+        deadline = time.monotonic() + scope.timeout
+
+    # The lock queries go straight through the connection, so that polling doesn't
+    # count towards the repeated query check. Polling, rather than blocking, lets the
+    # scope's cancellation and timeout interrupt a waiter.
+    with psycopg.connect(conninfo, autocommit=True) as conn:
+        while True:
+            (locked,) = conn.execute(
+                "SELECT pg_try_advisory_lock(%s);", [lock_id]
+            ).fetchone()
+            if locked:
+                break
+
+            if scope is not None and scope.cancelled:
+                raise psycopg.errors.QueryCanceled("The request was cancelled")
+            wait = interval
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    raise psycopg.errors.QueryCanceled("Timed out waiting for a lock")
+
+            time.sleep(wait)
+            interval = min(2 * interval, max_poll_interval)
+
+        try:
+            yield
+        finally:
+            # Closing the connection would also release the lock, but it may be
+            # broken
+            with contextlib.suppress(psycopg.Error):
+                conn.execute("SELECT pg_advisory_unlock(%s);", [lock_id])
@@ -0,0 +1,249 @@
+"""On-demand profiling of individual requests
+
+A request is profiled if it has an `X-Profile` header or a `profile` query parameter,
+with a comma-separated list of modes:
+    - "cpu": run the request under cProfile, saving the stats as `<request ID>.prof`
+    - "memory": trace allocations with tracemalloc, saving the top allocation sites as
+      `<request ID>.memory.txt`
+
+Profiles are saved in `PROFILE_DIR`, which is shared by the workers on one machine.
+Note that tracemalloc traces the whole process, so with threaded workers its results
+can include allocations from concurrent requests.
+
+Chem computations run in sandbox child processes (see `_sandbox`), out of sight of the
+request's profilers, so they are profiled in the child, and the results are sent back
+and added to the request's profile.
+"""
+
+import cProfile
+import os
+import pstats
+import re
+import tempfile
+import time
+import tracemalloc
+from typing import List, Optional, Set
+
+import dotenv
+import flask
+
+dotenv.load_dotenv()
+
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR", os.path.join(tempfile.gettempdir(), "flame_data_profiles")
+)
+MODES = ("cpu", "memory")
+KIND_EXTENSIONS = {"cpu": ".prof", "memory": ".memory.txt"}
+MEMORY_TOP_COUNT = 50
+REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9_.-]{1,64}")
+
+
+def requested_modes() -> Set[str]:
+    """Get the profiling modes requested for the current request
+
+    :return: The modes; "cpu" and/or "memory"
+    :rtype: Set[str]
+    """
+    flag = flask.request.headers.get("X-Profile") or flask.request.args.get("profile")
+    if flag is None:
+        return set()
+
+    modes = {m.strip().lower() for m in flag.split(",")} & set(MODES)
+    # A bare flag, like `?profile` or `X-Profile: 1`, means CPU profiling
+    return modes or {"cpu"}
+
+
+def start(modes: Set[str]):
+    """Start profiling the current request
+
+    :param modes: The profiling modes; "cpu" and/or "memory"
+    :type modes: Set[str]
+    """
+    if "memory" in modes and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        flask.g.profile_memory = True
+
+    if "cpu" in modes:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            flask.g.profiler = profiler
+        except ValueError:
+            # Another profiler is already active in this thread
+            pass
+
+    flask.g.profile_start = time.perf_counter()
+
+
+def stop(request_id: str) -> List[str]:
+    """Stop profiling the current request, if it is being profiled, and save the results
+
+    :param request_id: The request ID, used to name the files
+    :type request_id: str
+    :return: The kinds of profile that were saved; "cpu" and/or "memory"
+    :rtype: List[str]
+    """
+    profiler = flask.g.pop("profiler", None)
+    profile_memory = flask.g.pop("profile_memory", False)
+    start_time = flask.g.pop("profile_start", None)
+    child_results = flask.g.pop("child_profiles", [])
+    if start_time is None:
+        return []
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    kinds = []
+
+    if profiler is not None:
+        profiler.disable()
+        stats = pstats.Stats(profiler)
+        for results in child_results:
+            if "cpu" in results:
+                stats.add(_ChildStats(results["cpu"]))
+        stats.dump_stats(profile_path(request_id, "cpu"))
+        kinds.append("cpu")
+
+    if profile_memory:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        lines = [
+            f"{flask.request.method} {flask.request.full_path}",
+            f"Wall time: {time.perf_counter() - start_time:.3f} s",
+            f"Traced memory: {current / 1e6:.1f} MB at the end, {peak / 1e6:.1f} MB peak",
+            f"Top {MEMORY_TOP_COUNT} allocation sites:",
+        ]
+        lines.extend(map(str, snapshot.statistics("lineno")[:MEMORY_TOP_COUNT]))
+        for results in child_results:
+            if "memory" in results:
+                peak, child_lines = results["memory"]
+                lines.append(f"Sandboxed chem computation: {peak / 1e6:.1f} MB peak")
+                lines.extend(child_lines)
+        with open(profile_path(request_id, "memory"), "w") as memory_file:
+            memory_file.write("\n".join(lines) + "\n")
+        kinds.append("memory")
+
+    return kinds
+
+
+def sandbox_modes() -> Set[str]:
+    """Get the profiling modes for work that the current request runs in a sandbox
+
+    :return: The modes that are active for the request; "cpu" and/or "memory"
+    :rtype: Set[str]
+    """
+    if not flask.has_request_context():
+        return set()
+
+    modes = set()
+    if flask.g.get("profiler") is not None:
+        modes.add("cpu")
+    if flask.g.get("profile_memory"):
+        modes.add("memory")
+    return modes
+
+
+def start_child(modes: Set[str]) -> Optional[cProfile.Profile]:
+    """Start profiling in a sandbox child process
+
+    :param modes: The profiling modes, from `sandbox_modes()`
+    :type modes: Set[str]
+    :return: The CPU profiler, if any
+    :rtype: Optional[cProfile.Profile]
+    """
+    if "memory" in modes:
+        tracemalloc.start()
+
+    if "cpu" not in modes:
+        return None
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_child(modes: Set[str], profiler: Optional[cProfile.Profile]) -> dict:
+    """Stop profiling in a sandbox child process
+
+    :param modes: The profiling modes, from `sandbox_modes()`
+    :type modes: Set[str]
+    :param profiler: The CPU profiler, from `start_child()`
+    :type profiler: Optional[cProfile.Profile]
+    :return: The results, to send back to the parent for `add_child()`
+    :rtype: dict
+    """
+    results = {}
+    if profiler is not None:
+        profiler.disable()
+        profiler.create_stats()
+        results["cpu"] = profiler.stats
+
+    if "memory" in modes:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        top_stats = snapshot.statistics("lineno")[:MEMORY_TOP_COUNT]
+        results["memory"] = (peak, list(map(str, top_stats)))
+
+    return results
+
+
+def add_child(results: dict):
+    """Add the results of profiling a sandbox child to the current request's profile
+
+    :param results: The results, from `stop_child()`
+    :type results: dict
+    """
+    if results and flask.has_request_context():
+        flask.g.setdefault("child_profiles", []).append(results)
+
+
+class _ChildStats:
+    # The CPU stats from a child, in the form that `pstats.Stats` loads
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def profile_path(request_id: str, kind: str) -> Optional[str]:
+    """Get the path to a saved profile
+
+    :param request_id: The request ID
+    :type request_id: str
+    :param kind: The kind of profile; "cpu" or "memory"
+    :type kind: str
+    :return: The path, or None if the request ID or kind is invalid
+    :rtype: Optional[str]
+    """
+    if not REQUEST_ID_PATTERN.fullmatch(request_id) or kind not in KIND_EXTENSIONS:
+        return None
+
+    return os.path.join(PROFILE_DIR, request_id + KIND_EXTENSIONS[kind])
+
+
+def list_profiles() -> List[dict]:
+    """List the saved profiles, most recent first
+
+    :return: The profiles; keys: "request_id", "kind", "size", "created"
+    :rtype: List[dict]
+    """
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+
+    profiles = []
+    for entry in os.scandir(PROFILE_DIR):
+        for kind, ext in KIND_EXTENSIONS.items():
+            if entry.name.endswith(ext):
+                stat = entry.stat()
+                profiles.append(
+                    {
+                        "request_id": entry.name[: -len(ext)],
+                        "kind": kind,
+                        "size": stat.st_size,
+                        "created": stat.st_mtime,
+                    }
+                )
+
+    return sorted(profiles, key=lambda p: p["created"], reverse=True)
@@ -0,0 +1,141 @@
+"""Statistics on the queries run per request, keyed by statement fingerprint
+
+A fingerprint is the statement with its whitespace collapsed and any inline literals
+replaced by `?`, so that the same statement run with different values is counted
+together. When one fingerprint runs more than `QUERY_REPEAT_LIMIT` times in a single
+request (a sign of queries issued in a Python loop), a warning is logged, or, if
+`QUERY_REPEAT_STRICT` is set, a `RepeatedQueryError` is raised.
+
+Statistics are also accumulated per process, for the slowest-queries dev endpoint. At
+most `PROCESS_STATS_SIZE` fingerprints are kept; past that, the one with the least
+total time is dropped to make room for a new one.
+"""
+
+import contextvars
+import functools
+import logging
+import os
+import re
+import threading
+from typing import Dict, List
+
+import dotenv
+
+dotenv.load_dotenv()
+
+REPEAT_LIMIT = int(os.getenv("QUERY_REPEAT_LIMIT", "10"))
+REPEAT_STRICT = os.getenv("QUERY_REPEAT_STRICT", "").lower() in ("1", "true", "yes")
+PROCESS_STATS_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+_request_stats = contextvars.ContextVar("request_stats", default=None)
+_process_stats = {}
+_process_lock = threading.Lock()
+
+
+class RepeatedQueryError(RuntimeError):
+    """Raised in strict mode when a request runs the same statement too many times"""
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(query_string: str) -> str:
+    """Get the fingerprint of a statement
+
+    :param query_string: The statement
+    :type query_string: str
+    :return: The fingerprint
+    :rtype: str
+    """
+    fprint = re.sub(r"'(?:[^']|'')*'", "?", query_string)
+    fprint = re.sub(r"\b\d+(?:\.\d+)?\b", "?", fprint)
+    return " ".join(fprint.split())
+
+
+def start():
+    """Start recording queries for a request"""
+    _request_stats.set({})
+
+
+def stop() -> Dict[str, dict]:
+    """Stop recording queries for a request
+
+    :return: The statistics for each fingerprint run during the request; keys:
+        "count", "rows", "seconds"
+    :rtype: Dict[str, dict]
+    """
+    stats = _request_stats.get()
+    _request_stats.set(None)
+    return stats or {}
+
+
+def record(query, nrows: int, seconds: float):
+    """Record a query that was run
+
+    :param query: The statement, as passed to the cursor
+    :param nrows: The number of rows returned or affected, or -1 if unknown
+    :type nrows: int
+    :param seconds: How long the query took
+    :type seconds: float
+    :raises RepeatedQueryError: In strict mode, if the statement has run more than
+        `REPEAT_LIMIT` times in the current request
+    """
+    if isinstance(query, bytes):
+        query = query.decode("utf-8")
+    fprint = fingerprint(query if isinstance(query, str) else str(query))
+    nrows = max(nrows, 0)
+
+    with _process_lock:
+        if fprint not in _process_stats and len(_process_stats) >= PROCESS_STATS_SIZE:
+            fastest = min(_process_stats, key=lambda f: _process_stats[f]["seconds"])
+            del _process_stats[fastest]
+        pstat = _process_stats.setdefault(
+            fprint, {"count": 0, "rows": 0, "seconds": 0.0, "max_seconds": 0.0}
+        )
+        pstat["count"] += 1
+        pstat["rows"] += nrows
+        pstat["seconds"] += seconds
+        pstat["max_seconds"] = max(pstat["max_seconds"], seconds)
+
+    stats = _request_stats.get()
+    if stats is None:
+        return
+
+    stat = stats.setdefault(fprint, {"count": 0, "rows": 0, "seconds": 0.0})
+    stat["count"] += 1
+    stat["rows"] += nrows
+    stat["seconds"] += seconds
+
+    if stat["count"] == REPEAT_LIMIT + 1:
+        message = (
+            f"Statement ran more than {REPEAT_LIMIT} times in one request: {fprint}"
+        )
+        if REPEAT_STRICT:
+            raise RepeatedQueryError(message)
+        logger.warning(message)
+
+
+def slowest(limit: int = 20) -> List[dict]:
+    """Get the fingerprints with the most total time in this process
+
+    :param limit: The maximum number of fingerprints to return, defaults to 20
+    :type limit: int, optional
+    :return: The statistics, slowest first; keys: "fingerprint", "count", "rows",
+        "total_ms", "mean_ms", "max_ms"
+    :rtype: List[dict]
+    """
+    with _process_lock:
+        items = [(f, dict(s)) for f, s in _process_stats.items()]
+
+    items.sort(key=lambda x: x[1]["seconds"], reverse=True)
+    return [
+        {
+            "fingerprint": fprint,
+            "count": stat["count"],
+            "rows": stat["rows"],
+            "total_ms": round(stat["seconds"] * 1e3, 3),
+            "mean_ms": round(stat["seconds"] / stat["count"] * 1e3, 3),
+            "max_ms": round(stat["max_seconds"] * 1e3, 3),
+        }
+        for fprint, stat in items[:limit]
+    ]
@@ -0,0 +1,120 @@
+"""Run chem computations in a subprocess, with hard CPU time and memory limits
+
+Some inputs make the chem pipeline blow up combinatorially. Running it in a forked
+child process means that a runaway computation is killed when it hits a limit, rather
+than pinning a CPU and growing the web worker until the OOM killer steps in. Each
+computation gets a fresh child, which exits when it is done, so nothing it allocated
+lingers in the web worker.
+
+The children are forked from a fork server rather than from the web worker. The web
+worker runs several threads, and a child forked from it could be left waiting on a lock
+that another thread held at the time. The fork server is single-threaded, and imports
+the chem pipeline once, so that each child starts with it loaded. Functions, arguments
+and results are passed by pickling. The children don't record metrics (each would write
+its own files in multiprocess mode); the parent times the function it ran instead.
+
+Limits:
+    - CPU time: `CHEM_CPU_LIMIT` seconds (RLIMIT_CPU)
+    - Memory: `CHEM_MEMORY_LIMIT` megabytes of address space, on top of what the child
+      inherits from its parent (RLIMIT_AS, since Linux doesn't enforce RLIMIT_RSS)
+    - Wall time: `CHEM_WALL_LIMIT` seconds, enforced by the parent
+"""
+
+import multiprocessing
+import os
+import resource
+
+import dotenv
+
+from flame_data import _metrics, _profile, _timing
+
+dotenv.load_dotenv()
+
+ENABLED = os.getenv("CHEM_SANDBOX", "1").lower() not in ("0", "false", "no")
+CPU_LIMIT = int(os.getenv("CHEM_CPU_LIMIT", "120"))
+MEMORY_LIMIT = int(os.getenv("CHEM_MEMORY_LIMIT", "2048"))
+WALL_LIMIT = float(os.getenv("CHEM_WALL_LIMIT", str(2 * CPU_LIMIT)))
+
+CONTEXT = multiprocessing.get_context("forkserver")
+CONTEXT.set_forkserver_preload(["flame_data._sandbox", "flame_data.chem"])
+
+
+class TooComplex(Exception):
+    """Raised when a chem computation hits one of its limits"""
+
+
+def run(func, *args):
+    """Run a function in a sandboxed subprocess and return its result
+
+    Exceptions raised by the function are re-raised here. If the current request is
+    being profiled, the function is profiled in the child, and the results are added
+    to the request's profile.
+
+    :param func: The function; it and its arguments and return value must be picklable
+    :return: The function's return value
+    :raises TooComplex: If the computation hits a CPU time, memory, or wall time limit
+    """
+    if not ENABLED:
+        return func(*args)
+
+    profile_modes = _profile.sandbox_modes()
+    recv_conn, send_conn = CONTEXT.Pipe(duplex=False)
+    proc = CONTEXT.Process(
+        target=_run_child, args=(send_conn, func, args, profile_modes), daemon=True
+    )
+
+    with _timing.timer("chem"), _metrics.builder_timer(func.__name__):
+        proc.start()
+        send_conn.close()
+        try:
+            if not recv_conn.poll(WALL_LIMIT):
+                raise TooComplex(f"it took more than {WALL_LIMIT:g} s")
+            ok, payload, profile_results = recv_conn.recv()
+        except EOFError:
+            # The child was killed before it could send anything back, which means it
+            # went over its CPU limit
+            raise TooComplex(f"it used more than {CPU_LIMIT} s of CPU time")
+        finally:
+            recv_conn.close()
+            if proc.is_alive():
+                proc.kill()
+            proc.join()
+
+    _profile.add_child(profile_results)
+    if not ok:
+        raise payload
+    return payload
+
+
+def _run_child(send_conn, func, args, profile_modes):
+    _metrics.stop_recording()
+
+    # Leave a second between the soft CPU limit (SIGXCPU) and the hard one (SIGKILL)
+    resource.setrlimit(resource.RLIMIT_CPU, (CPU_LIMIT, CPU_LIMIT + 1))
+    try:
+        with open("/proc/self/statm") as statm:
+            inherited_bytes = int(statm.read().split()[0]) * resource.getpagesize()
+    except OSError:
+        # Not Linux, so the address space limit wouldn't be reliable anyway
+        inherited_bytes = None
+    if inherited_bytes is not None:
+        memory_bytes = inherited_bytes + MEMORY_LIMIT * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+
+    profiler = _profile.start_child(profile_modes)
+    try:
+        result = (True, func(*args))
+    except MemoryError:
+        result = (False, TooComplex(f"it used more than {MEMORY_LIMIT} MB of memory"))
+    except Exception as exc:
+        result = (False, exc)
+    profile_results = _profile.stop_child(profile_modes, profiler)
+
+    try:
+        send_conn.send((*result, profile_results))
+    except Exception as exc:
+        # The result or exception couldn't be pickled
+        error = RuntimeError(f"{type(exc).__name__}: {exc}")
+        send_conn.send((False, error, profile_results))
+    finally:
+        send_conn.close()
@@ -0,0 +1,96 @@
+"""Per-request breakdown of where the time goes
+
+Time spent inside a timer is added to its category for the current request. Timers
+can nest, in which case only the outermost one counts, so that (for example) a chem
+function calling another chem function isn't counted twice. Outside of a request,
+timers do nothing.
+"""
+
+import contextlib
+import contextvars
+import functools
+import time
+from typing import Dict, Tuple
+
+CATEGORIES = ("db", "chem", "sort", "json")
+
+_timings = contextvars.ContextVar("timings", default=None)
+_active = contextvars.ContextVar("active", default=False)
+_start = contextvars.ContextVar("start", default=None)
+
+
+def start():
+    """Start timing a request"""
+    _timings.set(dict.fromkeys(CATEGORIES, 0.0))
+    _active.set(False)
+    _start.set(time.perf_counter())
+
+
+def stop() -> Tuple[Dict[str, float], float]:
+    """Stop timing a request
+
+    :return: The seconds spent in each category, and the total seconds for the request
+    :rtype: Tuple[Dict[str, float], float]
+    """
+    timings = _timings.get()
+    start_time = _start.get()
+    _timings.set(None)
+    _start.set(None)
+
+    if timings is None:
+        return {}, 0.0
+
+    return timings, time.perf_counter() - start_time
+
+
+@contextlib.contextmanager
+def timer(category: str):
+    """Add the time spent in this context to a category for the current request
+
+    :param category: The category, one of `CATEGORIES`
+    :type category: str
+    """
+    timings = _timings.get()
+    if timings is None or _active.get():
+        yield
+        return
+
+    token = _active.set(True)
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[category] += time.perf_counter() - start_time
+        _active.reset(token)
+
+
+def timed(category: str):
+    """Decorate a function to add its run time to a category for the current request
+
+    :param category: The category, one of `CATEGORIES`
+    :type category: str
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(category):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def server_timing_header(timings: Dict[str, float], total: float) -> str:
+    """Format timings as a `Server-Timing` header value, in milliseconds
+
+    :param timings: The seconds spent in each category
+    :type timings: Dict[str, float]
+    :param total: The total seconds for the request
+    :type total: float
+    :return: The header value
+    :rtype: str
+    """
+    metrics = [*timings.items(), ("total", total)]
+    return ", ".join(f"{name};dur={secs * 1e3:.1f}" for name, secs in metrics)
@@ -1,42 +1,162 @@
+import functools
 import itertools
-from typing import List, Tuple, Union
+from typing import List, Optional, Tuple, Union
 
 import automol
 
+from flame_data import _metrics, _timing, geometry
 from flame_data.utils import is_nonstring_sequence
 
 
+# DERIVATIONS
+class SpeciesDerivation:
+    """The identifiers derived from a species SMILES string
+
+    Each one is computed on first use and then memoized. The species row builders
+    accept one of these in place of a SMILES string, so that a submission passing the
+    same derivation to all of them computes each identifier only once.
+    """
+
+    def __init__(self, smi: str):
+        self.smi = smi
+
+    @functools.cached_property
+    def conn_smi(self) -> str:
+        return automol.smiles.without_stereo(self.smi)
+
+    @functools.cached_property
+    def conn_inchi(self) -> str:
+        return automol.smiles.inchi(self.conn_smi, stereo=False)
+
+    @functools.cached_property
+    def conn_amchi(self) -> str:
+        return automol.smiles.amchi(self.conn_smi, stereo=False)
+
+    @functools.cached_property
+    def conn_inchi_hash(self) -> str:
+        return automol.inchi_key.first_hash(automol.inchi.inchi_key(self.conn_inchi))
+
+    @functools.cached_property
+    def conn_amchi_hash(self) -> str:
+        return automol.inchi_key.first_hash(automol.amchi.amchi_key(self.conn_amchi))
+
+    @functools.cached_property
+    def conn_graph(self):
+        return automol.smiles.graph(self.smi, stereo=False)
+
+
+class ReactionDerivation:
+    """The identifiers derived from a reaction SMILES string
+
+    Each one is computed on first use and then memoized. The reaction row builders
+    accept one of these in place of a SMILES string, so that a submission passing the
+    same derivation to all of them computes each identifier only once.
+
+    Identifiers for the reactants and products come in (reactants, products) pairs
+    """
+
+    def __init__(self, smi: str):
+        self.smi = smi
+
+    @functools.cached_property
+    def conn_smi(self) -> str:
+        return automol.smiles.without_stereo(self.smi)
+
+    @functools.cached_property
+    def reagent_smis(self) -> Tuple[str, str]:
+        return tuple(automol.smiles.reaction_reagents(self.conn_smi))
+
+    @functools.cached_property
+    def reagent_inchis(self) -> Tuple[str, str]:
+        return tuple(map(automol.smiles.inchi, self.reagent_smis))
+
+    @functools.cached_property
+    def reagent_inchi_lists(self) -> Tuple[List[str], List[str]]:
+        return tuple(map(automol.inchi.split, self.reagent_inchis))
+
+    @functools.cached_property
+    def reagent_amchis(self) -> Tuple[str, str]:
+        return tuple(map(automol.smiles.amchi, self.reagent_smis))
+
+    @functools.cached_property
+    def reagent_amchi_lists(self) -> Tuple[List[str], List[str]]:
+        return tuple(map(automol.amchi.split, self.reagent_amchis))
+
+    @functools.cached_property
+    def reagent_inchi_hashes(self) -> Tuple[str, str]:
+        ichs = self.reagent_inchis
+        return tuple(
+            automol.inchi_key.first_hash(automol.inchi.inchi_key(i)) for i in ichs
+        )
+
+    @functools.cached_property
+    def reagent_amchi_hashes(self) -> Tuple[str, str]:
+        achs = self.reagent_amchis
+        return tuple(
+            automol.inchi_key.first_hash(automol.amchi.amchi_key(a)) for a in achs
+        )
+
+    @functools.cached_property
+    def reagent_graphs(self) -> tuple:
+        return tuple(map(automol.smiles.graph, self.reagent_smis))
+
+    @functools.cached_property
+    def reactions(self) -> tuple:
+        rgra, pgra = self.reagent_graphs
+        return tuple(automol.reac.find(rgra, pgra, stereo=False))
+
+
+def species_derivation(smi: Union[str, SpeciesDerivation]) -> SpeciesDerivation:
+    """Get a derivation for a species, if it isn't one already
+
+    :param smi: SMILES string, or a derivation
+    :type smi: Union[str, SpeciesDerivation]
+    :rtype: SpeciesDerivation
+    """
+    return smi if isinstance(smi, SpeciesDerivation) else SpeciesDerivation(smi)
+
+
+def reaction_derivation(smi: Union[str, ReactionDerivation]) -> ReactionDerivation:
+    """Get a derivation for a reaction, if it isn't one already
+
+    :param smi: Reaction SMILES string, or a derivation
+    :type smi: Union[str, ReactionDerivation]
+    :rtype: ReactionDerivation
+    """
+    return smi if isinstance(smi, ReactionDerivation) else ReactionDerivation(smi)
+
+
 # PREPARE DATA FOR DATABASE
-def species_connectivity_row(smi: str) -> dict:
+@_timing.timed("chem")
+@_metrics.timed_builder
+def species_connectivity_row(smi: Union[str, SpeciesDerivation]) -> dict:
     """Generate row for species connectivity table
 
-    :param smi: SMILES string
-    :type smi: str
+    :param smi: SMILES string, or a derivation
+    :type smi: Union[str, SpeciesDerivation]
     :return: The row; keys: "formula", "svg_string, "conn_smiles", "conn_inchi",
         "conn_inchi_key", "conn_amchi", "conn_amchi_key"
     :rtype: dict
     """
-    smi = automol.smiles.without_stereo(smi)
-    ich = automol.smiles.inchi(smi, stereo=False)
-    ach = automol.smiles.amchi(smi, stereo=False)
-    ick = automol.inchi.inchi_key(ich)
-    ack = automol.amchi.amchi_key(ach)
+    spc = species_derivation(smi)
     return {
-        "formula": automol.smiles.formula_string(smi),
-        "svg_string": automol.smiles.svg_string(smi, stereo=False),
-        "conn_smiles": automol.smiles.recalculate_without_stereo(smi),
-        "conn_inchi": ich,
-        "conn_inchi_hash": automol.inchi_key.first_hash(ick),
-        "conn_amchi": ach,
-        "conn_amchi_hash": automol.inchi_key.first_hash(ack),
+        "formula": automol.smiles.formula_string(spc.conn_smi),
+        "svg_string": automol.smiles.svg_string(spc.conn_smi, stereo=False),
+        "conn_smiles": automol.smiles.recalculate_without_stereo(spc.conn_smi),
+        "conn_inchi": spc.conn_inchi,
+        "conn_inchi_hash": spc.conn_inchi_hash,
+        "conn_amchi": spc.conn_amchi,
+        "conn_amchi_hash": spc.conn_amchi_hash,
     }
 
 
-def reaction_connectivity_row(smi: str) -> dict:
+@_timing.timed("chem")
+@_metrics.timed_builder
+def reaction_connectivity_row(smi: Union[str, ReactionDerivation]) -> dict:
     """Generate row for reaction connectivity table
 
-    :param smi: Reaction SMILES string
-    :type smi: str
+    :param smi: Reaction SMILES string, or a derivation
+    :type smi: Union[str, ReactionDerivation]
     :return: The row; keys:
         "formula", "conn_smiles", "r_svg_string", "p_svg_string", "r_conn_inchi",
         "p_conn_inchi", "r_conn_inchi_hash", "p_conn_inchi_hash", "r_conn_amchi",
@@ -46,19 +166,18 @@ def reaction_connectivity_row(smi: str) -> dict:
         "p_conn_amchi_hashes",
     :rtype: dict
     """
-    smi = automol.smiles.without_stereo(smi)
-    rsmi, psmi = automol.smiles.reaction_reagents(smi)
-    rich, pich = map(automol.smiles.inchi, (rsmi, psmi))
-    richs, pichs = map(automol.inchi.split, (rich, pich))
+    rxn = reaction_derivation(smi)
+    rich, pich = rxn.reagent_inchis
+    richs, pichs = rxn.reagent_inchi_lists
     rsmis, psmis = (list(map(automol.inchi.smiles, i)) for i in (richs, pichs))
     smi = automol.smiles.reaction(rsmis, psmis)
     rsvg_str, psvg_str = automol.smiles.reaction_reagent_svg_strings(smi)
-    rick, pick = map(automol.inchi.inchi_key, (rich, pich))
     ricks, picks = (list(map(automol.inchi.inchi_key, i)) for i in (richs, pichs))
-    rach, pach = map(automol.smiles.amchi, (rsmi, psmi))
-    rachs, pachs = map(automol.amchi.split, (rach, pach))
-    rack, pack = map(automol.amchi.amchi_key, (rach, pach))
+    rach, pach = rxn.reagent_amchis
+    rachs, pachs = rxn.reagent_amchi_lists
     racks, packs = (list(map(automol.amchi.amchi_key, i)) for i in (rachs, pachs))
+    rhash, phash = rxn.reagent_inchi_hashes
+    rahash, pahash = rxn.reagent_amchi_hashes
     return {
         "formula": automol.inchi.formula_string(rich),
         "conn_smiles": smi,
@@ -66,12 +185,12 @@ def reaction_connectivity_row(smi: str) -> dict:
         "p_svg_string": psvg_str,
         "r_conn_inchi": rich,
         "p_conn_inchi": pich,
-        "r_conn_inchi_hash": automol.inchi_key.first_hash(rick),
-        "p_conn_inchi_hash": automol.inchi_key.first_hash(pick),
+        "r_conn_inchi_hash": rhash,
+        "p_conn_inchi_hash": phash,
         "r_conn_amchi": rach,
         "p_conn_amchi": pach,
-        "r_conn_amchi_hash": automol.inchi_key.first_hash(rack),
-        "p_conn_amchi_hash": automol.inchi_key.first_hash(pack),
+        "r_conn_amchi_hash": rahash,
+        "p_conn_amchi_hash": pahash,
         "r_formulas": list(map(automol.inchi.formula_string, richs)),
         "p_formulas": list(map(automol.inchi.formula_string, pichs)),
         "r_conn_inchis": richs,
@@ -85,82 +204,122 @@ def reaction_connectivity_row(smi: str) -> dict:
     }
 
 
-def species_estate_row(smi: str) -> dict:
+@_timing.timed("chem")
+@_metrics.timed_builder
+def species_estate_row(smi: Union[str, SpeciesDerivation]) -> dict:
     """Generate row for species estate table
 
-    :param smi: SMILES string
-    :type smi: str
+    :param smi: SMILES string, or a derivation
+    :type smi: Union[str, SpeciesDerivation]
     :return: The row; keys: "spin_mult"
     :rtype: dict
     """
-    ich = automol.smiles.inchi(smi, stereo=False)
-    return {"spin_mult": automol.inchi.low_spin_multiplicity(ich)}
+    spc = species_derivation(smi)
+    return {"spin_mult": automol.inchi.low_spin_multiplicity(spc.conn_inchi)}
 
 
-def reaction_estate_row(smi: str) -> dict:
+@_timing.timed("chem")
+@_metrics.timed_builder
+def reaction_estate_row(smi: Union[str, ReactionDerivation]) -> dict:
     """Generate row for reaction estate table
 
-    :param smi: SMILES string
-    :type smi: str
+    :param smi: Reaction SMILES string, or a derivation
+    :type smi: Union[str, ReactionDerivation]
     :return: The row; keys: "spin_mult"
     :rtype: dict
     """
-    smi = automol.smiles.without_stereo(smi)
-    richs = map(automol.smiles.inchi, automol.smiles.reaction_reactants(smi))
-    pichs = map(automol.smiles.inchi, automol.smiles.reaction_products(smi))
+    richs, pichs = reaction_derivation(smi).reagent_inchi_lists
     rmuls = list(map(automol.inchi.low_spin_multiplicity, richs))
     pmuls = list(map(automol.inchi.low_spin_multiplicity, pichs))
     return {"spin_mult": automol.mult.ts.low(rmuls, pmuls)}
 
 
-def species_rows(smi: str) -> List[dict]:
+@_timing.timed("chem")
+@_metrics.timed_builder
+def species_rows(
+    smi: Union[str, SpeciesDerivation],
+    geometries: bool = True,
+    cap: Optional[int] = None,
+) -> Tuple[List[dict], int]:
     """Generate rows for species stereo table
 
-    :param smi: SMILES string
-    :type smi: str
-    :return: The rows; keys: "geometry", "smiles", "inchi", "amchi", "amchi_key"
-    :rtype: List[dict]
+    :param smi: SMILES string, or a derivation
+    :type smi: Union[str, SpeciesDerivation]
+    :param geometries: Generate the geometries? If not, they are left as `None`, to be
+        filled in later by `species_geometries()`; default True
+    :type geometries: bool, optional
+    :param cap: The maximum number of stereoisomers to generate rows for, defaults to
+        None (all of them); the rest are only counted, without being kept
+    :type cap: Optional[int], optional
+    :return: The rows; keys: "geometry" (packed), "smiles", "inchi", "amchi",
+        "amchi_key"; and the total number of stereoisomers
+    :rtype: Tuple[List[dict], int]
     """
-    conn_gra = automol.smiles.graph(smi, stereo=False)
-    gras = automol.graph.expand_stereo(conn_gra)
+    gras = iter(automol.graph.expand_stereo(species_derivation(smi).conn_graph))
 
     rows = []
-    for gra in gras:
-        ach = automol.graph.amchi(gra)
-        row = {
-            "geometry": automol.geom.xyz_string(automol.graph.geometry(gra)),
-            "smiles": automol.graph.smiles(gra),
-            "inchi": automol.graph.inchi(gra),
-            "amchi": ach,
-            "amchi_key": automol.amchi.amchi_key(ach),
-        }
+    for gra in itertools.islice(gras, cap):
+        row = species_row_from_graph(gra)
+        if geometries:
+            row["geometry"] = geometry_data(automol.graph.geometry(gra))
         rows.append(row)
 
-    return rows
+    return rows, len(rows) + sum(1 for _ in gras)
+
+
+@_timing.timed("chem")
+def species_row_from_amchi(ach: str) -> dict:
+    """Generate a row for the species stereo table from an AMChI, without a geometry
+
+    :param ach: An AMChI chemical identifier string, with stereo
+    :type ach: str
+    :return: The row; keys: "geometry" (`None`), "smiles", "inchi", "amchi",
+        "amchi_key"
+    :rtype: dict
+    """
+    return species_row_from_graph(automol.amchi.graph(ach))
+
 
+@_timing.timed("chem")
+@_metrics.timed_builder
+def species_geometries(achs: List[str]) -> List[bytes]:
+    """Generate geometries for species stereoisomers
 
-def reaction_and_ts_rows(smi: str) -> Tuple[List[dict], List[List[dict]]]:
+    :param achs: AMChI chemical identifier strings, with stereo
+    :type achs: List[str]
+    :return: The packed geometries
+    :rtype: List[bytes]
+    """
+    return [
+        geometry_data(automol.graph.geometry(automol.amchi.graph(ach))) for ach in achs
+    ]
+
+
+@_timing.timed("chem")
+@_metrics.timed_builder
+def reaction_and_ts_rows(
+    smi: Union[str, ReactionDerivation], geometries: bool = True
+) -> Tuple[List[dict], List[List[dict]]]:
     """Generate rows for the reaction and TS tables
 
     The TS rows will be grouped by the reaction that they correspond to
 
-    :param smi: Reaction SMILES string
-    :type smi: str
+    :param smi: Reaction SMILES string, or a derivation
+    :type smi: Union[str, ReactionDerivation]
+    :param geometries: Generate the TS geometries? If not, they are left as `None`, to
+        be filled in later by `ts_geometries()`; default True
+    :type geometries: bool, optional
     :return: The reaction rows, with the following keys:
             "smiles", "r_amchi", "p_amchi", "r_amchi_key", "p_amchi_key", "r_inchis",
             "p_inchis", "r_amchis", "p_amchis", "r_amchi_keys", "p_amchi_keys",
         and the TS rows, grouped by reactants and products, with keys:
-              "geometry", "class", "amchi", "amchi_key"
+              "geometry" (packed), "class", "amchi", "amchi_key"
     :rtype: Tuple[List[dict], List[List[dict]]]
     """
-    smi = automol.smiles.without_stereo(smi)
-    rsmi, psmi = automol.smiles.reaction_reagents(smi)
-    rgra, pgra = map(automol.smiles.graph, (rsmi, psmi))
-
     all_rows = []
 
     # 1. Get all row information
-    for rxn in automol.reac.find(rgra, pgra, stereo=False):
+    for rxn in reaction_derivation(smi).reactions:
         for srxn in automol.reac.expand_stereo(rxn):
             # reaction row
             richs, pichs = automol.reac.inchi(srxn)
@@ -170,7 +329,7 @@ def reaction_and_ts_rows(smi: str) -> Tuple[List[dict], List[List[dict]]]:
             )
             rach, pach = map(automol.amchi.join, (rachs, pachs))
             tsg = automol.reac.ts_graph(srxn)
-            ts_geo = automol.graph.geometry(tsg)
+            ts_geo = automol.graph.geometry(tsg) if geometries else None
             ts_ach = automol.graph.amchi(tsg)
             all_row = {
                 # reaction columns
@@ -186,7 +345,7 @@ def reaction_and_ts_rows(smi: str) -> Tuple[List[dict], List[List[dict]]]:
                 "r_amchi_keys": racks,
                 "p_amchi_keys": packs,
                 # TS columns
-                "geometry": automol.geom.xyz_string(ts_geo),
+                "geometry": None if ts_geo is None else geometry_data(ts_geo),
                 "class": automol.reac.class_(srxn),
                 "amchi": ts_ach,
                 "amchi_key": automol.amchi.amchi_key(ts_ach),
@@ -228,22 +387,50 @@ def reaction_and_ts_rows(smi: str) -> Tuple[List[dict], List[List[dict]]]:
     return rxn_rows, ts_grouped_rows
 
 
-def validate_species_geometry(ach: str, xyz_str: str) -> str:
+@_timing.timed("chem")
+@_metrics.timed_builder
+def ts_geometries(smi: Union[str, ReactionDerivation], achs: List[str]) -> dict:
+    """Generate geometries for some of the TSs of a reaction
+
+    :param smi: Reaction SMILES string, or a derivation
+    :type smi: Union[str, ReactionDerivation]
+    :param achs: AMChI chemical identifier strings of the TSs
+    :type achs: List[str]
+    :return: The packed geometries, by AMChI; TSs that weren't found are left out
+    :rtype: dict
+    """
+    achs = set(achs)
+    geo_dct = {}
+    for rxn in reaction_derivation(smi).reactions:
+        for srxn in automol.reac.expand_stereo(rxn):
+            tsg = automol.reac.ts_graph(srxn)
+            ts_ach = automol.graph.amchi(tsg)
+            if ts_ach in achs and ts_ach not in geo_dct:
+                geo_dct[ts_ach] = geometry_data(automol.graph.geometry(tsg))
+
+    return geo_dct
+
+
+@_timing.timed("chem")
+@_metrics.timed_builder
+def validate_species_geometry(ach: str, xyz_str: str) -> bytes:
     """Validate that a geometry matches a species
 
     :param ach: An AMChI chemical identifier string
     :type ach: str
     :param xyz_str: The species geometry, in xyz format
     :type xyz_str: str
-    :return: A normalized xyz string, if valid; otherwise `None`
-    :rtype: str or NoneType
+    :return: The packed geometry, if valid; otherwise `None`
+    :rtype: bytes or NoneType
     """
     geo = automol.geom.from_xyz_string(xyz_str)
     ach_ = automol.geom.amchi(geo)
-    return automol.geom.xyz_string(geo) if ach == ach_ else None
+    return geometry_data(geo) if ach == ach_ else None
 
 
-def validate_reaction_geometry(ach: str, xyz_str: str) -> str:
+@_timing.timed("chem")
+@_metrics.timed_builder
+def validate_reaction_geometry(ach: str, xyz_str: str) -> bytes:
     """Validate that a geometry matches a reaction
 
     Currently, doesn't actually validate anything
@@ -255,14 +442,45 @@ def validate_reaction_geometry(ach: str, xyz_str: str) -> str:
     :type ach: str
     :param xyz_str: The reaction geometry, in xyz format
     :type xyz_str: str
-    :return: A normalized xyz string, if valid; otherwise `None`
-    :rtype: str or NoneType
+    :return: The packed geometry, if valid; otherwise `None`
+    :rtype: bytes or NoneType
     """
     geo = automol.geom.from_xyz_string(xyz_str)
-    return automol.geom.xyz_string(geo)
+    return geometry_data(geo)
 
 
 # HELPERS
+def species_row_from_graph(gra) -> dict:
+    """Generate a row for the species stereo table from a graph, without a geometry
+
+    :param gra: An automol molecular graph, with stereo
+    :return: The row; keys: "geometry" (`None`), "smiles", "inchi", "amchi",
+        "amchi_key"
+    :rtype: dict
+    """
+    ach = automol.graph.amchi(gra)
+    return {
+        "geometry": None,
+        "smiles": automol.graph.smiles(gra),
+        "inchi": automol.graph.inchi(gra),
+        "amchi": ach,
+        "amchi_key": automol.amchi.amchi_key(ach),
+    }
+
+
+def geometry_data(geo) -> bytes:
+    """Pack an automol geometry for storage in the database
+
+    :param geo: An automol geometry
+    :return: The packed geometry
+    :rtype: bytes
+    """
+    symbs = automol.geom.symbols(geo)
+    xyzs = automol.geom.coordinates(geo, angstrom=True)
+    return geometry.from_symbols_and_coordinates(symbs, xyzs)
+
+
+@_timing.timed("chem")
 def species_amchi_key(key: str, key_type: str = "smiles") -> str:
     """Get an ChI key from an identifier
 
@@ -289,6 +507,7 @@ def species_amchi_key(key: str, key_type: str = "smiles") -> str:
     return key
 
 
+@_timing.timed("chem")
 def species_connectivity_chi_hash(
     key: str, key_type: str = "smiles"
 ) -> Tuple[str, bool]:
@@ -334,6 +553,7 @@ def species_connectivity_chi_hash(
     return key, is_amchi
 
 
+@_timing.timed("chem")
 def reaction_connectivity_chi_hashes(
     key: Union[str, Tuple[str, str]], key_type: str = "smiles"
 ) -> Tuple[Tuple[str, str], bool]:
@@ -351,7 +571,6 @@ def reaction_connectivity_chi_hashes(
     """
     key_type = key_type.lower()
 
-    print("key", key)
     if isinstance(key, str) and key_type == "smiles":
         key = automol.smiles.reaction_reagents(key)
 
@@ -361,8 +580,6 @@ def reaction_connectivity_chi_hashes(
     )
 
     rkey, pkey = key
-    print("rkey", rkey)
-    print("pkey", pkey)
     rhash, is_amchi = species_connectivity_chi_hash(rkey, key_type=key_type)
     phash, is_amchi = species_connectivity_chi_hash(pkey, key_type=key_type)
     return (rhash, phash), is_amchi
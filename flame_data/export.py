@@ -0,0 +1,72 @@
+import io
+from typing import List
+
+import numpy
+
+from flame_data import geometry
+
+# Metadata columns and their types; string columns are sized to fit their contents
+METADATA_COLUMNS = (
+    ("kind", str),
+    ("id", numpy.int64),
+    ("reaction_id", numpy.int64),
+    ("spin_mult", numpy.int16),
+    ("formula", str),
+    ("class", str),
+    ("smiles", str),
+    ("inchi", str),
+    ("amchi", str),
+)
+
+
+def collection_npz(species_rows: List[dict], ts_rows: List[dict]) -> bytes:
+    """Pack the geometries of a collection into an uncompressed NumPy .npz archive
+
+    The archive has the following arrays, which can be loaded with `numpy.load()`
+    without pickling:
+        "atomic_numbers": uint8, shape (natms,)
+        "coordinates": float64 in angstroms, shape (natms, 3)
+        "offsets": int64, shape (ngeos + 1,); geometry `i` spans the atoms
+            `offsets[i]:offsets[i + 1]`
+        "metadata": A structured array, shape (ngeos,), with fields "kind" ("species"
+            or "ts"), "id", "reaction_id" (-1 for species), "spin_mult", "formula",
+            "class" (empty for species), "smiles", "inchi" (empty for TSs), "amchi"
+
+    Species come first, followed by TSs
+
+    :param species_rows: Species rows, as returned by `get_collection_geometries`
+    :type species_rows: List[dict]
+    :param ts_rows: TS rows, as returned by `get_collection_geometries`
+    :type ts_rows: List[dict]
+    :return: The contents of the .npz file
+    :rtype: bytes
+    """
+    rows = [{"kind": "species", "reaction_id": -1, **r} for r in species_rows] + [
+        {"kind": "ts", **r} for r in ts_rows
+    ]
+    nums, coords, offsets = geometry.concatenate([r["geometry"] for r in rows])
+
+    columns = [
+        numpy.array([_value(r, name, type_) for r in rows], dtype=type_)
+        for name, type_ in METADATA_COLUMNS
+    ]
+    metadata = numpy.rec.fromarrays(
+        columns, names=[name for name, _ in METADATA_COLUMNS]
+    ).view(numpy.ndarray)
+
+    buf = io.BytesIO()
+    numpy.savez(
+        buf,
+        atomic_numbers=nums,
+        coordinates=coords,
+        offsets=offsets,
+        metadata=metadata,
+    )
+    return buf.getvalue()
+
+
+def _value(row, name, type_):
+    val = row.get(name)
+    if val is None:
+        val = "" if type_ is str else -1
+    return val
@@ -0,0 +1,164 @@
+"""Compact binary storage format for molecular geometries
+
+A geometry is stored as a byte string with two packed arrays:
+    1. The atomic symbols, as two ASCII characters per atom (space-padded)
+    2. The Cartesian coordinates in angstroms, as big-endian (network order) doubles
+
+This is the byte order of Postgres's `float8send()`, so geometries can also be packed
+on the database side (see `migrations/0002_binary_geometry.sql`).
+"""
+
+import struct
+from typing import List, Sequence, Tuple
+
+import numpy
+
+SYMBOL_SIZE = 2
+COORDINATE_SIZE = 8
+ATOM_SIZE = SYMBOL_SIZE + 3 * COORDINATE_SIZE
+
+# fmt: off
+ELEMENT_SYMBOLS = (
+    "X",
+    "H", "He",
+    "Li", "Be", "B", "C", "N", "O", "F", "Ne",
+    "Na", "Mg", "Al", "Si", "P", "S", "Cl", "Ar",
+    "K", "Ca", "Sc", "Ti", "V", "Cr", "Mn", "Fe", "Co", "Ni", "Cu", "Zn",
+    "Ga", "Ge", "As", "Se", "Br", "Kr",
+    "Rb", "Sr", "Y", "Zr", "Nb", "Mo", "Tc", "Ru", "Rh", "Pd", "Ag", "Cd",
+    "In", "Sn", "Sb", "Te", "I", "Xe",
+)
+# fmt: on
+ATOMIC_NUMBERS = {s.upper(): z for z, s in enumerate(ELEMENT_SYMBOLS)}
+
+
+def from_symbols_and_coordinates(
+    symbs: Sequence[str], xyzs: Sequence[Sequence[float]]
+) -> bytes:
+    """Pack a geometry from its symbols and coordinates
+
+    :param symbs: The atomic symbols
+    :type symbs: Sequence[str]
+    :param xyzs: The atomic coordinates, in angstroms
+    :type xyzs: Sequence[Sequence[float]]
+    :return: The packed geometry
+    :rtype: bytes
+    """
+    assert len(symbs) == len(xyzs), f"Mismatched symbols and coordinates:{symbs}{xyzs}"
+    symb_data = "".join(f"{s:{SYMBOL_SIZE}s}" for s in symbs).encode("ascii")
+    coords = [float(c) for xyz in xyzs for c in xyz]
+    return symb_data + struct.pack(f">{len(coords)}d", *coords)
+
+
+def from_xyz_string(xyz_str: str) -> bytes:
+    """Pack a geometry from an xyz string
+
+    :param xyz_str: The geometry, in xyz format
+    :type xyz_str: str
+    :return: The packed geometry
+    :rtype: bytes
+    """
+    natms_line, _, *atom_lines = xyz_str.splitlines()
+    natms = int(natms_line)
+    symbs, xyzs = [], []
+    for line in atom_lines[:natms]:
+        symb, *xyz = line.split()
+        symbs.append(symb)
+        xyzs.append(xyz)
+    return from_symbols_and_coordinates(symbs, xyzs)
+
+
+def count(geo_data: bytes) -> int:
+    """Get the number of atoms in a packed geometry
+
+    :param geo_data: The packed geometry
+    :type geo_data: bytes
+    :return: The number of atoms
+    :rtype: int
+    """
+    return len(geo_data) // ATOM_SIZE
+
+
+def symbols(geo_data: bytes) -> Tuple[str, ...]:
+    """Get the atomic symbols of a packed geometry
+
+    :param geo_data: The packed geometry
+    :type geo_data: bytes
+    :return: The atomic symbols
+    :rtype: Tuple[str, ...]
+    """
+    natms = count(geo_data)
+    symb_str = geo_data[: natms * SYMBOL_SIZE].decode("ascii")
+    return tuple(
+        symb_str[i : i + SYMBOL_SIZE].strip()
+        for i in range(0, len(symb_str), SYMBOL_SIZE)
+    )
+
+
+def coordinates(geo_data: bytes) -> List[Tuple[float, float, float]]:
+    """Get the atomic coordinates of a packed geometry
+
+    :param geo_data: The packed geometry
+    :type geo_data: bytes
+    :return: The atomic coordinates, in angstroms
+    :rtype: List[Tuple[float, float, float]]
+    """
+    natms = count(geo_data)
+    coords = struct.unpack_from(f">{3 * natms}d", geo_data, natms * SYMBOL_SIZE)
+    return list(zip(coords[0::3], coords[1::3], coords[2::3]))
+
+
+def xyz_string(geo_data: bytes, comment: str = "") -> str:
+    """Render a packed geometry as an xyz string
+
+    :param geo_data: The packed geometry
+    :type geo_data: bytes
+    :param comment: A comment for the second line, defaults to ""
+    :type comment: str, optional
+    :return: The geometry, in xyz format
+    :rtype: str
+    """
+    symbs = symbols(geo_data)
+    xyzs = coordinates(geo_data)
+    lines = [str(len(symbs)), comment] + [
+        f"{s:2s} {x:10.6f} {y:10.6f} {z:10.6f}" for s, (x, y, z) in zip(symbs, xyzs)
+    ]
+    return "\n".join(lines)
+
+
+def concatenate(
+    geo_datas: Sequence[bytes],
+) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """Concatenate packed geometries into flat NumPy arrays
+
+    The atoms of geometry `i` are at positions `offsets[i]:offsets[i + 1]` of the atomic
+    number and coordinate arrays
+
+    :param geo_datas: The packed geometries
+    :type geo_datas: Sequence[bytes]
+    :return: The atomic numbers (uint8, shape (natms,)), the coordinates in angstroms
+        (float64, shape (natms, 3)), and the offsets (int64, shape (ngeos + 1,))
+    :rtype: Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]
+    """
+    counts = [count(d) for d in geo_datas]
+    offsets = numpy.zeros(len(geo_datas) + 1, dtype=numpy.int64)
+    numpy.cumsum(counts, out=offsets[1:])
+
+    symbs = numpy.concatenate(
+        [numpy.frombuffer(d, dtype="S2", count=n) for d, n in zip(geo_datas, counts)]
+        or [numpy.empty(0, dtype="S2")]
+    )
+    coords = numpy.concatenate(
+        [
+            numpy.frombuffer(d, dtype=">f8", count=3 * n, offset=n * SYMBOL_SIZE)
+            for d, n in zip(geo_datas, counts)
+        ]
+        or [numpy.empty(0, dtype=">f8")]
+    )
+
+    # Look up atomic numbers once per distinct symbol, rather than once per atom
+    uniq_symbs, inv = numpy.unique(symbs, return_inverse=True)
+    uniq_nums = [ATOMIC_NUMBERS[s.decode("ascii").strip().upper()] for s in uniq_symbs]
+    nums = numpy.array(uniq_nums, dtype=numpy.uint8)[inv]
+
+    return nums, coords.astype(numpy.float64).reshape(-1, 3), offsets
@@ -0,0 +1,160 @@
+"""Apply the schema migrations in `flame_data/migrations` to the database
+
+Migrations are applied in order of their file names, and each one is recorded in the
+`schema_migrations` table, so that it is only applied once. Every migration is also
+written to be idempotent, so they can all be applied to a database that was created
+from `database.sql`, or that had some of them applied by hand before this runner
+existed.
+
+Each migration runs in its own transaction, unless its first line is
+
+    -- migrate: no-transaction
+
+in which case its statements run one at a time, outside of a transaction. This is
+needed for `CREATE INDEX CONCURRENTLY`, which builds an index without blocking writes
+to the table. Statements in these files are split at semicolons, so they can't
+contain `DO` blocks or functions. If one fails partway through an index build, the
+invalid index it leaves behind is dropped and rebuilt on the next run.
+
+Usage:
+    python -m flame_data.migrate [--status] [--dry-run]
+"""
+
+import argparse
+import os
+import re
+from typing import List, Tuple
+
+import psycopg
+
+from flame_data._pool import conninfo
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+LOCK_KEY = 5_164_617_231  # Arbitrary; keeps concurrent runners from overlapping
+
+
+def migrations() -> List[Tuple[str, str]]:
+    """List the migrations, in order
+
+    :return: The version (the file name, without extension) and path of each one
+    :rtype: List[Tuple[str, str]]
+    """
+    names = sorted(n for n in os.listdir(MIGRATIONS_DIR) if n.endswith(".sql"))
+    return [(n[: -len(".sql")], os.path.join(MIGRATIONS_DIR, n)) for n in names]
+
+
+def applied_versions(conn: psycopg.Connection) -> List[str]:
+    """Get the versions of the migrations that have been applied
+
+    :param conn: A connection to the database
+    :type conn: psycopg.Connection
+    :return: The versions
+    :rtype: List[str]
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+          version TEXT PRIMARY KEY,
+          applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """)
+    rows = conn.execute("SELECT version FROM schema_migrations;").fetchall()
+    return sorted(r[0] for r in rows)
+
+
+def apply(dry_run: bool = False) -> List[str]:
+    """Apply the migrations that haven't been applied yet
+
+    :param dry_run: Just report which ones would be applied?, default False
+    :type dry_run: bool, optional
+    :return: The versions of the migrations that were (or would be) applied
+    :rtype: List[str]
+    """
+    with psycopg.connect(conninfo, autocommit=True) as conn:
+        conn.execute("SELECT pg_advisory_lock(%s);", [LOCK_KEY])
+        try:
+            done = set(applied_versions(conn))
+            pending = [(v, p) for v, p in migrations() if v not in done]
+            if dry_run:
+                return [v for v, _ in pending]
+
+            for version, path in pending:
+                print(f"Applying {version}")
+                with open(path) as sql_file:
+                    sql = sql_file.read()
+
+                if sql.startswith(NO_TRANSACTION_MARKER):
+                    _drop_invalid_indexes(conn, sql)
+                    for statement in _statements(sql):
+                        conn.execute(statement)
+                    _record(conn, version)
+                else:
+                    with conn.transaction():
+                        conn.execute(sql)
+                        _record(conn, version)
+        finally:
+            conn.execute("SELECT pg_advisory_unlock(%s);", [LOCK_KEY])
+
+    return [v for v, _ in pending]
+
+
+def _record(conn: psycopg.Connection, version: str):
+    conn.execute(
+        "INSERT INTO schema_migrations (version) VALUES (%s) ON CONFLICT DO NOTHING;",
+        [version],
+    )
+
+
+def _statements(sql: str) -> List[str]:
+    # Strip comments, then split at the semicolons
+    sql = re.sub(r"--[^\n]*", "", sql)
+    return [s.strip() for s in sql.split(";") if s.strip()]
+
+
+def _drop_invalid_indexes(conn: psycopg.Connection, sql: str):
+    # An interrupted CREATE INDEX CONCURRENTLY leaves an invalid index, which
+    # IF NOT EXISTS would then skip over
+    names = re.findall(r"CREATE INDEX CONCURRENTLY IF NOT EXISTS (\w+)", sql, re.I)
+    rows = conn.execute(
+        """
+        SELECT pg_class.relname FROM pg_index
+        JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+        JOIN pg_namespace ON pg_namespace.oid = pg_class.relnamespace
+        WHERE NOT pg_index.indisvalid AND pg_class.relname = ANY(%s)
+        AND pg_namespace.nspname = ANY(current_schemas(false));
+        """,
+        [names],
+    ).fetchall()
+    for (name,) in rows:
+        print(f"Dropping invalid index {name}")
+        conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}";')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--status", action="store_true", help="List the migrations and their status"
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="List the migrations that would be applied",
+    )
+    args = parser.parse_args()
+
+    if args.status:
+        with psycopg.connect(conninfo, autocommit=True) as conn:
+            done = set(applied_versions(conn))
+        for version, _ in migrations():
+            print(f"{'applied' if version in done else 'pending':<10}{version}")
+        return
+
+    versions = apply(dry_run=args.dry_run)
+    if args.dry_run:
+        print("\n".join(versions) if versions else "Nothing to apply")
+    elif not versions:
+        print("Nothing to apply")
+
+
+if __name__ == "__main__":
+    main()
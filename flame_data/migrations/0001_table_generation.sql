@@ -0,0 +1,39 @@
+-- Add per-table generation counters for ETag validation
+
+CREATE SEQUENCE IF NOT EXISTS table_generation_seq;
+
+CREATE TABLE IF NOT EXISTS table_generation (
+  table_name TEXT PRIMARY KEY,
+  generation BIGINT NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION bump_table_generation() RETURNS TRIGGER AS $$
+BEGIN
+  INSERT INTO table_generation (table_name, generation)
+  VALUES (TG_TABLE_NAME, nextval('table_generation_seq'))
+  ON CONFLICT (table_name)
+  DO UPDATE SET generation = EXCLUDED.generation;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+  name TEXT;
+BEGIN
+  FOREACH name IN ARRAY ARRAY[
+    'species_connectivity', 'species_estate', 'species',
+    'reaction_connectivity', 'reaction', 'reaction_estate', 'reaction_ts',
+    'reaction_reactants', 'reaction_products',
+    'collection', 'collection_species', 'collection_reactions'
+  ]
+  LOOP
+    EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I;', name || '_generation', name);
+    EXECUTE format(
+      'CREATE TRIGGER %I AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I '
+      'FOR EACH STATEMENT EXECUTE FUNCTION bump_table_generation();',
+      name || '_generation', name
+    );
+  END LOOP;
+END;
+$$;
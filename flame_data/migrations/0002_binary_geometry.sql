@@ -0,0 +1,46 @@
+-- Store geometries in the packed binary format of flame_data/geometry.py, instead of as
+-- xyz text
+--
+-- To compare storage sizes, run this before and after:
+--   SELECT SUM(pg_column_size(geometry)) FROM species;
+--   SELECT SUM(pg_column_size(geometry)) FROM reaction_ts;
+
+CREATE OR REPLACE FUNCTION pg_temp.xyz_to_geometry_data(xyz TEXT) RETURNS BYTEA AS $$
+DECLARE
+  lines TEXT[] := string_to_array(xyz, E'\n');
+  natms INT := btrim(lines[1])::INT;
+  fields TEXT[];
+  symb_data BYTEA := '';
+  coord_data BYTEA := '';
+BEGIN
+  FOR i IN 1..natms LOOP
+    fields := regexp_split_to_array(btrim(lines[i + 2]), '\s+');
+    symb_data := symb_data || convert_to(rpad(fields[1], 2), 'UTF8');
+    coord_data := coord_data
+      || float8send(fields[2]::FLOAT8)
+      || float8send(fields[3]::FLOAT8)
+      || float8send(fields[4]::FLOAT8);
+  END LOOP;
+  RETURN symb_data || coord_data;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE STRICT;
+
+DO $$
+DECLARE
+  name TEXT;
+BEGIN
+  FOREACH name IN ARRAY ARRAY['species', 'reaction_ts'] LOOP
+    IF (
+      SELECT data_type FROM information_schema.columns
+      WHERE table_schema = current_schema()
+      AND table_name = name AND column_name = 'geometry'
+    ) = 'text' THEN
+      EXECUTE format(
+        'ALTER TABLE %I ALTER COLUMN geometry TYPE BYTEA '
+        'USING pg_temp.xyz_to_geometry_data(geometry);',
+        name
+      );
+    END IF;
+  END LOOP;
+END;
+$$;
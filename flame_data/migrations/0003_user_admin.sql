@@ -0,0 +1,4 @@
+-- Add an admin flag to users, for admin-only tools such as request profiling
+-- Grant it with: UPDATE users SET admin = TRUE WHERE email = '<email>';
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS admin BOOLEAN NOT NULL DEFAULT FALSE;
@@ -0,0 +1,15 @@
+-- Store the responses to submissions, so that retries with the same Idempotency-Key
+-- header can be answered without redoing the work
+
+CREATE TABLE IF NOT EXISTS idempotency_key (
+  user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  key VARCHAR(255) NOT NULL,
+  request_hash TEXT NOT NULL,
+  status INTEGER,
+  content_type TEXT,
+  body BYTEA,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (user_id, key)
+);
+
+CREATE INDEX IF NOT EXISTS idempotency_key_created_at_idx ON idempotency_key (created_at);
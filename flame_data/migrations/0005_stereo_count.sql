@@ -0,0 +1,9 @@
+-- Record the total number of stereoisomers of each species, which can be more than the
+-- number stored when STEREO_CAP is set
+
+ALTER TABLE species_estate ADD COLUMN IF NOT EXISTS stereo_count INTEGER;
+
+UPDATE species_estate SET stereo_count = (
+  SELECT COUNT(*) FROM species WHERE species.estate_id = species_estate.id
+)
+WHERE stereo_count IS NULL;
@@ -0,0 +1,15 @@
+-- Track whether each TS geometry has been generated, so that generating them can be
+-- deferred to the background worker (flame_data/worker.py)
+--   pending: waiting for the worker
+--   running: claimed by a worker
+--   ready: generated (or uploaded)
+--   failed: couldn't be generated
+
+ALTER TABLE reaction_ts
+  ADD COLUMN IF NOT EXISTS geometry_status TEXT NOT NULL DEFAULT 'ready';
+
+UPDATE reaction_ts SET geometry_status = 'pending'
+WHERE geometry IS NULL AND geometry_status = 'ready';
+
+CREATE INDEX IF NOT EXISTS reaction_ts_geometry_pending_idx
+ON reaction_ts (id) WHERE geometry_status = 'pending';
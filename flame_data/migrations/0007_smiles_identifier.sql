@@ -0,0 +1,8 @@
+-- Memoize the identifiers computed from raw SMILES strings, which are slow to compute
+-- (see flame_data/_identifiers.py)
+
+CREATE TABLE IF NOT EXISTS smiles_identifier (
+  smiles TEXT PRIMARY KEY,
+  conn_inchi_hash CHAR(14),
+  amchi_key CHAR(27)
+);
@@ -0,0 +1,34 @@
+-- Normalize which species connectivities take part in each reaction connectivity into
+-- an indexed join table, instead of scanning the r_conn_ids and p_conn_ids arrays
+
+CREATE TABLE IF NOT EXISTS reaction_connectivity_species (
+  reaction_conn_id BIGINT NOT NULL
+    REFERENCES reaction_connectivity(id)
+    ON DELETE CASCADE,
+  species_conn_id BIGINT NOT NULL
+    REFERENCES species_connectivity(id)
+    ON DELETE CASCADE,
+  role TEXT NOT NULL CHECK (role IN ('reactant', 'product')),
+  PRIMARY KEY (reaction_conn_id, species_conn_id, role)
+);
+
+CREATE INDEX IF NOT EXISTS reaction_connectivity_species_species_idx
+ON reaction_connectivity_species (species_conn_id, role);
+
+-- Fill it in from the arrays, skipping any IDs that no longer exist
+INSERT INTO reaction_connectivity_species (reaction_conn_id, species_conn_id, role)
+SELECT reaction_connectivity.id, species_connectivity.id, reagents.role
+FROM reaction_connectivity
+CROSS JOIN LATERAL (
+  SELECT unnest(r_conn_ids) AS conn_id, 'reactant' AS role
+  UNION ALL
+  SELECT unnest(p_conn_ids), 'product'
+) AS reagents
+JOIN species_connectivity ON species_connectivity.id = reagents.conn_id
+ON CONFLICT DO NOTHING;
+
+DROP TRIGGER IF EXISTS reaction_connectivity_species_generation
+ON reaction_connectivity_species;
+CREATE TRIGGER reaction_connectivity_species_generation
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON reaction_connectivity_species
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_generation();
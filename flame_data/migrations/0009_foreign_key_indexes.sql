@@ -0,0 +1,35 @@
+-- migrate: no-transaction
+-- Index the foreign keys that the detail and collection queries join through. Postgres
+-- only indexes the referenced side of a foreign key, so without these every join from
+-- a parent row to its children scans the child table. The indexes are built
+-- concurrently, so that they don't block writes to a live database.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS species_estate_conn_id_idx
+ON species_estate (conn_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS species_estate_id_idx
+ON species (estate_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS reaction_conn_id_idx
+ON reaction (conn_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS reaction_estate_reaction_id_idx
+ON reaction_estate (reaction_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS reaction_ts_estate_id_idx
+ON reaction_ts (estate_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS reaction_reactants_species_id_idx
+ON reaction_reactants (species_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS reaction_products_species_id_idx
+ON reaction_products (species_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS collection_user_id_idx
+ON collection (user_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS collection_species_species_id_idx
+ON collection_species (species_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS collection_reactions_reaction_id_idx
+ON collection_reactions (reaction_id);
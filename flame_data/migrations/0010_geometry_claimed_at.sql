@@ -0,0 +1,5 @@
+-- Record when a worker claimed each TS, so that TSs left "running" by a worker that
+-- stopped can be reclaimed once the claim is stale, while other workers keep going.
+-- The index on it is built concurrently, in 0013.
+
+ALTER TABLE reaction_ts ADD COLUMN IF NOT EXISTS geometry_claimed_at TIMESTAMPTZ;
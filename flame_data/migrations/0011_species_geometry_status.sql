@@ -0,0 +1,16 @@
+-- Track whether each species geometry has been generated, like the TS geometries (see
+-- 0006 and 0010), so that only the background worker generates them, one species at a
+-- time, and species whose geometries can't be generated aren't retried
+--   pending: waiting for the worker
+--   running: claimed by a worker
+--   ready: generated (or uploaded)
+--   failed: couldn't be generated
+-- The indexes for the worker are built concurrently, in 0014.
+
+ALTER TABLE species
+  ADD COLUMN IF NOT EXISTS geometry_status TEXT NOT NULL DEFAULT 'ready';
+
+ALTER TABLE species ADD COLUMN IF NOT EXISTS geometry_claimed_at TIMESTAMPTZ;
+
+UPDATE species SET geometry_status = 'pending'
+WHERE geometry IS NULL AND geometry_status = 'ready';
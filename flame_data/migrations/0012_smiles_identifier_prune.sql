@@ -0,0 +1,4 @@
+-- Lookups used to memoize every SMILES string they were given, so the table could grow
+-- without bound. Now only submissions write to it; clear it, and let them refill it
+
+DELETE FROM smiles_identifier;
@@ -0,0 +1,7 @@
+-- migrate: no-transaction
+-- Index the TSs claimed by workers (see 0010), so that stale claims can be found
+-- without scanning the table. The index is built concurrently, so that it doesn't
+-- block writes to a live database.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS reaction_ts_geometry_running_idx
+ON reaction_ts (geometry_claimed_at) WHERE geometry_status = 'running';
@@ -0,0 +1,10 @@
+-- migrate: no-transaction
+-- Index the species waiting for geometries and the species claimed by workers (see
+-- 0011), so that the worker can find them without scanning the table. The indexes are
+-- built concurrently, so that they don't block writes to a live database.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS species_geometry_pending_idx
+ON species (id) WHERE geometry_status = 'pending';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS species_geometry_running_idx
+ON species (geometry_claimed_at) WHERE geometry_status = 'running';
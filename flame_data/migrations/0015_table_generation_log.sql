@@ -0,0 +1,38 @@
+-- Record table generations in an append-only log, rather than in one row per table.
+-- Updating that row made every write to a table wait on the row lock of every other
+-- uncommitted write to it, and cascading deletes, which fire the triggers of the child
+-- tables first, could deadlock with inserts, which lock them parent first.
+--
+-- Each modifying statement now inserts a row with a fresh value from the sequence, and
+-- a table's generation is the sum of its rows. That grows with every commit, in
+-- whatever order the writes commit, which the maximum wouldn't. The worker prunes the
+-- log by replacing each table's rows with one row holding their sum (see
+-- `query.prune_table_generations()`).
+
+CREATE TABLE IF NOT EXISTS table_generation_log (
+  table_name TEXT NOT NULL,
+  generation BIGINT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS table_generation_log_table_name_idx
+ON table_generation_log (table_name) INCLUDE (generation);
+
+CREATE OR REPLACE FUNCTION bump_table_generation() RETURNS TRIGGER AS $$
+BEGIN
+  INSERT INTO table_generation_log (table_name, generation)
+  VALUES (TG_TABLE_NAME, nextval('table_generation_seq'));
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Carry the current generations over, so that they keep growing
+DO $$
+BEGIN
+  IF to_regclass('table_generation') IS NOT NULL THEN
+    INSERT INTO table_generation_log (table_name, generation)
+    SELECT table_name, generation FROM table_generation;
+
+    DROP TABLE table_generation;
+  END IF;
+END;
+$$;
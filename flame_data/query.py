@@ -1,11 +1,39 @@
-from typing import List, Tuple, Union
+import logging
+import os
+from typing import List, Optional, Tuple, Union
 
 import automol
-
-from flame_data import chem
-from flame_data._pool import pg_connection, pg_cursor
+import dotenv
+
+from flame_data import (
+    _identifiers,
+    _index,
+    _metrics,
+    _network,
+    _sandbox,
+    _timing,
+    chem,
+    geometry,
+)
+from flame_data._pool import pg_advisory_lock, pg_connection, pg_cursor
 from flame_data.utils import row_with_array_literals
 
+dotenv.load_dotenv()
+
+# The maximum number of stereoisomers stored per species (0 for no limit); the total
+# number is always recorded as the species' `stereo_count`
+STEREO_CAP = int(os.getenv("STEREO_CAP", "0"))
+# Store stereoisomers without geometries, leaving them for the background worker
+STEREO_LAZY = os.getenv("STEREO_LAZY", "").lower() in ("1", "true", "yes")
+# Store TSs without geometries, leaving them for the background worker (flame_data.worker)
+DEFER_TS_GEOMETRIES = os.getenv("DEFER_TS_GEOMETRIES", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+logger = logging.getLogger(__name__)
+
 
 # USER TABLE
 def get_user(id: int, return_password: bool = False) -> dict:
@@ -156,23 +184,46 @@ def search_species_connectivities(
 
 
 def search_reaction_connectivities(
-    fml_str: str = None, is_partial: bool = False
+    fml_str: str = None,
+    is_partial: bool = False,
+    species_ids: Optional[List[int]] = None,
+    role: str = "either",
 ) -> List[dict]:
     """Get connectivity reaction grouped by formula
 
-    Optionally, search for reaction matching a particular formula
+    Optionally, search for reaction matching a particular formula, or for reactions
+    that a set of species take part in
 
     :param fml_str: A formula string to search for, defaults to None
     :type fml: str, optional
     :param is_partial: Whether the formula is partial, defaults to False
     :type is_partial: bool, optional
+    :param species_ids: Species connectivity IDs; if given, only reactions that all of
+        them take part in are returned, defaults to None
+    :type species_ids: Optional[List[int]], optional
+    :param role: The role of the species; options: "reactant", "product", "either"
+    :type role: str, optional
     :return: Connectivity reaction information
     :rtype: List[dict]
     """
+    assert role in ("reactant", "product", "either"), f"Invalid role {role}"
+
     clause_string, query_params = formula_matching_clauses_and_params(
         fml_str, is_partial=is_partial
     )
 
+    # Add species matching to query string, if requested, using the membership table
+    if species_ids is not None:
+        species_ids = sorted(set(species_ids))
+        clause_string += " AND " if clause_string else "WHERE "
+        clause_string += """id IN (
+            SELECT reaction_conn_id FROM reaction_connectivity_species
+            WHERE species_conn_id = ANY(%s) AND (%s = 'either' OR role = %s)
+            GROUP BY reaction_conn_id
+            HAVING COUNT(DISTINCT species_conn_id) = %s
+        )"""
+        query_params = [*query_params, species_ids, role, role, len(species_ids)]
+
     query_string = f"""
         SELECT * FROM reaction_connectivity {clause_string};
     """
@@ -218,7 +269,7 @@ def lookup_species_connectivities(
     :rtype: Union[List[dict], List[int]]
     """
     hashes, (is_amchi, *_) = zip(
-        *(chem.species_connectivity_chi_hash(k, key_type) for k in keys)
+        *_identifiers.species_connectivity_chi_hashes(keys, key_type)
     )
 
     query_string = f"""
@@ -272,7 +323,7 @@ def lookup_reaction_connectivities(
     :rtype: Union[List[dict], List[int]]
     """
     hash_pairs, (is_amchi, *_) = zip(
-        *(chem.reaction_connectivity_chi_hashes(k, key_type) for k in keys)
+        *(_identifiers.reaction_connectivity_chi_hashes(k, key_type) for k in keys)
     )
 
     query_string = f"""
@@ -303,7 +354,7 @@ def lookup_species(keys: str, key_type: str = "smiles", id_only: bool = False) -
     :return: The row of the species connectivity
     :rtype: dict
     """
-    chi_keys = [chem.species_amchi_key(k, key_type) for k in keys]
+    chi_keys = _identifiers.species_amchi_keys(keys, key_type)
 
     query_string = """
         SELECT * FROM species
@@ -319,37 +370,63 @@ def lookup_species(keys: str, key_type: str = "smiles", id_only: bool = False) -
     return query_results
 
 
-def add_species_by_smiles_connectivity(smi: str) -> Tuple[int, str]:
+def add_species_by_smiles_connectivity(
+    smi: str, recheck: bool = False
+) -> Tuple[int, str]:
     """Add a new species using its SMILES string, returning the connectivity ID
 
     :param smi: SMILES string
     :type smi: str
+    :param recheck: Check the database, even if the in-process index has the species?
+        For when it was just found missing, since the index can still list a species
+        that another process deleted since its last sync; default False
+    :type recheck: bool, optional
     :returns: A status code and an error message, if it failed
     :rtype: Tuple[int, str]
     """
+    # Shared by the row builders, so that each identifier is only computed once
+    spc = chem.SpeciesDerivation(smi)
     try:
-        row = lookup_species_connectivity(smi, key_type="smiles")
-        if not row:
-            _add_species_by_smiles_connectivity(smi)
+        conn_hash, _ = _identifiers.species_connectivity_chi_hash(smi, save=True)
+        # The in-process index answers most existence checks without the database; a
+        # miss is still checked against the database under the lock
+        known = None if recheck else _index.SPECIES.contains(conn_hash)
+        if known is None:
+            known = bool(lookup_species_connectivity(conn_hash, key_type="inchi_hash"))
+        if not known:
+            # Only one request at a time can add a given species; any others wait for
+            # it to finish, then find the species already there
+            with pg_advisory_lock(f"species:{conn_hash}"):
+                if not lookup_species_connectivity(conn_hash, key_type="inchi_hash"):
+                    _add_species_by_smiles_connectivity(spc)
+                    _index.SPECIES.add(
+                        {"inchi": conn_hash, "amchi": spc.conn_amchi_hash}
+                    )
+    except _sandbox.TooComplex as exc:
+        return 422, f"{smi} is too complex to add: {exc}"
     except Exception as exc:
         return 500, f"Adding {smi} to database failed with this exception:\n{exc}"
 
     return 0, ""
 
 
-def _add_species_by_smiles_connectivity(smi: str) -> int:
+def _add_species_by_smiles_connectivity(smi: Union[str, chem.SpeciesDerivation]) -> int:
     """Add a new species using its SMILES string, returning the connectivity ID
 
     (Only for species that don't already exist!)
 
-    :param smi: SMILES string
-    :type smi: str
+    :param smi: SMILES string, or a derivation
+    :type smi: Union[str, chem.SpeciesDerivation]
     :return: The connectivity ID of the species
     :rtype: int
     """
-    conn_row = chem.species_connectivity_row(smi)
-    estate_row = chem.species_estate_row(smi)
-    spc_rows = chem.species_rows(smi)
+    spc = chem.species_derivation(smi)
+    conn_row = chem.species_connectivity_row(spc)
+    estate_row = chem.species_estate_row(spc)
+    spc_rows, stereo_count = _sandbox.run(
+        chem.species_rows, spc, not STEREO_LAZY, STEREO_CAP or None
+    )
+    _metrics.observe_species_submission(len(spc_rows))
 
     with pg_connection() as conn:
         with pg_cursor(conn) as cursor:
@@ -371,33 +448,102 @@ def _add_species_by_smiles_connectivity(smi: str) -> int:
             # INSERT INTO species_estate
             query_string2 = """
                 INSERT INTO species_estate
-                (spin_mult, conn_id)
+                (spin_mult, stereo_count, conn_id)
                 VALUES
-                (%(spin_mult)s, %(id)s)
+                (%(spin_mult)s, %(stereo_count)s, %(id)s)
                 RETURNING id;
             """
-            query_params2 = {**query_result1, **estate_row}
+            query_params2 = {
+                **query_result1,
+                **estate_row,
+                "stereo_count": stereo_count,
+            }
             cursor.execute(query_string2, query_params2)
             query_result2 = cursor.fetchone()
 
             # INSERT INTO species
             query_string3 = """
                 INSERT INTO species
-                (geometry, smiles, inchi, amchi, amchi_key, estate_id)
+                (geometry, geometry_status, smiles, inchi, amchi, amchi_key, estate_id)
                 VALUES
-                (%(geometry)s, %(smiles)s, %(inchi)s, %(amchi)s, %(amchi_key)s, %(id)s)
+                (%(geometry)s, %(geometry_status)s, %(smiles)s, %(inchi)s, %(amchi)s,
+                %(amchi_key)s, %(id)s)
             """
-            query_params3 = [{**query_result2, **spc_row} for spc_row in spc_rows]
+            query_params3 = [
+                {
+                    **query_result2,
+                    **spc_row,
+                    "geometry_status": (
+                        "pending" if spc_row["geometry"] is None else "ready"
+                    ),
+                }
+                for spc_row in spc_rows
+            ]
             cursor.executemany(query_string3, query_params3)
 
     return query_result1["id"]
 
 
-def add_reaction_by_smiles_connectivity(smi: str) -> Tuple[int, str]:
+def _add_missing_species(achs: List[str]):
+    """Add species stereoisomers that aren't stored yet, leaving their geometries for
+    the worker
+
+    (Only for stereoisomers of species connectivities that already exist!)
+
+    :param achs: AMChI chemical identifier strings, with stereo
+    :type achs: List[str]
+    """
+    achs = sorted(set(achs))
+    query_string1 = """
+        SELECT amchi FROM species WHERE amchi = ANY(%s);
+    """
+    query_params1 = [achs]
+
+    with pg_connection() as conn:
+        with pg_cursor(conn) as cursor:
+            cursor.execute(query_string1, query_params1)
+            stored_achs = {r["amchi"] for r in cursor.fetchall()}
+
+    missing_achs = [a for a in achs if a not in stored_achs]
+    if not missing_achs:
+        return
+
+    spc_rows = [
+        {
+            **chem.species_row_from_amchi(ach),
+            "conn_amchi_hash": chem.species_connectivity_chi_hash(ach, "amchi")[0],
+        }
+        for ach in missing_achs
+    ]
+    query_string2 = """
+        INSERT INTO species
+        (geometry, geometry_status, smiles, inchi, amchi, amchi_key, estate_id)
+        SELECT
+            NULL, 'pending', %(smiles)s, %(inchi)s, %(amchi)s, %(amchi_key)s,
+            species_estate.id
+        FROM species_estate
+        JOIN species_connectivity ON species_estate.conn_id = species_connectivity.id
+        WHERE conn_amchi_hash = %(conn_amchi_hash)s
+        ORDER BY species_estate.id
+        LIMIT 1
+        ON CONFLICT (amchi_key) DO NOTHING;
+    """
+
+    with pg_connection() as conn:
+        with pg_cursor(conn) as cursor:
+            cursor.executemany(query_string2, spc_rows)
+
+
+def add_reaction_by_smiles_connectivity(
+    smi: str, recheck: bool = False
+) -> Tuple[int, str]:
     """Add a new reaction using its SMILES string, returning the connectivity ID
 
     :param smi: SMILES string
     :type smi: str
+    :param recheck: Check the database for the reaction and its species, even if the
+        in-process indexes have them?; default False
+    :type recheck: bool, optional
     :returns: A status code and an error message, if it failed
     :rtype: Tuple[int, str]
     """
@@ -409,30 +555,58 @@ def add_reaction_by_smiles_connectivity(smi: str) -> Tuple[int, str]:
         rsmis = automol.smiles.reaction_reactants(smi)
         psmis = automol.smiles.reaction_products(smi)
         for smi_ in rsmis + psmis:
-            status, error = add_species_by_smiles_connectivity(smi_)
+            status, error = add_species_by_smiles_connectivity(smi_, recheck=recheck)
             if status >= 400:
                 return status, error
 
         # 2. Add the reaction
-        row = lookup_reaction_connectivity(smi, key_type="smiles")
-        if not row:
-            _add_reaction_by_smiles_connectivity(smi)
+        rxn = chem.ReactionDerivation(smi)
+        (rhash, phash), _ = _identifiers.reaction_connectivity_chi_hashes(
+            smi, save=True
+        )
+        known = None if recheck else _index.REACTIONS.contains(rhash + phash)
+        if known is None:
+            known = bool(
+                lookup_reaction_connectivity((rhash, phash), key_type="inchi_hash")
+            )
+        if not known:
+            # Only one request at a time can add a given reaction; any others wait for
+            # it to finish, then find the reaction already there
+            with pg_advisory_lock(f"reaction:{rhash}:{phash}"):
+                if not lookup_reaction_connectivity(
+                    (rhash, phash), key_type="inchi_hash"
+                ):
+                    _add_reaction_by_smiles_connectivity(rxn)
+                    _index.REACTIONS.add(
+                        {
+                            "inchi": rhash + phash,
+                            "amchi": "".join(rxn.reagent_amchi_hashes),
+                        }
+                    )
+    except _sandbox.TooComplex as exc:
+        return 422, f"{smi} is too complex to add: {exc}"
     except Exception as exc:
         return 500, f"Adding {smi} to database failed with this exception:\n{exc}"
     return 0, ""
 
 
-def _add_reaction_by_smiles_connectivity(smi: str) -> int:
+def _add_reaction_by_smiles_connectivity(
+    smi: Union[str, chem.ReactionDerivation],
+) -> int:
     """Add a new reaction using its SMILES string, returning the connectivity ID
 
-    :param smi: SMILES string
-    :type smi: str
+    :param smi: SMILES string, or a derivation
+    :type smi: Union[str, chem.ReactionDerivation]
     :return: The connectivity ID of the reaction
     :rtype: int
     """
-    conn_row = chem.reaction_connectivity_row(smi)
-    estate_row = chem.reaction_estate_row(smi)
-    rxn_rows, ts_grouped_rows = chem.reaction_and_ts_rows(smi)
+    rxn = chem.reaction_derivation(smi)
+    conn_row = chem.reaction_connectivity_row(rxn)
+    estate_row = chem.reaction_estate_row(rxn)
+    rxn_rows, ts_grouped_rows = _sandbox.run(
+        chem.reaction_and_ts_rows, rxn, not DEFER_TS_GEOMETRIES
+    )
+    _metrics.observe_reaction_submission(sum(map(len, ts_grouped_rows)))
 
     # Determine the connectivity IDs of the reactants and products
     rhashes = conn_row["r_conn_inchi_hashes"]
@@ -448,6 +622,12 @@ def _add_reaction_by_smiles_connectivity(smi: str) -> int:
     conn_row["r_conn_ids"] = r_conn_ids
     conn_row["p_conn_ids"] = p_conn_ids
 
+    # With a stereo cap, some of the reagent stereoisomers may not be stored yet
+    if STEREO_CAP:
+        _add_missing_species(
+            [ach for r in rxn_rows for ach in r["r_amchis"] + r["p_amchis"]]
+        )
+
     with pg_connection() as conn:
         with pg_cursor(conn) as cursor:
             # INSERT INTO reaction_connectivity
@@ -571,13 +751,20 @@ def _add_reaction_by_smiles_connectivity(smi: str) -> int:
 
             query_string4 = """
                 INSERT INTO reaction_ts
-                (geometry, class, amchi, amchi_key, estate_id)
+                (geometry, geometry_status, class, amchi, amchi_key, estate_id)
                 VALUES
-                (%(geometry)s, %(class)s, %(amchi)s, %(amchi_key)s, %(id)s)
+                (%(geometry)s, %(geometry_status)s, %(class)s, %(amchi)s,
+                %(amchi_key)s, %(id)s)
                 RETURNING id;
             """
             query_params4 = [
-                {**query_result3, **ts_row}
+                {
+                    **query_result3,
+                    **ts_row,
+                    "geometry_status": (
+                        "pending" if ts_row["geometry"] is None else "ready"
+                    ),
+                }
                 for query_result3, ts_rows in zip(query_results3, ts_grouped_rows)
                 for ts_row in ts_rows
             ]
@@ -617,6 +804,23 @@ def _add_reaction_by_smiles_connectivity(smi: str) -> int:
             ]
             cursor.executemany(query_string6, query_params6)
 
+            # INSERT INTO reaction_connectivity_species
+            query_string7 = """
+                INSERT INTO reaction_connectivity_species
+                (reaction_conn_id, species_conn_id, role)
+                VALUES (%(id)s, %(species_conn_id)s, %(role)s)
+                ON CONFLICT DO NOTHING;
+            """
+            query_params7 = [
+                {**query_result1, "species_conn_id": species_conn_id, "role": role}
+                for role, species_conn_ids in (
+                    ("reactant", r_conn_ids),
+                    ("product", p_conn_ids),
+                )
+                for species_conn_id in species_conn_ids
+            ]
+            cursor.executemany(query_string7, query_params7)
+
 
 def get_species_by_connectivity(
     id: int, id_only: bool = False
@@ -629,13 +833,15 @@ def get_species_by_connectivity(
     :type id_only: bool, optional
     :return: Details for each isomer, as a list of dictionaries; keys:
         id, conn_id, estate_id, formula, svg_string, conn_smiles, conn_inchi,
-        conn_amchi, spin_mult, smiles, inchi, amchi, geometry
+        conn_amchi, spin_mult, stereo_count, smiles, inchi, amchi, geometry,
+        geometry_status (the geometry is `None` until the worker has generated it)
     :rtype: Union[List[dict], List[int]]
     """
     query_string = """
         SELECT
             species.id, conn_id, estate_id, formula, svg_string, conn_smiles, conn_inchi,
-            conn_amchi, spin_mult, smiles, inchi, amchi, geometry
+            conn_amchi, spin_mult, stereo_count, smiles, inchi, amchi, geometry,
+            geometry_status
         FROM species_connectivity
         JOIN species_estate ON species_connectivity.id = species_estate.conn_id
         JOIN species ON species_estate.id = species.estate_id
@@ -650,6 +856,8 @@ def get_species_by_connectivity(
 
     if id_only:
         query_results = [r["id"] for r in query_results]
+    else:
+        query_results = rows_with_xyz_geometries(query_results)
 
     return query_results
 
@@ -665,18 +873,109 @@ def get_species_connectivity_ids_by_reaction_connectivity(id: int) -> List[int]:
     :rtype: List[int]
     """
     query_string = """
-        SELECT (p_conn_ids || r_conn_ids) as "ids"
-        FROM reaction_connectivity
-        WHERE reaction_connectivity.id = %s;
+        SELECT DISTINCT species_conn_id AS id
+        FROM reaction_connectivity_species
+        WHERE reaction_conn_id = %s;
     """
     query_params = [id]
 
     with pg_connection() as conn:
         with pg_cursor(conn) as cursor:
             cursor.execute(query_string, query_params)
-            query_result = cursor.fetchone()
+            query_results = cursor.fetchall()
+
+    return [r["id"] for r in query_results]
+
+
+def get_reaction_connectivity_ids_by_species_connectivity(
+    id: int, role: str = "either"
+) -> List[int]:
+    """Get all reaction connectivities that a certain species takes part in
+
+    :param id: The ID of the species connectivity
+    :type id: int
+    :param role: The role of the species; options: "reactant", "product", "either"
+    :type role: str, optional
+    :return: The ID of each reaction connectivity
+    :rtype: List[int]
+    """
+    assert role in ("reactant", "product", "either"), f"Invalid role {role}"
 
-    return list(set(query_result["ids"]))
+    query_string = """
+        SELECT DISTINCT reaction_conn_id AS id
+        FROM reaction_connectivity_species
+        WHERE species_conn_id = %(id)s
+        AND (%(role)s = 'either' OR role = %(role)s)
+        ORDER BY id;
+    """
+    query_params = {"id": id, "role": role}
+
+    with pg_connection() as conn:
+        with pg_cursor(conn) as cursor:
+            cursor.execute(query_string, query_params)
+            query_results = cursor.fetchall()
+
+    return [r["id"] for r in query_results]
+
+
+def find_reaction_pathways(
+    source_id: int,
+    target_id: int,
+    max_steps: int = 3,
+    limit: int = 20,
+    reversible: bool = False,
+    exclude_ids: List[int] = (),
+) -> List[List[dict]]:
+    """Find the chains of reactions that lead from one species connectivity to another
+
+    The search runs over the in-process reaction network (see `_network`), and only
+    the SMILES strings of the reactions found are looked up in the database
+
+    :param source_id: The ID of the species connectivity to start from
+    :type source_id: int
+    :param target_id: The ID of the species connectivity to end at
+    :type target_id: int
+    :param max_steps: The most reactions in a pathway, defaults to 3
+    :type max_steps: int, optional
+    :param limit: The most pathways to return, defaults to 20
+    :type limit: int, optional
+    :param reversible: Allow reactions to run in reverse?, defaults to False
+    :type reversible: bool, optional
+    :param exclude_ids: Species connectivities not to pass through, defaults to ()
+    :type exclude_ids: List[int], optional
+    :return: The pathways, shortest first; each step has keys `reaction_conn_id`,
+        `conn_smiles`, `from_conn_id`, `to_conn_id`, and `reverse`
+    :rtype: List[List[dict]]
+    """
+    pathways = _network.NETWORK.pathways(
+        source_id,
+        target_id,
+        max_steps=max_steps,
+        limit=limit,
+        reversible=reversible,
+        exclude=exclude_ids,
+    )
+
+    rxn_ids = sorted({s["reaction_conn_id"] for p in pathways for s in p})
+    if not rxn_ids:
+        return pathways
+
+    query_string = """
+        SELECT id, conn_smiles FROM reaction_connectivity WHERE id = ANY(%s);
+    """
+    query_params = [rxn_ids]
+
+    with pg_connection() as conn:
+        with pg_cursor(conn) as cursor:
+            cursor.execute(query_string, query_params)
+            smiles = {r["id"]: r["conn_smiles"] for r in cursor.fetchall()}
+
+    # Drop any pathways through reactions that were deleted since the last sync
+    pathways = [p for p in pathways if all(s["reaction_conn_id"] in smiles for s in p)]
+    for step in (s for p in pathways for s in p):
+        step["conn_smiles"] = smiles[step["reaction_conn_id"]]
+
+    return pathways
 
 
 def get_reactions_by_connectivity(
@@ -690,7 +989,8 @@ def get_reactions_by_connectivity(
     :type id_only: bool, optional
     :return: Details for each isomer, as a list of dictionaries; keys:
         id, conn_id, estate_id, formula, svg_string, conn_smiles, conn_inchi,
-        conn_amchi, spin_mult, smiles, inchi, amchi, geometry
+        conn_amchi, spin_mult, smiles, inchi, amchi, geometry, geometry_statuses
+        ("pending", "ready", or "failed", for each TS), geometries_pending
     :rtype: List[dict]
     """
     query_string = """
@@ -719,6 +1019,8 @@ def get_reactions_by_connectivity(
             -- TS columns
             ARRAY_AGG(reaction_ts.id) AS ts_ids,
             ARRAY_AGG(geometry) AS geometries,
+            ARRAY_AGG(geometry_status) AS geometry_statuses,
+            BOOL_OR(geometry_status = 'pending') AS geometries_pending,
             ARRAY_AGG(class) AS classes,
             ARRAY_AGG(amchi) AS amchis,
             ARRAY_AGG(amchi_key) AS amchi_keys
@@ -738,6 +1040,8 @@ def get_reactions_by_connectivity(
 
     if id_only:
         query_results = [r["id"] for r in query_results]
+    else:
+        query_results = rows_with_xyz_geometries(query_results)
 
     return query_results
 
@@ -796,23 +1100,31 @@ def delete_species_connectivity(id: int) -> (int, str):
 
     with pg_connection() as conn:
         with pg_cursor(conn) as cursor:
-            # 1. Delete from the species connectivity table
+            # 1. Delete from the reaction connectivity table (first, since deleting the
+            # species cascades to its reaction_connectivity_species rows)
             query_string1 = """
-                DELETE FROM species_connectivity WHERE id = %s;
+                DELETE FROM reaction_connectivity
+                WHERE id IN (
+                    SELECT reaction_conn_id FROM reaction_connectivity_species
+                    WHERE species_conn_id = %s
+                );
             """
             query_params1 = [id]
             cursor.execute(query_string1, query_params1)
             success &= bool(cursor.rowcount)
 
-            # 2. Delete from the reaction connectivity table
+            # 2. Delete from the species connectivity table
             query_string2 = """
-                DELETE FROM reaction_connectivity
-                WHERE %s = ANY(r_conn_ids) OR %s = ANY(p_conn_ids);
+                DELETE FROM species_connectivity WHERE id = %s;
             """
-            query_params2 = [id, id]
+            query_params2 = [id]
             cursor.execute(query_string2, query_params2)
             success &= bool(cursor.rowcount)
 
+    _index.SPECIES.invalidate()
+    _index.REACTIONS.invalidate()
+    _network.NETWORK.invalidate()
+
     if not success:
         return 404, f"No resource with ID {id} was found."
 
@@ -839,6 +1151,9 @@ def delete_reaction_connectivity(id: int) -> (int, str):
             cursor.execute(query_string1, query_params1)
             success &= bool(cursor.rowcount)
 
+    _index.REACTIONS.invalidate()
+    _network.NETWORK.invalidate()
+
     if not success:
         return 404, f"No resource with ID {id} was found."
 
@@ -860,16 +1175,14 @@ def update_species_geometry(id: int, xyz_str: str) -> bool:
         return 404, f"No resource with ID {id} was found."
 
     ach = species_row["amchi"]
-    ret = chem.validate_species_geometry(ach, xyz_str)
-    if ret is None:
+    geo_data = chem.validate_species_geometry(ach, xyz_str)
+    if geo_data is None:
         return 415, f"Invalid xyz string for species {ach}:\n{xyz_str}"
 
-    xyz_str = ret
-
     query_string = """
-        UPDATE species SET geometry = %s WHERE id = %s;
+        UPDATE species SET geometry = %s, geometry_status = 'ready' WHERE id = %s;
     """
-    query_params = [xyz_str, id]
+    query_params = [geo_data, id]
 
     with pg_connection() as conn:
         with pg_cursor(conn) as cursor:
@@ -898,16 +1211,14 @@ def update_reaction_ts_geometry(id: int, xyz_str: str) -> bool:
     # order of the geometry, allowing us to handle the breaking/forming bonds
     # appropriately
     ach = reaction_row["amchi"]
-    ret = chem.validate_reaction_geometry(ach, xyz_str)
-    if ret is None:
+    geo_data = chem.validate_reaction_geometry(ach, xyz_str)
+    if geo_data is None:
         return 415, f"Invalid xyz string for reaction {ach}:\n{xyz_str}"
 
-    xyz_str = ret
-
     query_string = """
-        UPDATE reaction_ts SET geometry = %s WHERE id = %s;
+        UPDATE reaction_ts SET geometry = %s, geometry_status = 'ready' WHERE id = %s;
     """
-    query_params = [xyz_str, id]
+    query_params = [geo_data, id]
 
     with pg_connection() as conn:
         with pg_cursor(conn) as cursor:
@@ -916,6 +1227,177 @@ def update_reaction_ts_geometry(id: int, xyz_str: str) -> bool:
     return 0, ""
 
 
+def fill_pending_species_geometries(limit: int = 10) -> int:
+    """Generate and save species geometries that were deferred
+
+    Works through one species at a time, claiming it by marking it "running", so that
+    concurrent workers don't duplicate the work. Species whose geometries can't be
+    generated are marked "failed".
+
+    :param limit: The maximum number of species to work through, defaults to 10
+    :type limit: int, optional
+    :return: The number of species geometries that were filled in
+    :rtype: int
+    """
+    query_string1 = """
+        UPDATE species SET geometry_status = 'running', geometry_claimed_at = now()
+        WHERE id = (
+            SELECT id FROM species
+            WHERE geometry_status = 'pending'
+            ORDER BY id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, amchi;
+    """
+    query_string2 = """
+        UPDATE species SET geometry = %(geometry)s, geometry_status = %(status)s
+        WHERE id = %(id)s AND geometry_status = 'running';
+    """
+
+    count = 0
+    for _ in range(limit):
+        with pg_connection() as conn:
+            with pg_cursor(conn) as cursor:
+                cursor.execute(query_string1)
+                spc_row = cursor.fetchone()
+                if spc_row is None:
+                    break
+
+        ach = spc_row["amchi"]
+        try:
+            (geo_data,) = _sandbox.run(chem.species_geometries, [ach])
+        except Exception as exc:
+            logger.warning("Generating the geometry for %s failed: %s", ach, exc)
+            geo_data = None
+
+        query_params2 = {
+            "id": spc_row["id"],
+            "geometry": geo_data,
+            "status": "failed" if geo_data is None else "ready",
+        }
+        with pg_connection() as conn:
+            with pg_cursor(conn) as cursor:
+                cursor.execute(query_string2, query_params2)
+
+        count += geo_data is not None
+
+    return count
+
+
+def fill_pending_ts_geometries(limit: int = 10) -> int:
+    """Generate and save TS geometries that were deferred
+
+    Works through one reaction connectivity at a time, claiming its pending TSs by
+    marking them "running", so that concurrent workers don't duplicate the work. TSs
+    whose geometries can't be generated are marked "failed".
+
+    :param limit: The maximum number of reaction connectivities to work through,
+        defaults to 10
+    :type limit: int, optional
+    :return: The number of TS geometries that were filled in
+    :rtype: int
+    """
+    query_string1 = """
+        SELECT reaction_connectivity.id, conn_smiles
+        FROM reaction_ts
+        JOIN reaction_estate ON reaction_ts.estate_id = reaction_estate.id
+        JOIN reaction ON reaction_estate.reaction_id = reaction.id
+        JOIN reaction_connectivity ON reaction.conn_id = reaction_connectivity.id
+        WHERE geometry_status = 'pending'
+        ORDER BY reaction_ts.id
+        LIMIT 1;
+    """
+    query_string2 = """
+        UPDATE reaction_ts SET geometry_status = 'running', geometry_claimed_at = now()
+        FROM reaction_estate, reaction
+        WHERE reaction_ts.estate_id = reaction_estate.id
+        AND reaction_estate.reaction_id = reaction.id
+        AND reaction.conn_id = %s
+        AND geometry_status = 'pending'
+        RETURNING reaction_ts.id, reaction_ts.amchi;
+    """
+    query_string3 = """
+        UPDATE reaction_ts SET geometry = %(geometry)s, geometry_status = %(status)s
+        WHERE id = %(id)s AND geometry_status = 'running';
+    """
+
+    count = 0
+    for _ in range(limit):
+        with pg_connection() as conn:
+            with pg_cursor(conn) as cursor:
+                cursor.execute(query_string1)
+                conn_row = cursor.fetchone()
+                if conn_row is None:
+                    break
+
+                cursor.execute(query_string2, [conn_row["id"]])
+                ts_rows = cursor.fetchall()
+
+        # Another worker claimed them first
+        if not ts_rows:
+            continue
+
+        achs = [r["amchi"] for r in ts_rows]
+        try:
+            geo_dct = _sandbox.run(chem.ts_geometries, conn_row["conn_smiles"], achs)
+        except Exception as exc:
+            logger.warning(
+                "Generating TS geometries for %s failed: %s",
+                conn_row["conn_smiles"],
+                exc,
+            )
+            geo_dct = {}
+
+        query_params3 = [
+            {
+                "id": r["id"],
+                "geometry": geo_dct.get(r["amchi"]),
+                "status": "ready" if r["amchi"] in geo_dct else "failed",
+            }
+            for r in ts_rows
+        ]
+        with pg_connection() as conn:
+            with pg_cursor(conn) as cursor:
+                cursor.executemany(query_string3, query_params3)
+
+        count += len(geo_dct)
+
+    return count
+
+
+def reset_interrupted_geometries(stale_after: float) -> int:
+    """Return TSs and species that were claimed by a worker that stopped to the pending
+    state
+
+    A claim counts as interrupted once it is older than `stale_after`, so this is safe
+    to call while other workers are running, as long as none of them takes that long
+    to work through one reaction connectivity or species
+
+    :param stale_after: How long a TS or species can stay claimed, in seconds
+    :type stale_after: float
+    :return: The number of TSs and species that were reset
+    :rtype: int
+    """
+    count = 0
+    with pg_connection() as conn:
+        with pg_cursor(conn) as cursor:
+            for table_name in ("reaction_ts", "species"):
+                query_string = f"""
+                    UPDATE {table_name}
+                    SET geometry_status = 'pending', geometry_claimed_at = NULL
+                    WHERE geometry_status = 'running'
+                    AND (
+                        geometry_claimed_at IS NULL
+                        OR geometry_claimed_at < now() - make_interval(secs => %s)
+                    );
+                """
+                cursor.execute(query_string, [stale_after])
+                count += cursor.rowcount
+
+    return count
+
+
 # COLLECTIONS TABLES
 def get_user_collections(user_id: int) -> List[dict]:
     """Get the collections associated with a user
@@ -1178,6 +1660,7 @@ def get_collection_species_data(coll_id: int) -> List[dict]:
             cursor.execute(query_string, query_params)
             species_rows = cursor.fetchall()
 
+    species_rows = rows_with_xyz_geometries(species_rows)
     return sort_rows_by_formula(species_rows)
 
 
@@ -1202,6 +1685,7 @@ def get_collection_reactions_data(coll_id: int) -> List[dict]:
                     MAX(reaction_estate.spin_mult) AS spin_mult,
                     -- TS columns
                     ARRAY_AGG(reaction_ts.geometry) AS geometries,
+                    ARRAY_AGG(reaction_ts.geometry_status) AS geometry_statuses,
                     ARRAY_AGG(reaction_ts.class) AS classes,
                     ARRAY_AGG(reaction_ts.amchi) AS amchis
                 FROM collection_reactions
@@ -1262,20 +1746,76 @@ def get_collection_reactions_data(coll_id: int) -> List[dict]:
             cursor.execute(query_string3, query_params)
             rxn_p_rows = cursor.fetchall()
 
+    rxn_rows = rows_with_xyz_geometries(rxn_rows)
     for rxn_row, rxn_r_row, rxn_p_row in zip(rxn_rows, rxn_r_rows, rxn_p_rows):
         # Add reactant information
         rxn_row.update(**rxn_r_row, **rxn_p_row)
         # Zip TS information
         geometries = rxn_row.pop("geometries")
+        statuses = rxn_row.pop("geometry_statuses")
         classes = rxn_row.pop("classes")
         amchis = rxn_row.pop("amchis")
         rxn_row["transition_states"] = list(
-            {"geometry": g, "class": c, "amchi": a}
-            for (g, c, a) in zip(geometries, classes, amchis)
+            {"geometry": g, "geometry_status": s, "class": c, "amchi": a}
+            for (g, s, c, a) in zip(geometries, statuses, classes, amchis)
         )
     return sort_rows_by_formula(rxn_rows)
 
 
+def get_collection_geometries(coll_id: int) -> Tuple[List[dict], List[dict]]:
+    """Get the packed geometries of all species and TSs in a collection
+
+    Unlike the other collection data functions, this leaves the geometries packed, and
+    it leaves out species and TSs whose geometries haven't been generated
+
+    :param coll_id: The collection ID
+    :type coll_id: int
+    :return: The species rows, with keys "id", "formula", "smiles", "inchi", "amchi",
+        "spin_mult", "geometry"; and the TS rows, with keys "id", "reaction_id",
+        "formula", "smiles", "class", "amchi", "spin_mult", "geometry"
+    :rtype: Tuple[List[dict], List[dict]]
+    """
+    query_string1 = """
+        SELECT
+            species.id, formula, smiles, inchi, amchi, spin_mult, geometry
+        FROM collection_species
+        JOIN species ON species_id = species.id
+        JOIN species_estate ON species.estate_id = species_estate.id
+        JOIN species_connectivity ON species_estate.conn_id = species_connectivity.id
+        WHERE collection_species.coll_id = %s AND species.geometry IS NOT NULL
+        ORDER BY species.id;
+    """
+    query_string2 = """
+        SELECT
+            reaction_ts.id,
+            reaction.id AS reaction_id,
+            reaction_connectivity.formula,
+            reaction.smiles,
+            reaction_ts.class,
+            reaction_ts.amchi,
+            reaction_estate.spin_mult,
+            reaction_ts.geometry
+        FROM collection_reactions
+        JOIN reaction ON reaction.id = collection_reactions.reaction_id
+        JOIN reaction_connectivity ON reaction_connectivity.id = reaction.conn_id
+        JOIN reaction_estate ON reaction_estate.reaction_id = reaction.id
+        JOIN reaction_ts ON reaction_ts.estate_id = reaction_estate.id
+        WHERE collection_reactions.coll_id = %s AND reaction_ts.geometry IS NOT NULL
+        ORDER BY reaction_ts.id;
+    """
+    query_params = [coll_id]
+
+    with pg_connection() as conn:
+        with pg_cursor(conn) as cursor:
+            cursor.execute(query_string1, query_params)
+            species_rows = cursor.fetchall()
+
+            cursor.execute(query_string2, query_params)
+            ts_rows = cursor.fetchall()
+
+    return species_rows, ts_rows
+
+
 def delete_collection(coll_id: int) -> (int, str):
     """Delete one species connectivity
 
@@ -1302,7 +1842,225 @@ def delete_collection(coll_id: int) -> (int, str):
     return 0, ""
 
 
+# IDEMPOTENCY KEY TABLE
+def claim_idempotency_key(
+    user_id: int, key: str, request_hash: str, ttl: int, lease: int, limit: int
+) -> Optional[dict]:
+    """Claim an idempotency key for a request, unless it has already been claimed
+
+    The key is cleared out first if it is older than the time-to-live, or if its request
+    has run longer than the lease (its worker most likely died), along with the user's
+    oldest finished keys past the limit. Other users' expired keys are left for
+    `expire_idempotency_keys()`
+
+    :param user_id: The ID of the user making the request
+    :type user_id: int
+    :param key: The idempotency key
+    :type key: str
+    :param request_hash: A hash identifying the request, to catch reuse of a key for a
+        different request
+    :type request_hash: str
+    :param ttl: How long to keep keys, in seconds
+    :type ttl: int
+    :param lease: How long a request can hold a key before it is given up on, in seconds
+    :type lease: int
+    :param limit: The most keys to keep per user
+    :type limit: int
+    :return: None if the key was claimed, otherwise the existing row; keys:
+        "request_hash", "status" (None while in progress), "content_type", "body"
+    :rtype: Optional[dict]
+    """
+    query_string1 = """
+        DELETE FROM idempotency_key
+        WHERE user_id = %(user_id)s AND key = %(key)s AND (
+            created_at < now() - make_interval(secs => %(ttl)s)
+            OR (status IS NULL AND created_at < now() - make_interval(secs => %(lease)s))
+        );
+    """
+    query_string2 = """
+        DELETE FROM idempotency_key
+        WHERE user_id = %(user_id)s AND key IN (
+            SELECT key FROM idempotency_key
+            WHERE user_id = %(user_id)s AND status IS NOT NULL
+            ORDER BY created_at DESC OFFSET %(keep)s
+        );
+    """
+    query_string3 = """
+        INSERT INTO idempotency_key (user_id, key, request_hash) VALUES (%s, %s, %s)
+        ON CONFLICT (user_id, key) DO NOTHING
+        RETURNING user_id;
+    """
+    query_string4 = """
+        SELECT request_hash, status, content_type, body FROM idempotency_key
+        WHERE user_id = %s AND key = %s;
+    """
+
+    with pg_connection() as conn:
+        with pg_cursor(conn) as cursor:
+            cursor.execute(
+                query_string1,
+                {"user_id": user_id, "key": key, "ttl": ttl, "lease": lease},
+            )
+            cursor.execute(query_string2, {"user_id": user_id, "keep": limit - 1})
+            cursor.execute(query_string3, [user_id, key, request_hash])
+            if cursor.fetchone() is not None:
+                return None
+
+            cursor.execute(query_string4, [user_id, key])
+            return cursor.fetchone()
+
+
+def expire_idempotency_keys(ttl: int, lease: int) -> int:
+    """Clear out the idempotency keys of all users that are older than the time-to-live,
+    and the claims whose requests have run longer than the lease
+
+    :param ttl: How long to keep keys, in seconds
+    :type ttl: int
+    :param lease: How long a request can hold a key before it is given up on, in seconds
+    :type lease: int
+    :return: The number of keys that were cleared out
+    :rtype: int
+    """
+    query_string = """
+        DELETE FROM idempotency_key
+        WHERE created_at < now() - make_interval(secs => %(ttl)s)
+        OR (status IS NULL AND created_at < now() - make_interval(secs => %(lease)s));
+    """
+
+    with pg_connection() as conn:
+        with pg_cursor(conn) as cursor:
+            cursor.execute(query_string, {"ttl": ttl, "lease": lease})
+            return cursor.rowcount
+
+
+def save_idempotent_response(
+    user_id: int, key: str, status: int, content_type: str, body: bytes
+):
+    """Save the response to a request with a claimed idempotency key
+
+    :param user_id: The ID of the user making the request
+    :type user_id: int
+    :param key: The idempotency key
+    :type key: str
+    :param status: The response status code
+    :type status: int
+    :param content_type: The response content type
+    :type content_type: str
+    :param body: The response body
+    :type body: bytes
+    """
+    query_string = """
+        UPDATE idempotency_key SET status = %s, content_type = %s, body = %s
+        WHERE user_id = %s AND key = %s;
+    """
+    query_params = [status, content_type, body, user_id, key]
+
+    with pg_connection() as conn:
+        with pg_cursor(conn) as cursor:
+            cursor.execute(query_string, query_params)
+
+
+def release_idempotency_key(user_id: int, key: str):
+    """Release a claimed idempotency key, so that the request can be retried
+
+    :param user_id: The ID of the user making the request
+    :type user_id: int
+    :param key: The idempotency key
+    :type key: str
+    """
+    query_string = """
+        DELETE FROM idempotency_key WHERE user_id = %s AND key = %s;
+    """
+
+    with pg_connection() as conn:
+        with pg_cursor(conn) as cursor:
+            cursor.execute(query_string, [user_id, key])
+
+
+# CACHE VALIDATION TABLES
+def get_table_generations(table_names: List[str]) -> dict:
+    """Get the current generation counters for some tables
+
+    The generation of a table changes whenever a statement modifies it, so these can be
+    used to tell whether data derived from the tables might have changed
+
+    :param table_names: The names of the tables
+    :type table_names: List[str]
+    :return: The generation of each table, by name; tables that have never been
+        modified are reported with generation 0
+    :rtype: dict
+    """
+    query_string = """
+        SELECT table_name, SUM(generation)::BIGINT AS generation
+        FROM table_generation_log
+        WHERE table_name = ANY(%s)
+        GROUP BY table_name;
+    """
+    query_params = [list(table_names)]
+
+    with pg_connection() as conn:
+        with pg_cursor(conn) as cursor:
+            cursor.execute(query_string, query_params)
+            gen_rows = cursor.fetchall()
+
+    gen_dct = dict.fromkeys(table_names, 0)
+    gen_dct.update({r["table_name"]: r["generation"] for r in gen_rows})
+    return gen_dct
+
+
+def prune_table_generations() -> int:
+    """Collapse the table generation log to one row per table
+
+    Each table's rows are replaced by one row holding their sum, which leaves its
+    generation unchanged. Rows logged by writes that commit in the meantime are left for
+    next time.
+
+    :return: The number of rows that were removed
+    :rtype: int
+    """
+    query_string = """
+        WITH pruned AS (
+            DELETE FROM table_generation_log RETURNING table_name, generation
+        ), kept AS (
+            INSERT INTO table_generation_log (table_name, generation)
+            SELECT table_name, SUM(generation) FROM pruned GROUP BY table_name
+            RETURNING table_name
+        )
+        SELECT (SELECT COUNT(*) FROM pruned) - (SELECT COUNT(*) FROM kept) AS count;
+    """
+
+    with pg_connection() as conn:
+        with pg_cursor(conn) as cursor:
+            cursor.execute(query_string)
+            row = cursor.fetchone()
+
+    return row["count"]
+
+
 # helpers
+def rows_with_xyz_geometries(rows: List[dict]) -> List[dict]:
+    """Render the packed geometries in table rows as xyz strings
+
+    Handles single geometries ("geometry") and aggregated ones ("geometries")
+
+    :param rows: Table rows, as dictionaries
+    :type rows: List[dict]
+    :return: The rows, with geometries in xyz format
+    :rtype: List[dict]
+    """
+
+    def _xyz_string(geo_data):
+        return None if geo_data is None else geometry.xyz_string(geo_data)
+
+    for row in rows:
+        if "geometry" in row:
+            row["geometry"] = _xyz_string(row["geometry"])
+        if "geometries" in row:
+            row["geometries"] = list(map(_xyz_string, row["geometries"]))
+
+    return rows
+
+
 def results_from_executemany(cursor, id_only=False):
     query_results = []
     while True:
@@ -1315,6 +2073,7 @@ def results_from_executemany(cursor, id_only=False):
     return query_results
 
 
+@_timing.timed("sort")
 def sort_rows_by_formula(rows):
     """Sort rows by formula
 
@@ -49,8 +49,10 @@ def array_literal(seq: list) -> str:
 def is_nonstring_sequence(obj) -> bool:
     """Is this object a non-string sequence?
 
+    Byte strings don't count as sequences either
+
     :param obj: Any object
     :return: `True` if it is, `False` if it isn't
     :rtype: bool
     """
-    return isinstance(obj, Sequence) and not isinstance(obj, str)
+    return isinstance(obj, Sequence) and not isinstance(obj, (str, bytes))
@@ -0,0 +1,90 @@
+"""Background worker that generates deferred geometries
+
+Fills in the TS geometries that were left out of reaction submissions (with
+`DEFER_TS_GEOMETRIES`) and the species geometries that were left out of species
+submissions (with `STEREO_LAZY`), so that submissions can return without waiting for
+them.
+
+Any number of workers can run at once. A worker that stops partway through a batch
+leaves its claims "running"; they are returned to the queue once they are older than
+`GEOMETRY_LEASE` seconds.
+
+Each batch also prunes the table generation log, which grows by a row with every write.
+
+Usage:
+    python -m flame_data.worker [--batch 10] [--interval 5] [--once]
+"""
+
+import argparse
+import logging
+import os
+import signal
+import threading
+
+import dotenv
+
+from flame_data import query
+
+dotenv.load_dotenv()
+
+LEASE = float(os.getenv("GEOMETRY_LEASE", "900"))
+
+logger = logging.getLogger("flame_data.worker")
+
+
+def run_once(batch: int) -> int:
+    """Fill in one batch of deferred geometries
+
+    :param batch: The maximum number of reaction connectivities and species to fill in
+    :type batch: int
+    :return: The number of geometries that were filled in
+    :rtype: int
+    """
+    reset_count = query.reset_interrupted_geometries(LEASE)
+    if reset_count:
+        logger.info("Reset %d geometries whose claims went stale", reset_count)
+
+    pruned_count = query.prune_table_generations()
+    if pruned_count:
+        logger.debug("Pruned %d table generation log rows", pruned_count)
+
+    ts_count = query.fill_pending_ts_geometries(batch)
+    spc_count = query.fill_pending_species_geometries(batch)
+    if ts_count or spc_count:
+        logger.info("Filled in %d TS and %d species geometries", ts_count, spc_count)
+    return ts_count + spc_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch", type=int, default=10)
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=5.0,
+        help="How long to wait when there is nothing to do, in seconds",
+    )
+    parser.add_argument(
+        "--once", action="store_true", help="Fill in one batch, then exit"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+
+    # Finish the current batch before exiting
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+
+    while not stopping.is_set():
+        count = run_once(args.batch)
+        if args.once:
+            break
+        if not count:
+            stopping.wait(args.interval)
+
+
+if __name__ == "__main__":
+    main()
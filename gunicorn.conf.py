@@ -0,0 +1,38 @@
+"""Gunicorn settings, read automatically when gunicorn is run from this directory
+
+Sets the number of workers and threads, and sets up a shared directory for the
+Prometheus metrics of all worker processes (see `flame_data/_metrics.py`)
+"""
+
+import os
+import shutil
+import tempfile
+
+# Each worker serves requests on several threads, so that a request waiting for an
+# admission slot doesn't hold up the whole worker. The admission budgets are sized from
+# these (see `flame_data/_admission.py`), so set them through the environment rather
+# than with `-w` or `--threads`.
+workers = int(os.environ.setdefault("WEB_CONCURRENCY", "2"))
+threads = int(os.environ.setdefault("GUNICORN_THREADS", "4"))
+
+# Must be set before anything imports prometheus_client, which decides whether to
+# write its values to files when it is first imported, and before the workers fork
+metrics_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.join(tempfile.gettempdir(), "flame_data_metrics"),
+)
+
+
+def on_starting(server):
+    # Clear out the metrics from any previous run
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,30 @@
+"""Check that the hot read queries are planned with indexes
+
+Runs the check in `benchmarks/plans.py` against the benchmark schema of the database
+configured in the environment, and is skipped when there isn't one.
+"""
+
+import os
+import sys
+
+import dotenv
+import pytest
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "benchmarks")
+sys.path.insert(0, BENCHMARKS_DIR)
+
+dotenv.load_dotenv()
+
+pytestmark = pytest.mark.skipif(
+    not all(os.getenv(v) for v in ("DB_USER", "DB_HOST", "DB_NAME")),
+    reason="DB_USER, DB_HOST and DB_NAME must be set to check query plans",
+)
+
+
+def test_hot_queries_use_indexes():
+    import plans
+
+    results = plans.check(size=10)
+
+    seq_scan_dct = {name: tables for name, (tables, _) in results.items() if tables}
+    assert not seq_scan_dct, f"Sequential scans: {seq_scan_dct}"